@@ -1,34 +1,114 @@
 import os
+
+# Realtime chat: run directly, the app serves Socket.IO on eventlet (or gevent) so one process
+# can hold thousands of idle connections. The stdlib must be patched before anything imports
+# socket/threading, hence this sits above every other import. Under gunicorn, use a cooperative
+# worker instead (gunicorn -k eventlet -w 1 app:app), which patches for us.
+# SOCKETIO_ASYNC_MODE=threading forces plain threads.
+SOCKETIO_ASYNC_MODE = os.environ.get('SOCKETIO_ASYNC_MODE')
+if __name__ == '__main__' and SOCKETIO_ASYNC_MODE is None:
+    try:
+        import eventlet
+        eventlet.monkey_patch()
+        SOCKETIO_ASYNC_MODE = 'eventlet'
+    except ImportError:
+        try:
+            from gevent import monkey
+            monkey.patch_all()
+            SOCKETIO_ASYNC_MODE = 'gevent'
+        except ImportError:
+            SOCKETIO_ASYNC_MODE = 'threading'
+
 import re
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from flask_socketio import SocketIO, emit, join_room, leave_room
+from socketio import PubSubManager
+import sqlite3
+from markupsafe import Markup, escape
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate # Import Migrate
 from sqlalchemy.exc import IntegrityError
 import json # For handling JSON data
+import base64
+import hashlib
+import tempfile
+import csv
+import io
+import threading
+import time
 import pytz
 from datetime import datetime
 from flask_login import LoginManager, login_required, current_user, UserMixin, login_user, logout_user
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
 from werkzeug.utils import secure_filename
 from flask_uploads import UploadSet, configure_uploads, DOCUMENTS, IMAGES, ALL
 from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import RequestEntityTooLarge
+from flask import Request, send_from_directory
 import smtplib
 from email.message import EmailMessage
-from PIL import Image
-# import pytesseract # Uncomment if you have pytesseract installed and configured
-# import PyPDF2 # Uncomment if you have PyPDF2 installed
-# import docx # Uncomment if you have python-docx installed
+from PIL import Image, ImageOps
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import click
+from cachetools import TLRUCache
+import mimetypes
+import zipfile
+import struct
+import uuid
+import zlib
+from functools import partial
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree import ElementTree
+# Document/OCR libraries are optional; extraction falls back or reports what is missing
+try:
+    import fitz # PyMuPDF
+except ImportError:
+    fitz = None
+try:
+    import PyPDF2
+except ImportError:
+    PyPDF2 = None
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+try:
+    import docx # python-docx
+except ImportError:
+    docx = None
+try:
+    import pytesseract
+except ImportError:
+    pytesseract = None
+try:
+    import fcntl # Locks the chat journal to one process; not available on Windows
+except ImportError:
+    fcntl = None
 
 # Initialize the Flask application
 app = Flask(__name__)
 
 # --- Configuration ---
 app.config['SECRET_KEY'] = 'fdtygt5e5re4ere43rt435erdrs34e56fdrde3w22121234567ytgytuih8uijhu87y6fvb' # A strong, unique secret key
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///o.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///o.db') # Tests point this at a scratch database
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False # Recommended to disable
 app.config['UPLOAD_FOLDER'] = os.path.join(os.getcwd(), 'static', 'uploads') # Absolute path for file uploads
+app.config['MAX_CONTENT_LENGTH'] = 32 * 1024 * 1024 # Whole request; larger bodies get 413 before they are read
+
+# Outgoing mail. For local testing point it at a debugging server, e.g.
+#   python -m aiosmtpd -n -l localhost:1025   (pip install aiosmtpd; the stdlib smtpd is gone in 3.12)
+# with MAIL_SERVER=localhost MAIL_PORT=1025 MAIL_USE_SSL=0 and no MAIL_USERNAME.
+app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
+app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 465))
+app.config['MAIL_USE_SSL'] = os.environ.get('MAIL_USE_SSL', '1') == '1'
+app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', '0') == '1' # STARTTLS, when MAIL_USE_SSL is off
+app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME', 'yourgmail@gmail.com') # Replace with your actual Gmail credentials
+app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD', 'your_app_password') # App Password if 2FA is enabled
+app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER', app.config['MAIL_USERNAME'] or 'noreply@localhost')
 
 # Configure Flask-Uploads
 app.config['UPLOADED_PROJECTS_DEST'] = os.path.join(app.root_path, 'static', 'project_uploads') # Separate folder for project files
@@ -42,6 +122,88 @@ os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True) # Ensure this also exist
 
 # Initialize extensions
 db = SQLAlchemy(app)
+
+# --- Multi-worker Socket.IO ---
+# A room emit only reaches sockets held by the process that makes it. To run several
+# Socket.IO workers (one per core, behind a load balancer with sticky sessions, e.g.
+# nginx ip_hash), set SOCKETIO_MESSAGE_QUEUE so every emit is shared through a queue:
+#   redis://localhost:6379/0, amqp://..., kafka://..., zmq+tcp://... -> python-socketio's managers
+#   sqlite:// (or sqlite:////path/to/queue.db) -> SQLiteQueueManager below, no outside service
+# e.g. SOCKETIO_MESSAGE_QUEUE=sqlite:// PORT=5001 python app.py, likewise on 5002, ...
+# Unset, the gateway stays single-process.
+SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+SOCKETIO_CHANNEL = 'flask-socketio'
+SOCKETIO_QUEUE_POLL_SECONDS = 0.01
+SOCKETIO_QUEUE_RETENTION_SECONDS = 60
+
+
+class SQLiteQueueManager(PubSubManager):
+    """
+    Socket.IO client manager that shares emits between processes on one machine through
+    a small SQLite file (WAL mode, separate from the application database so chat writes
+    never wait on it). Each process polls for rows newer than the last it has seen;
+    rows older than SOCKETIO_QUEUE_RETENTION_SECONDS are pruned.
+    """
+    name = 'sqlite'
+
+    def __init__(self, url='sqlite://', channel=SOCKETIO_CHANNEL, write_only=False, logger=None, json=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        self.path = url[len('sqlite:///'):] if url.startswith('sqlite:///') else os.path.join(app.instance_path, 'socketio-queue.db')
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL') # Messages are transient; no fsync per emit
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS socketio_queue ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT NOT NULL, payload TEXT NOT NULL, created_at REAL NOT NULL)'
+            )
+
+    def _publish(self, data):
+        payload = self.json.dumps(data) # Binary attachments arrive base64-encoded from PubSubManager.emit
+        with self._lock:
+            self._conn.execute('INSERT INTO socketio_queue (channel, payload, created_at) VALUES (?, ?, ?)',
+                               (self.channel, payload, time.time()))
+
+    def _listen(self):
+        # AUTOINCREMENT never reuses ids and each insert commits on its own, so "id > last seen" misses nothing
+        with self._lock:
+            last_id = self._conn.execute('SELECT COALESCE(MAX(id), 0) FROM socketio_queue').fetchone()[0]
+        next_prune = time.monotonic()
+        while True:
+            with self._lock:
+                rows = self._conn.execute('SELECT id, payload FROM socketio_queue WHERE id > ? AND channel = ? ORDER BY id',
+                                          (last_id, self.channel)).fetchall()
+                if time.monotonic() >= next_prune:
+                    self._conn.execute('DELETE FROM socketio_queue WHERE created_at < ?',
+                                       (time.time() - SOCKETIO_QUEUE_RETENTION_SECONDS,))
+                    next_prune = time.monotonic() + SOCKETIO_QUEUE_RETENTION_SECONDS
+            for row_id, payload in rows:
+                last_id = row_id
+                yield payload
+            if not rows:
+                self.server.sleep(SOCKETIO_QUEUE_POLL_SECONDS)
+
+
+def socketio_queue_options(url):
+    """SocketIO() keyword arguments for a SOCKETIO_MESSAGE_QUEUE url (none when unset)."""
+    if not url:
+        return {}
+    if url.startswith('sqlite:'):
+        return {'client_manager': SQLiteQueueManager(url)}
+    return {'message_queue': url, 'channel': SOCKETIO_CHANNEL}
+
+
+# async_mode None lets Flask-SocketIO pick eventlet/gevent when the server (e.g. gunicorn) runs them
+socketio = SocketIO(
+    app,
+    async_mode=SOCKETIO_ASYNC_MODE,
+    max_http_buffer_size=64 * 1024, # Encrypted chat messages are small; cap what one event may carry
+    ping_interval=25, # Idle connections cost one ping every 25s
+    ping_timeout=20,
+    **socketio_queue_options(SOCKETIO_MESSAGE_QUEUE)
+)
 migrate = Migrate(app, db) # Initialize Flask-Migrate
 
 # --- CONSOLIDATED FLASK-LOGIN SETUP ---
@@ -154,12 +316,27 @@ class ElectoralCandidate(db.Model):
 
 
 
+def conversation_key(user_a, user_b):
+    """Canonical id of the conversation between two users: the same whichever of them sent."""
+    low, high = sorted((int(user_a), int(user_b)))
+    return f'{low}:{high}'
+
+
+def _conversation_id_default(context):
+    params = context.get_current_parameters()
+    return conversation_key(params['sender_id'], params['recipient_id'])
+
+
 class Message(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     recipient_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     encrypted_content = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    conversation_id = db.Column(db.String(40), nullable=False, default=_conversation_id_default) # "<low id>:<high id>"
+
+    # History pages are one seek on (conversation, newest first)
+    __table_args__ = (db.Index('ix_message_conversation_timestamp_id', 'conversation_id', 'timestamp', 'id'),)
 
     # Define relationships here using back_populates
     # 'sender' on Message will link back to 'sent_messages' on User
@@ -203,14 +380,39 @@ class PrivateChat(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     recipient_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    # Store the encrypted message as TEXT. It includes the ciphertext and nonce.
-    encrypted_content = db.Column(db.Text, nullable=False)
+    # Envelope version 0: legacy JSON text {ciphertext, nonce} (base64) in encrypted_content.
+    # Envelope version 1: the raw crypto_box ciphertext and its 24-byte nonce as BLOBs.
+    encrypted_content = db.Column(db.Text, nullable=False, default='')
+    ciphertext = db.Column(db.LargeBinary, nullable=True)
+    nonce = db.Column(db.LargeBinary(24), nullable=True)
+    envelope_version = db.Column(db.SmallInteger, nullable=False, default=1)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    conversation_id = db.Column(db.String(40), nullable=False, default=_conversation_id_default) # "<low id>:<high id>"
+    # Assigned by the gateway before the row is written (see ChatWriteBehind); makes journal replay idempotent
+    message_uid = db.Column(db.String(32), nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_private_chat_conversation_timestamp_id', 'conversation_id', 'timestamp', 'id'),
+        db.Index('ux_private_chat_message_uid', 'message_uid', unique=True),
+        # Delta sync reads "everything in this conversation after id N"
+        db.Index('ix_private_chat_conversation_id_id', 'conversation_id', 'id'),
+    )
 
     def __repr__(self):
         return f'<PrivateChat from {self.sender_id} to {self.recipient_id} at {self.timestamp}>'
 
 
+class ChatSyncState(db.Model):
+    """The newest PrivateChat id each user has acknowledged per conversation (see the sync_* socket events)."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    conversation_id = db.Column(db.String(40), nullable=False)
+    last_acked_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('user_id', 'conversation_id', name='_chat_sync_user_conversation_uc'),)
+
+
 # New Rating Model
 class Rating(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -233,11 +435,22 @@ class ProjectIdea(db.Model):
     innovations = db.Column(db.Text, nullable=True)
     file_paths = db.Column(db.Text, nullable=True) # Store comma-separated file paths
     contact_email = db.Column(db.String(100), nullable=False)
-    submission_date = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
+    # Set in Python: SQLite's CURRENT_TIMESTAMP has no fractional part, so it wouldn't compare equal to the datetimes keyset cursors bind
+    submission_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     visibility = db.Column(db.String(10), nullable=False, default='public') # 'public' or 'private'
 
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True) # Assume nullable for now
 
+    __table_args__ = (
+        # Keyset pagination for the project catalog: newest first, id breaks ties
+        db.Index('ix_project_idea_submission_id', 'submission_date', 'id'),
+        db.Index('ix_project_idea_user_submission_id', 'user_id', 'submission_date', 'id'),
+    )
+
+    # selectin: tags for a whole page of projects load in one extra query
+    tags = db.relationship('Tag', secondary='project_tags', lazy='selectin', order_by='Tag.name',
+                           backref=db.backref('projects', lazy='dynamic'))
+
     def __repr__(self):
         return f"ProjectIdea('{self.title}', '{self.submission_date}')"
 
@@ -313,12 +526,40 @@ class StudentResult(db.Model):
     total_score = db.Column(db.Integer, nullable=False)
     grade = db.Column(db.String(5), nullable=False)
 
-    __table_args__ = (db.UniqueConstraint('course_id', 'reg_number', name='_course_reg_number_uc'),)
+    __table_args__ = (
+        db.UniqueConstraint('course_id', 'reg_number', name='_course_reg_number_uc'),
+        # Keyset pagination indexes for the admin result listing: (sort column, id)
+        db.Index('ix_student_result_reg_number_id', 'reg_number', 'id'),
+        db.Index('ix_student_result_total_score_id', 'total_score', 'id'),
+    )
 
     def __repr__(self):
         return f"StudentResult(RegNo: {self.reg_number}, Course: {self.course.course_code if self.course else 'N/A'}, Total: {self.total_score}, Grade: {self.grade})"
 
-def calculate_grade(total_score):
+class GradingScale(db.Model):
+    """Grade cut-offs for one academic session. Sessions without a row use DEFAULT_GRADE_BOUNDARIES."""
+    id = db.Column(db.Integer, primary_key=True)
+    session_written = db.Column(db.String(50), unique=True, nullable=False)
+    boundaries = db.Column(db.Text, nullable=False) # JSON list of [minimum_total, grade], e.g. [[70, "A"], [60, "B"]]
+    fail_grade = db.Column(db.String(5), nullable=False, default='F')
+
+    def __repr__(self):
+        return f"GradingScale(Session: {self.session_written}, Boundaries: {self.boundaries})"
+
+
+# Minimum total for each grade; anything below the last cut-off gets the fail grade
+DEFAULT_GRADE_BOUNDARIES = [(70, 'A'), (60, 'B'), (50, 'C'), (45, 'D'), (40, 'E')]
+DEFAULT_FAIL_GRADE = 'F'
+CA_SCORE_MAX = 30
+EXAM_SCORE_MAX = 70
+
+def calculate_grade(total_score, scale=None):
+    if scale is not None:
+        for cutoff, grade in scale['boundaries']:
+            if total_score >= cutoff:
+                return grade
+        return scale['fail_grade']
+
     if total_score >= 70:
         return 'A'
     elif total_score >= 60:
@@ -332,10 +573,323 @@ def calculate_grade(total_score):
     else:
         return 'F'
 
+def build_grading_scale(boundaries, fail_grade=DEFAULT_FAIL_GRADE):
+    """
+    Turns [(minimum_total, grade), ...] into the lookup structure used by
+    calculate_grade (boundaries, highest first) and grade_result_batch
+    (ascending cut-offs plus one grade per searchsorted bucket).
+    """
+    ascending = sorted((float(cutoff), grade) for cutoff, grade in boundaries)
+    return {
+        'boundaries': list(reversed(ascending)),
+        'fail_grade': fail_grade,
+        'cutoffs': np.array([cutoff for cutoff, _ in ascending], dtype=float),
+        'grades': np.array([fail_grade] + [grade for _, grade in ascending], dtype=object)
+    }
+
+def get_grading_scale(session_written):
+    """Returns the grading scale for a session, falling back to the standard 70/60/50/45/40 cut-offs."""
+    custom_scale = GradingScale.query.filter_by(session_written=session_written).first() if session_written else None
+    if custom_scale:
+        return build_grading_scale(json.loads(custom_scale.boundaries), custom_scale.fail_grade)
+    return build_grading_scale(DEFAULT_GRADE_BOUNDARIES, DEFAULT_FAIL_GRADE)
+
+def grade_result_batch(ca_scores, exam_scores, scale=None):
+    """
+    Validates and grades a whole batch of scores in one vectorized pass.
+
+    Returns a dict of arrays, one entry per student:
+      ca_valid / exam_valid - score is inside 0-30 / 0-70
+      totals                - ca + exam, uncapped
+      capped_totals         - totals capped at 100
+      grades                - grade for the capped total (searchsorted over the scale's cut-offs)
+    """
+    if scale is None:
+        scale = build_grading_scale(DEFAULT_GRADE_BOUNDARIES, DEFAULT_FAIL_GRADE)
+    ca = np.asarray(ca_scores, dtype=float)
+    exam = np.asarray(exam_scores, dtype=float)
+
+    totals = ca + exam
+    capped_totals = np.minimum(totals, 100)
+    grade_index = np.searchsorted(scale['cutoffs'], capped_totals, side='right')
+    return {
+        'ca_valid': (ca >= 0) & (ca <= CA_SCORE_MAX),
+        'exam_valid': (exam >= 0) & (exam <= EXAM_SCORE_MAX),
+        'totals': totals,
+        'capped_totals': capped_totals,
+        'grades': scale['grades'][grade_index]
+    }
+
 def parse_bulk_input(input_string):
     return [item.strip() for item in re.split(r'[\n,]+', input_string) if item.strip()]
 
 
+# How many result rows go into one executemany() call during bulk upload
+RESULT_UPSERT_BATCH_SIZE = 500
+
+def _student_result_upsert_statement():
+    """
+    Builds an INSERT ... ON CONFLICT statement for StudentResult that updates the
+    row already holding the same (course_id, reg_number) pair (_course_reg_number_uc).
+    """
+    table = StudentResult.__table__
+    update_columns = ('student_name', 'ca_score', 'exam_score', 'total_score', 'grade')
+    dialect = db.engine.dialect.name
+
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert as dialect_insert
+        stmt = dialect_insert(table)
+        return stmt.on_duplicate_key_update({col: stmt.inserted[col] for col in update_columns})
+
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    stmt = dialect_insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=['course_id', 'reg_number'],
+        set_={col: stmt.excluded[col] for col in update_columns}
+    )
+
+def get_existing_result_reg_numbers(course_id):
+    """Returns the set of reg numbers that already have a result for this course (one query)."""
+    return {
+        reg_number for (reg_number,) in db.session.query(StudentResult.reg_number)
+        .filter(StudentResult.course_id == course_id).all()
+    }
+
+def bulk_upsert_student_results(course_id, students_data, existing_reg_numbers=None, seen_in_upload=None):
+    """
+    Writes all results for one course as batched upserts.
+    Existing rows for the course are fetched in a single query so we can tell
+    inserts from updates, and rows that can't be stored are reported per entry
+    instead of aborting the whole upload.
+    The caller owns the transaction and must commit (or roll back) afterwards.
+
+    When a large sheet is written chunk by chunk, pass the same
+    existing_reg_numbers set and seen_in_upload dict to every call so the
+    course is only scanned once and duplicates are caught across chunks.
+
+    Returns (added_count, updated_count, failures) where failures is a list of
+    (entry_number, message) tuples.
+    """
+    if existing_reg_numbers is None:
+        existing_reg_numbers = get_existing_result_reg_numbers(course_id)
+    if seen_in_upload is None:
+        seen_in_upload = {}
+
+    name_limit = StudentResult.__table__.c.student_name.type.length
+    reg_limit = StudentResult.__table__.c.reg_number.type.length
+
+    rows = []
+    failures = []
+    added_count = 0
+    updated_count = 0
+    for position, student_data in enumerate(students_data, start=1):
+        entry = student_data.get('entry', position)
+        reg_number = student_data['reg_number']
+        if len(reg_number) > reg_limit:
+            failures.append((entry, f"Registration number '{reg_number}' is longer than {reg_limit} characters."))
+            continue
+        if len(student_data['name']) > name_limit:
+            failures.append((entry, f"Student name for '{reg_number}' is longer than {name_limit} characters."))
+            continue
+        if reg_number in seen_in_upload:
+            failures.append((entry, f"Duplicate entry: '{reg_number}' already appears at entry {seen_in_upload[reg_number]} of this upload."))
+            continue
+        seen_in_upload[reg_number] = entry
+
+        if reg_number in existing_reg_numbers:
+            updated_count += 1
+        else:
+            added_count += 1
+        rows.append({
+            'course_id': course_id,
+            'student_name': student_data['name'],
+            'reg_number': reg_number,
+            'ca_score': student_data['ca_score'],
+            'exam_score': student_data['exam_score'],
+            'total_score': student_data['total_score'],
+            'grade': student_data['grade']
+        })
+
+    if rows:
+        stmt = _student_result_upsert_statement()
+        for start in range(0, len(rows), RESULT_UPSERT_BATCH_SIZE):
+            db.session.execute(stmt, rows[start:start + RESULT_UPSERT_BATCH_SIZE])
+
+    return added_count, updated_count, failures
+
+
+# --- Result sheet import pipeline ---
+# Rows flow through small generators (read -> validate -> chunk) so a sheet
+# with tens of thousands of students never has to sit in memory at once.
+RESULT_SHEET_EXTENSIONS = {'csv', 'xlsx'}
+RESULT_IMPORT_CHUNK_SIZE = 1000 # Valid rows written per upsert batch
+RESULT_REPORT_MAX_ISSUES = 200 # Errors/warnings kept for display; the rest are only counted
+
+def new_result_import_report():
+    return {
+        'processed': 0,
+        'added': 0,
+        'updated': 0,
+        'skipped': 0,
+        'errors': [],
+        'warnings': [],
+        'hidden_issues': 0
+    }
+
+def add_result_report_issue(report, kind, entry, message):
+    """Records an error or warning, keeping only the first RESULT_REPORT_MAX_ISSUES for display."""
+    if len(report['errors']) + len(report['warnings']) >= RESULT_REPORT_MAX_ISSUES:
+        report['hidden_issues'] += 1
+        return
+    report[kind].append({'entry': entry, 'message': message})
+
+def _sheet_cell_text(value):
+    # XLSX cells come back typed; 2019123456.0 should read as "2019123456"
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+def iter_bulk_input_rows(names, reg_numbers, ca_scores, exam_scores):
+    """Pairs the four textarea columns by position, yielding (entry_number, cells)."""
+    for i, cells in enumerate(zip(names, reg_numbers, ca_scores, exam_scores), start=1):
+        yield i, list(cells)
+
+# Words expected in each column's title, for recognising a header row
+RESULT_SHEET_HEADER_WORDS = (
+    {'name', 'names', 'student', 'fullname'},
+    {'reg', 'regno', 'registration', 'matric', 'number', 'no'},
+    {'ca', 'continuous', 'assessment', 'test'},
+    {'exam', 'examination', 'exams'},
+)
+
+def is_result_sheet_header(cells):
+    """True when at least two of the first four cells read like the expected column titles."""
+    matches = 0
+    for cell, words in zip(cells, RESULT_SHEET_HEADER_WORDS):
+        if words & set(re.findall(r'[a-z]+', cell.lower())):
+            matches += 1
+    return matches >= 2
+
+def iter_result_sheet_rows(file_storage):
+    """
+    Streams (row_number, cells) from an uploaded CSV or XLSX result sheet, where
+    row_number is the line/row as the admin sees it in their spreadsheet.
+    Columns are expected in the order: Student Name, Reg Number, CA Score, Exam Score.
+    A first row whose cells name the columns (see is_result_sheet_header) is skipped as
+    the header; any other first row is imported, so a bad score in it is reported.
+    Blank rows are ignored.
+    """
+    extension = file_storage.filename.rsplit('.', 1)[-1].lower()
+    if extension == 'csv':
+        text_stream = io.TextIOWrapper(file_storage.stream, encoding='utf-8-sig', newline='')
+        raw_rows = csv.reader(text_stream)
+    else:
+        from openpyxl import load_workbook # Only needed for .xlsx uploads
+        workbook = load_workbook(file_storage.stream, read_only=True, data_only=True)
+        raw_rows = workbook.active.iter_rows(values_only=True)
+
+    first_row = True
+    for row_number, raw_row in enumerate(raw_rows, start=1):
+        cells = [_sheet_cell_text(value) for value in raw_row]
+        if not any(cells):
+            continue
+        if first_row:
+            first_row = False
+            if is_result_sheet_header(cells):
+                continue
+        yield row_number, cells[:4]
+
+def parse_result_rows(rows, report):
+    """Checks each row has all four values and numeric scores, yielding (entry, name, reg_number, ca, exam)."""
+    for entry, cells in rows:
+        report['processed'] += 1
+        if len(cells) < 4 or not all(cells):
+            add_result_report_issue(report, 'errors', entry, 'Missing value. Each entry needs a name, registration number, CA score and exam score.')
+            report['skipped'] += 1
+            continue
+        name, reg_number, ca_raw, exam_raw = cells
+
+        try:
+            ca = float(ca_raw)
+            exam = float(exam_raw)
+        except ValueError:
+            add_result_report_issue(report, 'errors', entry, f'Invalid score format for {name}. Scores must be numbers.')
+            report['skipped'] += 1
+            continue
+
+        yield entry, name, reg_number, ca, exam
+
+def validate_result_rows(rows, report, scale=None):
+    """
+    Applies the CA (0-30) and exam (0-70) rules and grades the rows,
+    one chunk at a time through grade_result_batch, yielding the student_data
+    dicts that passed. Problems go into the report instead of flash().
+    """
+    for chunk in chunked(parse_result_rows(rows, report), RESULT_IMPORT_CHUNK_SIZE):
+        graded = grade_result_batch([row[3] for row in chunk], [row[4] for row in chunk], scale)
+
+        for i, (entry, name, reg_number, ca, exam) in enumerate(chunk):
+            row_valid = True
+            if not graded['ca_valid'][i]:
+                add_result_report_issue(report, 'errors', entry, f'CA Score for student {name} is invalid. Must be between 0 and 30.')
+                row_valid = False
+            if not graded['exam_valid'][i]:
+                add_result_report_issue(report, 'errors', entry, f'Exam Score for student {name} is invalid. Must be between 0 and 70.')
+                row_valid = False
+            if not row_valid:
+                report['skipped'] += 1
+                continue
+
+            if graded['totals'][i] > 100:
+                add_result_report_issue(report, 'warnings', entry, f'Total score for student {name} exceeds 100 ({graded["totals"][i]}). Capped at 100.')
+
+            yield {
+                'entry': entry,
+                'name': name,
+                'reg_number': reg_number,
+                'ca_score': int(ca),
+                'exam_score': int(exam),
+                'total_score': int(graded['capped_totals'][i]),
+                'grade': graded['grades'][i]
+            }
+
+def chunked(iterable, size):
+    """Yields lists of up to `size` items from any iterable without materialising it."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def import_student_results(course_id, students, report):
+    """
+    Upserts validated student rows for a course in fixed-size chunks,
+    filling in the added/updated/skipped counts on the report.
+    """
+    existing_reg_numbers = get_existing_result_reg_numbers(course_id)
+    seen_in_upload = {}
+    for chunk in chunked(students, RESULT_IMPORT_CHUNK_SIZE):
+        added, updated, failures = bulk_upsert_student_results(
+            course_id, chunk,
+            existing_reg_numbers=existing_reg_numbers,
+            seen_in_upload=seen_in_upload
+        )
+        report['added'] += added
+        report['updated'] += updated
+        report['skipped'] += len(failures)
+        for entry, message in failures:
+            add_result_report_issue(report, 'errors', entry, message)
+    return report
+
+
 
 # The model you provided
 class ResultPublicationSchedule(db.Model):
@@ -350,9 +904,606 @@ class ResultPublicationSchedule(db.Model):
     course = db.relationship('Course', backref='scheduled_publications')
     admin = db.relationship('Admin', backref='scheduled_publications')
 
+    # Back the "which windows are open now" range scan and the per-course/session lookups
+    __table_args__ = (
+        db.Index('ix_publication_window', 'is_active', 'publish_start', 'publish_end'),
+        db.Index('ix_publication_course_session', 'course_id', 'session_written'),
+    )
+
     def __repr__(self):
         return f"ResultPublicationSchedule(Course: {self.course.course_code if self.course else 'N/A'}, Session: {self.session_written}, Start: {self.publish_start}, End: {self.publish_end})"
 
+
+# Publication times are entered and stored as Lagos wall-clock time (naive datetimes),
+# so "now" has to be compared in the same form.
+LAGOS_TZ = pytz.timezone('Africa/Lagos')
+
+def lagos_now():
+    return datetime.now(LAGOS_TZ).replace(tzinfo=None)
+
+class PublicationScheduleCache:
+    """
+    In-process copy of the publication windows that are open right now.
+    It is refreshed when the next window opens or closes, when an admin
+    changes a schedule (invalidate()), or after MAX_AGE as a safety net for
+    changes made through another worker process.
+    """
+    MAX_AGE = timedelta(seconds=60)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._windows = None
+        self._valid_until = None
+
+    def invalidate(self):
+        with self._lock:
+            self._windows = None
+
+    def open_windows(self, now=None):
+        """Returns {(course_id, session_written): {'publish_start': ..., 'publish_end': ...}} for open windows."""
+        now = now or lagos_now()
+        with self._lock:
+            if self._windows is None or now >= self._valid_until:
+                self._refresh(now)
+            return self._windows
+
+    def _refresh(self, now):
+        active_schedules = db.session.query(
+            ResultPublicationSchedule.course_id, ResultPublicationSchedule.session_written,
+            ResultPublicationSchedule.publish_start, ResultPublicationSchedule.publish_end
+        ).filter(
+            ResultPublicationSchedule.is_active == True,
+            ResultPublicationSchedule.publish_start <= now,
+            ResultPublicationSchedule.publish_end >= now
+        ).all()
+        next_opening = db.session.query(db.func.min(ResultPublicationSchedule.publish_start)).filter(
+            ResultPublicationSchedule.is_active == True,
+            ResultPublicationSchedule.publish_start > now
+        ).scalar()
+
+        self._windows = {
+            (schedule.course_id, schedule.session_written): {
+                'publish_start': schedule.publish_start,
+                'publish_end': schedule.publish_end
+            }
+            for schedule in active_schedules
+        }
+        # A window stays open through publish_end, so it closes just after it
+        boundaries = [now + self.MAX_AGE]
+        boundaries.extend(schedule.publish_end + timedelta(microseconds=1) for schedule in active_schedules)
+        if next_opening:
+            boundaries.append(next_opening)
+        self._valid_until = min(boundaries)
+
+publication_schedule_cache = PublicationScheduleCache()
+
+
+class StudentTranscript(db.Model):
+    """
+    Precomputed copy of a student's results for one session, with GPAs.
+    Rebuilt by refresh_student_transcripts() whenever their results change,
+    so the student results page reads a handful of rows instead of joining
+    StudentResult and Course on every view.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    reg_number = db.Column(db.String(50), nullable=False)
+    session_written = db.Column(db.String(50), nullable=False)
+    courses = db.Column(db.Text, nullable=False) # JSON list of per-course result rows, sorted by course code
+    semester_gpa = db.Column(db.Text, nullable=False) # JSON {semester: gpa}
+    session_gpa = db.Column(db.Float, nullable=True)
+    cgpa = db.Column(db.Float, nullable=True) # Cumulative up to and including this session
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # The unique index doubles as the (reg_number, session) lookup index
+    __table_args__ = (db.UniqueConstraint('reg_number', 'session_written', name='_transcript_reg_session_uc'),)
+
+    def __repr__(self):
+        return f"StudentTranscript(RegNo: {self.reg_number}, Session: {self.session_written}, CGPA: {self.cgpa})"
+
+
+# Grade points on the 5-point scale; grades not listed here are left out of GPA
+GRADE_POINTS = {'A': 5, 'B': 4, 'C': 3, 'D': 2, 'E': 1, 'F': 0}
+TRANSCRIPT_REFRESH_BATCH_SIZE = 500
+
+def calculate_gpa(grades):
+    """Average grade point over the given grades (every course weighted equally)."""
+    points = [GRADE_POINTS[grade] for grade in grades if grade in GRADE_POINTS]
+    return round(sum(points) / len(points), 2) if points else None
+
+def summarize_transcript_courses(courses):
+    """Returns ({semester: gpa}, session_gpa) for a list of transcript course rows."""
+    grades_by_semester = {}
+    for course in courses:
+        grades_by_semester.setdefault(course['semester'], []).append(course['grade'])
+    semester_gpa = {semester: calculate_gpa(grades) for semester, grades in sorted(grades_by_semester.items())}
+    return semester_gpa, calculate_gpa([course['grade'] for course in courses])
+
+def refresh_student_transcripts(reg_numbers, session=None):
+    """
+    Rebuilds the StudentTranscript rows for the given students from StudentResult,
+    a batch of students per query. Sessions a student no longer has results in are removed.
+    Runs inside the caller's transaction (db.session unless another session is given);
+    the caller commits.
+    """
+    session = session or db.session
+    reg_numbers = sorted(set(reg_numbers))
+    for start in range(0, len(reg_numbers), TRANSCRIPT_REFRESH_BATCH_SIZE):
+        batch = reg_numbers[start:start + TRANSCRIPT_REFRESH_BATCH_SIZE]
+
+        rows = session.query(
+            StudentResult.reg_number, StudentResult.course_id, StudentResult.ca_score,
+            StudentResult.exam_score, StudentResult.total_score, StudentResult.grade,
+            Course.course_code, Course.course_title, Course.session_written, Course.semester
+        ).join(Course, StudentResult.course_id == Course.id).filter(StudentResult.reg_number.in_(batch)).all()
+
+        courses_by_student = {}
+        for row in rows:
+            courses_by_student.setdefault(row.reg_number, {}).setdefault(row.session_written, []).append({
+                'course_id': row.course_id,
+                'course_code': row.course_code,
+                'course_title': row.course_title,
+                'semester': row.semester,
+                'ca_score': row.ca_score,
+                'exam_score': row.exam_score,
+                'total_score': row.total_score,
+                'grade': row.grade
+            })
+
+        existing = {
+            (transcript.reg_number, transcript.session_written): transcript
+            for transcript in session.query(StudentTranscript).filter(StudentTranscript.reg_number.in_(batch)).all()
+        }
+
+        for reg_number in batch:
+            cumulative_grades = []
+            sessions = courses_by_student.get(reg_number, {})
+            for session_written in sorted(sessions):
+                courses = sorted(sessions[session_written], key=lambda course: course['course_code'])
+                cumulative_grades.extend(course['grade'] for course in courses)
+                semester_gpa, session_gpa = summarize_transcript_courses(courses)
+
+                transcript = existing.pop((reg_number, session_written), None)
+                if transcript is None:
+                    transcript = StudentTranscript(reg_number=reg_number, session_written=session_written)
+                    session.add(transcript)
+                transcript.courses = json.dumps(courses)
+                transcript.semester_gpa = json.dumps(semester_gpa)
+                transcript.session_gpa = session_gpa
+                transcript.cgpa = calculate_gpa(cumulative_grades)
+
+        for stale_transcript in existing.values():
+            session.delete(stale_transcript)
+        session.flush() # Keep the session small when rebuilding a whole course
+
+
+def load_student_transcripts(reg_numbers):
+    """
+    Returns {reg_number: [transcripts in session order]}. Students who have results but no
+    transcript rows yet (results from before transcripts existed) are rebuilt on the spot.
+    """
+    def load(session, numbers):
+        transcripts = {}
+        for transcript in session.query(StudentTranscript).filter(StudentTranscript.reg_number.in_(numbers)).order_by(StudentTranscript.session_written).all():
+            transcripts.setdefault(transcript.reg_number, []).append(transcript)
+        return transcripts
+
+    reg_numbers = set(reg_numbers)
+    transcripts = load(db.session, reg_numbers)
+    missing = reg_numbers - transcripts.keys()
+    if missing:
+        missing = [reg_number for (reg_number,) in db.session.query(StudentResult.reg_number)
+                   .filter(StudentResult.reg_number.in_(missing)).distinct().all()]
+    if missing:
+        # Rebuilt and committed in a session of its own: committing db.session here would expire
+        # everything the request already loaded (one refresh query per row on next access)
+        with db.session.session_factory(expire_on_commit=False) as rebuild_session:
+            try:
+                refresh_student_transcripts(missing, rebuild_session)
+                rebuild_session.commit()
+            except IntegrityError:
+                rebuild_session.rollback() # Another request rebuilt the same student first
+            transcripts.update(load(rebuild_session, missing))
+    return transcripts
+
+
+def build_student_results_payload(fullname, reg_number, transcripts, open_windows):
+    """
+    Builds what the student results page shows from the student's transcripts,
+    keeping only courses whose publication window is open.
+    """
+    published_results = []
+    gpa_summary = []
+    all_sessions_fully_published = True
+    published_grades = []
+    for transcript in transcripts:
+        courses = json.loads(transcript.courses)
+        visible_courses = [course for course in courses if (course['course_id'], transcript.session_written) in open_windows]
+        if len(visible_courses) != len(courses):
+            all_sessions_fully_published = False
+        if not visible_courses:
+            continue
+
+        for course in visible_courses:
+            schedule = open_windows[(course['course_id'], transcript.session_written)]
+            published_results.append({
+                'course_code': course['course_code'],
+                'course_title': course['course_title'],
+                'session_written': transcript.session_written,
+                'ca_score': course['ca_score'],
+                'exam_score': course['exam_score'],
+                'total_score': course['total_score'],
+                'grade': course['grade'],
+                'publish_start': schedule['publish_start'],
+                'publish_end': schedule['publish_end']
+            })
+        published_grades.extend(course['grade'] for course in visible_courses)
+
+        # Stored GPAs cover every result; only use them when nothing is being held back
+        if all_sessions_fully_published:
+            semester_gpa, session_gpa, cgpa = json.loads(transcript.semester_gpa), transcript.session_gpa, transcript.cgpa
+        else:
+            semester_gpa, session_gpa = summarize_transcript_courses(visible_courses)
+            cgpa = calculate_gpa(published_grades)
+        gpa_summary.append({
+            'session_written': transcript.session_written,
+            'semester_gpa': semester_gpa,
+            'session_gpa': session_gpa,
+            'cgpa': cgpa
+        })
+
+    return {
+        'user': {'fullname': fullname, 'regno': reg_number},
+        'results': published_results,
+        'gpa_summary': gpa_summary
+    }
+
+
+class StudentResultsSurgeCache:
+    """
+    Release-day cache of rendered student result payloads, keyed by user id.
+
+    When the set of open publication windows changes, every eligible student's
+    payload is built in the background with a few set-based queries. Entries
+    expire at the end of the earliest open window or after MAX_AGE, whichever
+    comes first (TLRU), so results edited through another worker process show
+    up within MAX_AGE. Each entry remembers which windows it was built for, so a
+    newly opened window is never served stale. While lookups keep coming, the
+    prewarm is re-run every MAX_AGE / 2, so the age limit never empties the cache
+    mid-spike. Anything not cached falls back to the live query path.
+
+    invalidate() bumps a generation counter; payloads built from data read
+    before that (a prewarm or live build still running) are not stored.
+    """
+    MAX_ENTRIES = 20000
+    MAX_AGE = timedelta(seconds=60)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = TLRUCache(maxsize=self.MAX_ENTRIES, ttu=lambda key, value, now: value['expires_at'], timer=lagos_now)
+        self._warmed_windows = None
+        self._refresh_at = None # When the current window set's prewarm should be re-run
+        self._prewarms_running = 0
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.prewarmed = 0
+
+    @staticmethod
+    def _windows_key(open_windows):
+        return frozenset(open_windows)
+
+    def get(self, user_id, open_windows):
+        if not open_windows:
+            return None # Nothing published; the live path needs no result queries anyway
+        windows_key = self._windows_key(open_windows)
+        now = lagos_now()
+        payload = None
+        start_prewarm = False
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry['windows'] == windows_key:
+                self.hits += 1
+                payload = entry['payload']
+            else:
+                self.misses += 1
+            if self._warmed_windows != windows_key or (now >= self._refresh_at and not self._prewarms_running):
+                self._warmed_windows = windows_key
+                self._refresh_at = now + self.MAX_AGE / 2 # Replaced before the entries it builds expire
+                self._prewarms_running += 1
+                start_prewarm = True
+        if start_prewarm:
+            threading.Thread(target=self._prewarm_in_background, args=(open_windows,), daemon=True).start()
+        return payload
+
+    def generation(self):
+        """Read this before loading the data a payload is built from, and pass it to put()."""
+        with self._lock:
+            return self._generation
+
+    def put(self, user_id, payload, open_windows, generation):
+        if not open_windows:
+            return
+        expires_at = min(
+            min(window['publish_end'] for window in open_windows.values()) + timedelta(microseconds=1),
+            lagos_now() + self.MAX_AGE
+        )
+        with self._lock:
+            if generation != self._generation:
+                return # Built from results read before the last invalidate()
+            self._entries[user_id] = {
+                'payload': payload,
+                'windows': self._windows_key(open_windows),
+                'expires_at': expires_at
+            }
+
+    def invalidate(self):
+        """Drops every payload, e.g. after results were uploaded, edited or deleted."""
+        with self._lock:
+            self._entries.clear()
+            self._warmed_windows = None
+            self._generation += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'prewarmed': self.prewarmed,
+                'cached_payloads': len(self._entries)
+            }
+
+    def _prewarm_in_background(self, open_windows):
+        with app.app_context():
+            try:
+                self.prewarm(open_windows)
+            except Exception as e:
+                print(f"Error pre-rendering student results: {e}")
+            finally:
+                db.session.remove()
+                with self._lock:
+                    self._prewarms_running -= 1
+
+    def prewarm(self, open_windows):
+        """Builds and caches the payload of every student with a result in an open window."""
+        generation = self.generation()
+        course_ids = {course_id for course_id, _ in open_windows}
+        reg_numbers = [
+            reg_number for (reg_number,) in db.session.query(StudentResult.reg_number)
+            .filter(StudentResult.course_id.in_(course_ids)).distinct().all()
+        ]
+        for start in range(0, len(reg_numbers), TRANSCRIPT_REFRESH_BATCH_SIZE):
+            if self.generation() != generation:
+                return # Invalidated meanwhile; whatever is left would be built from stale results
+            batch = reg_numbers[start:start + TRANSCRIPT_REFRESH_BATCH_SIZE]
+            users = db.session.query(User.id, User.fullname, User.regno).filter(User.regno.in_(batch)).all()
+            transcripts_by_student = load_student_transcripts(batch)
+
+            for user in users:
+                payload = build_student_results_payload(user.fullname, user.regno, transcripts_by_student.get(user.regno, []), open_windows)
+                self.put(user.id, payload, open_windows, generation)
+                with self._lock:
+                    self.prewarmed += 1
+
+student_results_surge_cache = StudentResultsSurgeCache()
+
+
+class Notification(db.Model):
+    """In-app notice shown on the student's dashboard."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    message = db.Column(db.String(255), nullable=False)
+    link = db.Column(db.String(255), nullable=True)
+    is_read = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.Index('ix_notification_user_read', 'user_id', 'is_read', 'created_at'),)
+
+    def __repr__(self):
+        return f"Notification(User: {self.user_id}, {self.message[:30]})"
+
+
+class PublicationNotificationJob(db.Model):
+    """One fan-out per publication window; the unique schedule_id stops two processes sending twice."""
+    id = db.Column(db.Integer, primary_key=True)
+    schedule_id = db.Column(db.Integer, db.ForeignKey('result_publication_schedule.id', ondelete='CASCADE'), unique=True, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='running') # running, fanned_out, failed
+    total_recipients = db.Column(db.Integer, nullable=False, default=0)
+    notifications_created = db.Column(db.Integer, nullable=False, default=0)
+    emails_queued = db.Column(db.Integer, nullable=False, default=0)
+    last_user_id = db.Column(db.Integer, nullable=False, default=0) # Recipients up to this User.id are done
+    attempts = db.Column(db.Integer, nullable=False, default=1)
+    claimed_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow) # Heartbeat; refreshed every batch
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    fanned_out_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.String(255), nullable=True)
+
+    schedule = db.relationship('ResultPublicationSchedule', backref=db.backref('notification_job', uselist=False))
+
+    def __repr__(self):
+        return f"PublicationNotificationJob(Schedule: {self.schedule_id}, {self.status})"
+
+
+# --- Result publication notifications ---
+# When a publication window opens, every student with a result in that course gets an
+# in-app notification and an email. Recipients come from one query; rows are written
+# in batches and the emails go through the rate-limited outbound queue, so nothing
+# runs on the request path and nobody has to poll /student/view_results.
+NOTIFY_BATCH_SIZE = 500
+NOTIFY_POLL_SECONDS = 60
+NOTIFY_CATCH_UP = timedelta(hours=24) # Windows that opened longer ago than this are not announced
+NOTIFY_LEASE = timedelta(minutes=5) # A running job with no heartbeat for this long lost its process
+NOTIFY_MAX_ATTEMPTS = 5
+
+
+class PublicationNotifier:
+    """Background thread that announces publication windows as they open."""
+
+    def __init__(self):
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def wake(self):
+        """Starts the notifier if needed and makes it re-check the schedules now."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='publication-notifier', daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.clear()
+            timeout = NOTIFY_POLL_SECONDS
+            try:
+                with app.app_context():
+                    next_opening = self.run_due()
+                if next_opening is not None:
+                    timeout = min(timeout, max((next_opening - lagos_now()).total_seconds(), 1))
+            except Exception as e:
+                print(f"Publication notifier error: {e}")
+            self._wake.wait(timeout)
+
+    def run_due(self, now=None):
+        """Fans out every open window that has not been announced. Returns the next opening time, if any."""
+        now = now or lagos_now()
+        due = ResultPublicationSchedule.query.outerjoin(PublicationNotificationJob).filter(
+            ResultPublicationSchedule.is_active == True,
+            ResultPublicationSchedule.publish_start <= now,
+            ResultPublicationSchedule.publish_start >= now - NOTIFY_CATCH_UP,
+            ResultPublicationSchedule.publish_end >= now,
+            PublicationNotificationJob.id.is_(None)
+        ).all()
+        for schedule in due:
+            job = PublicationNotificationJob(schedule_id=schedule.id)
+            db.session.add(job)
+            try:
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback() # Another worker process claimed this window
+                continue
+            self._fan_out_safely(job)
+        for job in self._claim_interrupted(now):
+            self._fan_out_safely(job)
+        return db.session.query(db.func.min(ResultPublicationSchedule.publish_start)).filter(
+            ResultPublicationSchedule.is_active == True,
+            ResultPublicationSchedule.publish_start > now
+        ).scalar()
+
+    def _claim_interrupted(self, now):
+        """
+        Re-claims jobs that failed or whose process died mid-fan-out, while their window is still open.
+        The conditional UPDATE means only one process resumes a given job.
+        """
+        stale_before = datetime.utcnow() - NOTIFY_LEASE
+        resumable = db.and_(
+            PublicationNotificationJob.status.in_(['running', 'failed']),
+            PublicationNotificationJob.attempts < NOTIFY_MAX_ATTEMPTS,
+            db.or_(PublicationNotificationJob.claimed_at.is_(None), PublicationNotificationJob.claimed_at < stale_before)
+        )
+        job_ids = [job_id for (job_id,) in db.session.query(PublicationNotificationJob.id)
+                   .join(ResultPublicationSchedule)
+                   .filter(resumable, ResultPublicationSchedule.is_active == True, ResultPublicationSchedule.publish_end >= now)
+                   .all()]
+        claimed = []
+        for job_id in job_ids:
+            result = db.session.execute(
+                db.update(PublicationNotificationJob)
+                .where(PublicationNotificationJob.id == job_id, resumable)
+                .values(status='running', attempts=PublicationNotificationJob.attempts + 1,
+                        claimed_at=datetime.utcnow(), last_error=None)
+            )
+            db.session.commit()
+            if result.rowcount == 1:
+                claimed.append(db.session.get(PublicationNotificationJob, job_id))
+        return claimed
+
+    def _fan_out_safely(self, job):
+        try:
+            self.fan_out(job)
+        except Exception as e:
+            db.session.rollback()
+            job.status, job.last_error = 'failed', str(e)[:255]
+            db.session.commit()
+
+    def fan_out(self, job):
+        """Notifies the course's students in User.id order, continuing after job.last_user_id on a retry."""
+        schedule = job.schedule
+        course = schedule.course
+        recipients = db.session.query(User.id, User.email, User.fullname) \
+            .join(StudentResult, StudentResult.reg_number == User.regno) \
+            .filter(StudentResult.course_id == schedule.course_id)
+        if job.last_user_id == 0:
+            job.total_recipients = recipients.count()
+            db.session.commit()
+
+        with app.test_request_context(): # url_for outside a request
+            link = url_for('student_view_results')
+        message = f'Your {course.course_code} result for {schedule.session_written} has been published.'
+        subject = f'{course.course_code} results are out'
+        while True:
+            batch = recipients.filter(User.id > job.last_user_id).order_by(User.id).limit(NOTIFY_BATCH_SIZE).all()
+            if not batch:
+                break
+            queued_at = datetime.utcnow()
+            db.session.execute(db.insert(Notification), [
+                {'user_id': recipient.id, 'message': message, 'link': link, 'is_read': False, 'created_at': queued_at}
+                for recipient in batch
+            ])
+            db.session.execute(db.insert(OutboundEmail), [
+                {
+                    'to_address': recipient.email,
+                    'subject': subject,
+                    'body': f"Dear {recipient.fullname},\n\n{message}\n"
+                            f"Log in and open My Results to see it. It is visible until {schedule.publish_end:%d %b %Y, %H:%M}.\n\nThank you!",
+                    'notification_job_id': job.id,
+                    'status': 'queued', 'attempts': 0, 'next_attempt_at': queued_at, 'created_at': queued_at,
+                }
+                for recipient in batch
+            ])
+            job.notifications_created += len(batch)
+            job.emails_queued += len(batch)
+            # Progress commits with the rows it covers, so a resumed job neither skips nor repeats anyone
+            job.last_user_id, job.claimed_at = batch[-1].id, datetime.utcnow()
+            db.session.commit()
+            email_worker.wake() # Start sending while later batches are written
+        job.status, job.fanned_out_at = 'fanned_out', datetime.utcnow()
+        db.session.commit()
+
+
+publication_notifier = PublicationNotifier()
+
+
+def notification_job_report(job):
+    """Progress and throughput of one fan-out, including how far its emails have got."""
+    email_counts = dict(db.session.query(OutboundEmail.status, db.func.count(OutboundEmail.id))
+                        .filter(OutboundEmail.notification_job_id == job.id)
+                        .group_by(OutboundEmail.status).all())
+    last_sent_at = db.session.query(db.func.max(OutboundEmail.sent_at)) \
+        .filter(OutboundEmail.notification_job_id == job.id).scalar()
+    outstanding = email_counts.get('queued', 0) + email_counts.get('sending', 0)
+    complete = job.status == 'fanned_out' and outstanding == 0
+    finished_at = (last_sent_at or job.fanned_out_at) if complete else None
+    elapsed = ((finished_at or datetime.utcnow()) - job.started_at).total_seconds()
+    sent = email_counts.get('sent', 0)
+    return {
+        'id': job.id,
+        'schedule_id': job.schedule_id,
+        'course_code': job.schedule.course.course_code if job.schedule and job.schedule.course else None,
+        'status': job.status,
+        'complete': complete,
+        'total_recipients': job.total_recipients,
+        'notifications_created': job.notifications_created,
+        'emails': {'queued': job.emails_queued, 'sent': sent, 'failed': email_counts.get('failed', 0), 'outstanding': outstanding},
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': finished_at.isoformat() if finished_at else None,
+        'elapsed_seconds': round(elapsed, 1),
+        'emails_per_second': round(sent / elapsed, 2) if elapsed > 0 else None,
+        'last_error': job.last_error,
+    }
+
 class AdminAddDues(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     fullname = db.Column(db.String(100), nullable=False)
@@ -433,9 +1584,108 @@ class Lecturer(db.Model, UserMixin):
 class Tag(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), unique=True, nullable=False)
+    # Number of projects carrying this tag, kept up to date by set_project_tags/clear_project_tags
+    project_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     def __repr__(self):
         return f"Tag('{self.name}')"
+
+
+# Project <-> Tag association. The primary key serves project -> tags lookups and
+# ix_project_tags_tag_project serves the tag -> projects join used by browse_projects.
+project_tags = db.Table(
+    'project_tags',
+    db.Column('project_id', db.Integer, db.ForeignKey('project_idea.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_project_tags_tag_project', 'tag_id', 'project_id'),
+)
+
+MAX_TAGS_PER_PROJECT = 10
+
+
+def parse_tag_names(raw):
+    """Splits a comma-separated tag field into unique, trimmed names (case-insensitive, first spelling wins)."""
+    names = {}
+    for name in (raw or '').split(','):
+        name = ' '.join(name.split())[:50]
+        if name and name.lower() not in names:
+            names[name.lower()] = name
+    return list(names.values())
+
+
+def set_project_tags(idea, tag_names):
+    """
+    Replaces a project's tags, creating missing Tag rows and adjusting
+    project_count for only the tags that were added or removed.
+    """
+    wanted = {name.lower(): name for name in tag_names[:MAX_TAGS_PER_PROJECT]}
+    current = {tag.name.lower(): tag for tag in idea.tags}
+
+    existing = {}
+    if wanted:
+        existing = {tag.name.lower(): tag for tag in
+                    Tag.query.filter(db.func.lower(Tag.name).in_(list(wanted))).all()}
+    added = []
+    for key, name in wanted.items():
+        if key in current:
+            continue
+        tag = existing.get(key)
+        if tag is None:
+            tag = Tag(name=name, project_count=0)
+            try:
+                with db.session.begin_nested():
+                    db.session.add(tag)
+            except IntegrityError:
+                # Another request created the same tag since the lookup above; use theirs.
+                # A locking read, so MySQL's repeatable-read snapshot doesn't hide the new row.
+                tag = Tag.query.filter_by(name=name).with_for_update(read=True).one()
+        added.append(tag)
+    removed = [tag for key, tag in current.items() if key not in wanted]
+
+    for tag in added:
+        idea.tags.append(tag)
+        tag.project_count = Tag.project_count + 1 if tag.id else 1
+    for tag in removed:
+        idea.tags.remove(tag)
+        tag.project_count = Tag.project_count - 1
+    if added or removed:
+        tag_cloud_cache.invalidate()
+
+
+def clear_project_tags(idea):
+    """Call before deleting a project so its tags' counts drop with it."""
+    set_project_tags(idea, [])
+
+
+class TagCloudCache:
+    """
+    Tag names with project counts for the browse_projects tag cloud. Rebuilt from
+    the maintained Tag.project_count column (no GROUP BY over project_tags) at most
+    once per MAX_AGE, and immediately after any tag change in this process.
+    """
+    MAX_AGE = timedelta(minutes=5)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tags = None
+        self._loaded_at = None
+
+    def tags(self):
+        with self._lock:
+            now = datetime.utcnow()
+            if self._tags is None or now - self._loaded_at > self.MAX_AGE:
+                self._tags = [{'name': name, 'count': count} for name, count in
+                              db.session.query(Tag.name, Tag.project_count)
+                              .filter(Tag.project_count > 0).order_by(Tag.name).all()]
+                self._loaded_at = now
+            return self._tags
+
+    def invalidate(self):
+        with self._lock:
+            self._tags = None
+
+
+tag_cloud_cache = TagCloudCache()
 class AdminActivityLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     admin_id = db.Column(db.Integer, db.ForeignKey('admin.id'), nullable=False)
@@ -508,10 +1758,10 @@ def signup():
         hashed_password = generate_password_hash(password)
         new_user = User(fullname=fullname, email=email, regno=regno, phone=phone, password=hashed_password)
         db.session.add(new_user)
-        db.session.commit()
 
-        # Send Welcome Email
+        # Queue the Welcome Email with the account; the mail worker sends it after this response
         send_welcome_email(email, fullname)
+        db.session.commit()
 
         flash('Account created successfully! Please log in.', 'success')
         return redirect(url_for('login'))
@@ -520,25 +1770,256 @@ def signup():
 
 
 # -----------------
-# Welcome Email Function
+# Outbound Email Queue
 # -----------------
-def send_welcome_email(to_email, fullname):
-    msg = EmailMessage()
-    msg['Subject'] = 'Welcome to Department Of Public Administration, University Of Nigeria, Nsukka Platform!'
-    msg['From'] = 'yourgmail@gmail.com'
-    msg['To'] = to_email
-    msg.set_content(f"Dear {fullname},\n\nWelcome! Your account has been created successfully.\n\nThank you!")
+# Mail is written to the outbound_email table in the caller's transaction and sent
+# by one background thread per process. The worker keeps a single SMTP connection
+# open while there is work, sends up to EMAIL_MESSAGES_PER_CONNECTION messages over
+# it, and retries failures with exponential backoff.
+EMAIL_BATCH_SIZE = 50 # rows claimed per database round trip
+EMAIL_MESSAGES_PER_CONNECTION = 100 # Gmail drops connections after roughly this many
+EMAIL_MAX_ATTEMPTS = 6
+EMAIL_RETRY_BASE_SECONDS = 30 # 30s, 1m, 2m, 4m, 8m between attempts
+EMAIL_RETRY_MAX_SECONDS = 60 * 60
+EMAIL_POLL_SECONDS = 30 # wake up for due retries even when nothing new is queued
+EMAIL_IDLE_DISCONNECT_SECONDS = 60 # close the pooled connection after this long without mail
+EMAIL_NOOP_AFTER_IDLE_SECONDS = 5 # probe a pooled connection with NOOP only after it has sat idle
+EMAIL_SENDING_TIMEOUT = timedelta(minutes=10) # 'sending' rows whose claim wasn't renewed for this long belong to a dead worker
+EMAIL_SMTP_TIMEOUT = 30
+EMAIL_MAX_PER_SECOND = 25 # Stay under the provider's sending rate; 5,000 mails take a little over 3 minutes
+
+
+class OutboundEmail(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    to_address = db.Column(db.String(255), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued') # queued, sending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.String(255), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+    notification_job_id = db.Column(db.Integer, db.ForeignKey('publication_notification_job.id'), nullable=True) # Set for fan-out mail
+    claimed_by = db.Column(db.String(64), nullable=True) # Token of the worker that claimed it for sending
 
-    # Replace with your actual Gmail credentials
-    gmail_user = 'yourgmail@gmail.com'
-    gmail_password = 'your_app_password'  # App Password if 2FA is enabled
+    __table_args__ = (
+        db.Index('ix_outbound_email_status_next_attempt', 'status', 'next_attempt_at'),
+        db.Index('ix_outbound_email_job_status', 'notification_job_id', 'status'),
+    )
 
-    try:
-        with smtplib.SMTP_SSL('smtp.gmail.com', 465) as smtp:
-            smtp.login(gmail_user, gmail_password)
-            smtp.send_message(msg)
-    except Exception as e:
-        print("Email failed:", e)
+    def __repr__(self):
+        return f"OutboundEmail({self.id}, {self.to_address}, {self.status})"
+
+    def to_message(self):
+        msg = EmailMessage()
+        msg['Subject'] = self.subject
+        msg['From'] = app.config['MAIL_DEFAULT_SENDER']
+        msg['To'] = self.to_address
+        msg.set_content(self.body)
+        return msg
+
+
+def queue_email(to_address, subject, body):
+    """Adds a message to the outbound queue. It is sent once the caller commits."""
+    email = OutboundEmail(to_address=to_address, subject=subject, body=body)
+    db.session.add(email)
+    db.session.info['email_queued'] = True
+    return email
+
+
+@db.event.listens_for(db.session, 'after_commit')
+def _wake_email_worker(db_session):
+    if db_session.info.pop('email_queued', False):
+        email_worker.wake()
+
+
+@db.event.listens_for(db.session, 'after_rollback')
+def _forget_queued_email(db_session):
+    db_session.info.pop('email_queued', None)
+
+
+def open_smtp_connection():
+    config = app.config
+    if config['MAIL_USE_SSL']:
+        smtp = smtplib.SMTP_SSL(config['MAIL_SERVER'], config['MAIL_PORT'], timeout=EMAIL_SMTP_TIMEOUT)
+    else:
+        smtp = smtplib.SMTP(config['MAIL_SERVER'], config['MAIL_PORT'], timeout=EMAIL_SMTP_TIMEOUT)
+        if config['MAIL_USE_TLS']:
+            smtp.starttls()
+    if config['MAIL_USERNAME'] and config['MAIL_PASSWORD']:
+        smtp.login(config['MAIL_USERNAME'], config['MAIL_PASSWORD'])
+    return smtp
+
+
+def email_retry_delay(attempts):
+    return timedelta(seconds=min(EMAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1), EMAIL_RETRY_MAX_SECONDS))
+
+
+class EmailWorker:
+    """Background sender for OutboundEmail rows, holding one reusable SMTP connection."""
+
+    def __init__(self):
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._smtp = None
+        self._smtp_sent = 0
+        self._smtp_last_used = 0
+        self._next_send_at = 0
+        self._token = None
+        self._token_pid = None
+
+    @property
+    def token(self):
+        """Identifies this process's claims; regenerated after a fork so workers never share one."""
+        if self._token_pid != os.getpid():
+            self._token, self._token_pid = f'{os.getpid()}-{uuid.uuid4().hex}', os.getpid()
+        return self._token
+
+    def wake(self):
+        """Starts the worker thread if needed and tells it there is new mail."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='email-worker', daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.clear()
+            try:
+                with app.app_context():
+                    self.drain()
+            except Exception as e:
+                print(f"Email worker error: {e}")
+            if self._smtp is not None and time.monotonic() - self._smtp_last_used > EMAIL_IDLE_DISCONNECT_SECONDS:
+                self._disconnect()
+            self._wake.wait(EMAIL_POLL_SECONDS)
+
+    def drain(self):
+        """Sends every message that is due, batch by batch. Needs an app context. Returns the number sent."""
+        self._requeue_orphans()
+        sent = 0
+        while True:
+            batch = self._claim_batch()
+            if not batch:
+                return sent
+            for email in batch:
+                sent += self._deliver(email)
+                # Each outcome is committed at once, and the rest of the batch's claim renewed with it
+                db.session.execute(
+                    db.update(OutboundEmail)
+                    .where(OutboundEmail.claimed_by == self.token, OutboundEmail.status == 'sending', OutboundEmail.id != email.id)
+                    .values(next_attempt_at=datetime.utcnow())
+                )
+                db.session.commit()
+
+    def _requeue_orphans(self):
+        """
+        Returns 'sending' rows to the queue once their claim has gone EMAIL_SENDING_TIMEOUT without
+        renewal. A live worker renews after every message, so only a dead worker's rows qualify.
+        """
+        cutoff = datetime.utcnow() - EMAIL_SENDING_TIMEOUT
+        OutboundEmail.query.filter(OutboundEmail.status == 'sending', OutboundEmail.next_attempt_at < cutoff) \
+            .update({'status': 'queued', 'claimed_by': None}, synchronize_session=False)
+        db.session.commit()
+
+    def _claim_batch(self):
+        """Marks up to EMAIL_BATCH_SIZE due messages as 'sending' so another process skips them."""
+        now = datetime.utcnow()
+        candidates = [email_id for (email_id,) in db.session.query(OutboundEmail.id).filter(
+            OutboundEmail.status == 'queued', OutboundEmail.next_attempt_at <= now
+        ).order_by(OutboundEmail.next_attempt_at, OutboundEmail.id).limit(EMAIL_BATCH_SIZE)]
+        if not candidates:
+            return []
+        # Conditional update, then re-select what our token got: another process may have taken
+        # some of the candidates in between. Portable: MySQL has no UPDATE ... RETURNING.
+        claimed = db.session.execute(
+            db.update(OutboundEmail)
+            .where(OutboundEmail.id.in_(candidates), OutboundEmail.status == 'queued')
+            .values(status='sending', next_attempt_at=now, claimed_by=self.token)
+        ).rowcount
+        db.session.commit()
+        if not claimed:
+            return []
+        return OutboundEmail.query.filter(
+            OutboundEmail.id.in_(candidates), OutboundEmail.claimed_by == self.token, OutboundEmail.status == 'sending'
+        ).order_by(OutboundEmail.id).all()
+
+    def _connection(self):
+        if self._smtp is not None and self._smtp_sent >= EMAIL_MESSAGES_PER_CONNECTION:
+            self._disconnect()
+        if self._smtp is not None and time.monotonic() - self._smtp_last_used > EMAIL_NOOP_AFTER_IDLE_SECONDS:
+            try:
+                self._smtp.noop() # Servers drop idle connections; find out before sending
+            except smtplib.SMTPException:
+                self._disconnect()
+        if self._smtp is None:
+            self._smtp = open_smtp_connection()
+            self._smtp_sent = 0
+        return self._smtp
+
+    def _disconnect(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+        self._smtp = None
+
+    def _throttle(self):
+        """Spaces sends EMAIL_MAX_PER_SECOND apart."""
+        now = time.monotonic()
+        if self._next_send_at > now:
+            time.sleep(self._next_send_at - now)
+            now = self._next_send_at
+        self._next_send_at = now + 1.0 / EMAIL_MAX_PER_SECOND
+
+    def _deliver(self, email):
+        email.attempts += 1
+        self._throttle()
+        try:
+            self._connection().send_message(email.to_message())
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused) as e:
+            email.status, email.last_error = 'failed', str(e)[:255] # Retrying will not help
+            return 0
+        except Exception as e:
+            self._disconnect()
+            email.last_error = str(e)[:255]
+            if email.attempts >= EMAIL_MAX_ATTEMPTS:
+                email.status = 'failed'
+            else:
+                email.status = 'queued'
+                email.next_attempt_at = datetime.utcnow() + email_retry_delay(email.attempts)
+            return 0
+        self._smtp_sent += 1
+        self._smtp_last_used = time.monotonic()
+        email.status, email.sent_at, email.last_error = 'sent', datetime.utcnow(), None
+        return 1
+
+
+email_worker = EmailWorker()
+
+
+@app.cli.command('send-queued-emails')
+def send_queued_emails():
+    """Sends every due message in the outbound queue in the foreground."""
+    sent = email_worker.drain()
+    email_worker._disconnect()
+    pending = OutboundEmail.query.filter_by(status='queued').count()
+    click.echo(f'Sent {sent} emails; {pending} still queued for retry.')
+
+
+# -----------------
+# Welcome Email Function
+# -----------------
+def send_welcome_email(to_email, fullname):
+    queue_email(
+        to_email,
+        'Welcome to Department Of Public Administration, University Of Nigeria, Nsukka Platform!',
+        f"Dear {fullname},\n\nWelcome! Your account has been created successfully.\n\nThank you!",
+    )
 
 @app.route('/logout')
 def logout():
@@ -571,9 +2052,20 @@ def dashboard():
         return redirect(url_for('login'))
     flash('Welcome To Your Dashboard.', 'success')
     user = User.query.get(session['user_id'])
+    notifications = Notification.query.filter_by(user_id=session['user_id'], is_read=False) \
+        .order_by(Notification.created_at.desc()).limit(5).all()
 
+    return render_template('dashboard.html', user=user, notifications=notifications)
 
-    return render_template('dashboard.html', user=user)
+
+@app.route('/notifications/read', methods=['POST'])
+def mark_notifications_read():
+    if 'user_id' not in session:
+        flash('Please log in first.', 'danger')
+        return redirect(url_for('login'))
+    Notification.query.filter_by(user_id=session['user_id'], is_read=False).update({'is_read': True})
+    db.session.commit()
+    return redirect(url_for('dashboard'))
 
 @app.route('/settings')
 def settings():
@@ -660,6 +2152,598 @@ def view_friends():
 
     return render_template('view_friends.html', friends=friends,communitties=communities)
 
+# --- Content-addressed upload storage ---
+# Uploaded files are stored once per distinct content as "<sha256>.<ext>" inside the
+# existing static folders, so templates keep building URLs from a plain filename.
+# StoredBlob counts how many records point at each file; the file is removed only
+# when the last reference is released and the transaction commits.
+BLOB_FOLDERS = {
+    'uploads': app.config['UPLOAD_FOLDER'],
+    'project_uploads': app.config['UPLOADED_PROJECTS_DEST'],
+}
+BLOB_CHUNK_SIZE = 64 * 1024
+
+
+class StoredBlob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    folder = db.Column(db.String(50), nullable=False) # Key of BLOB_FOLDERS
+    filename = db.Column(db.String(100), nullable=False) # "<sha256>.<ext>"
+    sha256 = db.Column(db.String(64), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('folder', 'filename', name='_blob_folder_filename_uc'),)
+
+    def __repr__(self):
+        return f"StoredBlob({self.folder}/{self.filename}, refs={self.ref_count})"
+
+
+class ExtractedText(db.Model):
+    """Text pulled out of an uploaded document, cached by content hash so a re-upload never re-extracts."""
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending') # pending, ocr, done, failed
+    extractor = db.Column(db.String(30), nullable=True) # e.g. 'pymupdf', 'python-docx'
+    text = db.Column(db.Text, nullable=True)
+    error = db.Column(db.String(255), nullable=True)
+    pages_total = db.Column(db.Integer, nullable=False, default=0) # Set when a scan goes to page OCR
+    pages_done = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"ExtractedText({self.sha256[:12]}, {self.status})"
+
+
+class ExtractedTextPage(db.Model):
+    """One OCR'd page of a scanned document, saved as soon as that page finishes."""
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), nullable=False)
+    page_number = db.Column(db.Integer, nullable=False) # 0-based
+    text = db.Column(db.Text, nullable=True)
+    error = db.Column(db.String(255), nullable=True)
+
+    __table_args__ = (db.UniqueConstraint('sha256', 'page_number', name='_extracted_page_uc'),)
+
+    def __repr__(self):
+        return f"ExtractedTextPage({self.sha256[:12]}, page={self.page_number})"
+
+
+# --- Streaming uploads ---
+# Multipart files are written by the form parser straight into a temp file in their
+# destination folder. The same pass hashes the bytes, keeps the first few for type
+# sniffing and aborts with 413 as soon as a file passes its endpoint's limit, so an
+# oversized upload is never buffered in worker memory.
+DEFAULT_UPLOAD_MAX_FILE_BYTES = 8 * 1024 * 1024
+# endpoint -> (BLOB_FOLDERS key the file will end up in, per-file byte limit)
+UPLOAD_STREAM_RULES = {
+    'upload_project': ('project_uploads', 5 * 1024 * 1024),
+    'admin_edit_project_idea': ('project_uploads', 5 * 1024 * 1024),
+    'create_blog_post': ('uploads', 8 * 1024 * 1024),
+    'create_community': ('uploads', 5 * 1024 * 1024),
+    'add_candidate': ('uploads', 5 * 1024 * 1024),
+    'edit_candidate': ('uploads', 5 * 1024 * 1024),
+    'upload_results': (None, 20 * 1024 * 1024), # Parsed in place, never stored
+}
+UPLOAD_SNIFF_BYTES = 512
+
+UPLOAD_SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'%PDF-', 'pdf'),
+    (b'PK\x03\x04', 'zip'), # also docx/xlsx/pptx
+    (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'ole'), # legacy doc/xls/ppt
+    (b'\x1a\x45\xdf\xa3', 'webm'),
+]
+IMAGE_KINDS = {'png', 'jpeg', 'gif', 'webp'}
+
+
+class UploadRejected(ValueError):
+    """An upload failed a content check; handled like a 413 (flash and go back)."""
+
+
+def sniff_upload_kind(head):
+    """Short name for the file type implied by its leading bytes, or None if unknown (e.g. plain text)."""
+    for signature, kind in UPLOAD_SIGNATURES:
+        if head.startswith(signature):
+            return kind
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    if head[4:8] == b'ftyp':
+        return 'mp4'
+    return None
+
+
+class HashingUploadStream:
+    """
+    File object handed to Werkzeug's multipart parser for one upload. Everything
+    else (read/seek/tell...) is delegated to the underlying temp file.
+    """
+
+    def __init__(self, directory, max_bytes, filename=None):
+        fd, self.path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        self._file = os.fdopen(fd, 'w+b')
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.filename = filename
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.head = b''
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            self.close()
+            raise RequestEntityTooLarge(
+                f'"{self.filename or "upload"}" is larger than the {self.max_bytes // (1024 * 1024)} MB limit.')
+        if len(self.head) < UPLOAD_SNIFF_BYTES:
+            self.head += data[:UPLOAD_SNIFF_BYTES - len(self.head)]
+        self.digest.update(data)
+        return self._file.write(data)
+
+    @property
+    def kind(self):
+        return sniff_upload_kind(self.head)
+
+    def finish(self):
+        """Flushes and closes the temp file so it can be linked into place; it is still deleted by close()."""
+        self._file.flush()
+        self._file.close()
+        return self.path
+
+    def close(self):
+        """Closes and deletes the temp file; runs at request teardown."""
+        if not self._file.closed:
+            self._file.close()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class StreamingUploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        folder, max_bytes = UPLOAD_STREAM_RULES.get(self.endpoint, (None, DEFAULT_UPLOAD_MAX_FILE_BYTES))
+        if content_length is not None and content_length > max_bytes:
+            raise RequestEntityTooLarge(f'"{filename or "upload"}" is larger than the {max_bytes // (1024 * 1024)} MB limit.')
+        directory = BLOB_FOLDERS[folder] if folder else tempfile.gettempdir()
+        stream = HashingUploadStream(directory, max_bytes, filename)
+        # Tracked here as well: if a later file fails, Werkzeug never puts the earlier ones in request.files
+        self.__dict__.setdefault('upload_streams', []).append(stream)
+        return stream
+
+    def close_upload_streams(self):
+        """Deletes every temp file this request's uploads left behind (stored ones are hard links)."""
+        for stream in self.__dict__.pop('upload_streams', []):
+            stream.close()
+
+    def close(self):
+        super().close()
+        self.close_upload_streams()
+
+
+app.request_class = StreamingUploadRequest
+
+
+@app.errorhandler(RequestEntityTooLarge)
+@app.errorhandler(UploadRejected)
+def handle_rejected_upload(error):
+    db.session.rollback()
+    request.close_upload_streams()
+    message = error.description if isinstance(error, RequestEntityTooLarge) else str(error)
+    if request.is_json or request.path.startswith('/api/'):
+        return jsonify({'success': False, 'message': message}), 413
+    flash(message or 'The uploaded file is too large.', 'danger')
+    return redirect(request.referrer or url_for('index'))
+
+
+def uploaded_size(file_storage):
+    """Size in bytes of an uploaded file without reading it into memory."""
+    if isinstance(file_storage.stream, HashingUploadStream):
+        return file_storage.stream.size
+    file_storage.stream.seek(0, os.SEEK_END)
+    size = file_storage.stream.tell()
+    file_storage.stream.seek(0)
+    return size
+
+
+def _stored_blob_upsert_statement():
+    """
+    INSERT ... ON CONFLICT for StoredBlob that adds one reference in SQL, so concurrent
+    uploads of the same content neither lose counts nor trip _blob_folder_filename_uc.
+    """
+    table = StoredBlob.__table__
+    dialect = db.engine.dialect.name
+
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert as dialect_insert
+        return dialect_insert(table).on_duplicate_key_update(ref_count=table.c.ref_count + 1)
+
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    return dialect_insert(table).on_conflict_do_update(
+        index_elements=['folder', 'filename'],
+        set_={'ref_count': table.c.ref_count + 1}
+    )
+
+
+def save_upload_blob(file_storage, folder='uploads', allowed_kinds=None):
+    """
+    Stores an upload in BLOB_FOLDERS[folder] and returns the stored filename.
+    Identical content is kept once: a second upload only bumps StoredBlob.ref_count
+    and its temp file is discarded. allowed_kinds (e.g. IMAGE_KINDS) is checked
+    against the sniffed content, not the extension; a mismatch raises UploadRejected.
+    Commit with the record that references the returned filename.
+    """
+    directory = BLOB_FOLDERS[folder]
+    extension = os.path.splitext(secure_filename(file_storage.filename or ''))[1].lower()
+    stream = file_storage.stream
+
+    if isinstance(stream, HashingUploadStream) and stream.directory == directory:
+        # Already hashed and on disk next to its final location
+        kind, digest, size, temp_path = stream.kind, stream.digest, stream.size, None
+    else:
+        kind = sniff_upload_kind(stream.read(UPLOAD_SNIFF_BYTES))
+        stream.seek(0)
+        digest, size = hashlib.sha256(), 0
+        # Temp file in the destination folder so the final rename never crosses filesystems
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(BLOB_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+                out.write(chunk)
+
+    try:
+        if allowed_kinds is not None and kind not in allowed_kinds:
+            raise UploadRejected(f'"{file_storage.filename}" does not look like an allowed file type.')
+
+        filename = f'{digest.hexdigest()}{extension}'
+        final_path = os.path.join(directory, filename)
+        copy_path = temp_path or stream.finish()
+        # New row with one reference, or one more reference on the existing row
+        db.session.execute(_stored_blob_upsert_statement().values(
+            folder=folder, filename=filename, sha256=digest.hexdigest(), size=size,
+            ref_count=1, created_at=datetime.utcnow()
+        ))
+        with blob_store_lock():
+            try:
+                os.link(copy_path, final_path)
+                # Removed again if this transaction never commits (e.g. the form fails validation)
+                db.session.info.setdefault('blob_creations', []).append((folder, filename))
+            except FileExistsError:
+                pass
+        # Our copy stays until the transaction ends, in case another upload of the same content
+        # rolls back and removes the shared file first (see _restore_shared_blobs)
+        db.session.info.setdefault('blob_copies', []).append((folder, filename, copy_path))
+        temp_path = None
+        if kind in IMAGE_KINDS:
+            queue_image_derivatives(final_path)
+        if folder == 'project_uploads':
+            queue_text_extraction(digest.hexdigest(), final_path)
+        return filename
+    finally:
+        # A rejected file: drop our copy (a stream's temp file is deleted at request teardown)
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def release_blob(filename, folder='uploads'):
+    """
+    Drops one reference to a stored file. When none remain the StoredBlob row is
+    deleted and the file is unlinked after the surrounding commit succeeds. Files
+    saved before the blob store existed have no row and are left on disk, since
+    other records may still point at the same legacy filename.
+    """
+    if not filename:
+        return
+    filename = os.path.basename(filename)
+    # Read, then decrement only if nobody changed the count in between (compare-and-set), so
+    # concurrent uploads/deletes can't lose counts. Portable: MySQL has no UPDATE ... RETURNING.
+    while True:
+        current = db.session.execute(
+            db.select(StoredBlob.ref_count).where(StoredBlob.folder == folder, StoredBlob.filename == filename)
+        ).scalar()
+        if current is None:
+            return
+        updated = db.session.execute(
+            db.update(StoredBlob)
+            .where(StoredBlob.folder == folder, StoredBlob.filename == filename, StoredBlob.ref_count == current)
+            .values(ref_count=current - 1)
+        ).rowcount
+        if updated == 1:
+            break
+    if current - 1 > 0:
+        return
+    db.session.execute(db.delete(StoredBlob).where(
+        StoredBlob.folder == folder, StoredBlob.filename == filename, StoredBlob.ref_count <= 0
+    ))
+    db.session.info.setdefault('blob_unlinks', []).append((folder, filename))
+
+
+_blob_store_thread_lock = threading.Lock()
+
+
+@contextmanager
+def blob_store_lock():
+    """
+    Serializes the blob store's "is this file still referenced?" checks and unlinks against
+    uploads adding a reference, across threads and worker processes (a lock file in instance/).
+    """
+    if fcntl is None:
+        with _blob_store_thread_lock:
+            yield
+        return
+    os.makedirs(app.instance_path, exist_ok=True)
+    with open(os.path.join(app.instance_path, 'blob.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX) # Released when the file is closed
+        yield
+
+
+@db.event.listens_for(db.session, 'after_commit')
+def _unlink_released_blobs(db_session):
+    released = db_session.info.pop('blob_unlinks', [])
+    if not released:
+        return
+    with blob_store_lock(), db.engine.connect() as conn:
+        for folder, filename in released:
+            # Re-read: an upload of the same content may have re-created the row since our commit
+            referenced = conn.execute(
+                db.select(StoredBlob.id).where(StoredBlob.folder == folder, StoredBlob.filename == filename)
+            ).first()
+            if referenced is not None:
+                continue
+            path = os.path.join(BLOB_FOLDERS[folder], filename)
+            # The original plus any resized copies made by the derivative pipeline
+            for target in [path] + [derivative_path(path, size) for size in IMAGE_DERIVATIVE_SIZES]:
+                try:
+                    if os.path.exists(target):
+                        os.remove(target)
+                except OSError as e:
+                    print(f"Error deleting released upload {target}: {e}")
+
+
+@db.event.listens_for(db.session, 'after_rollback')
+def _forget_released_blobs(db_session):
+    db_session.info.pop('blob_unlinks', None)
+
+
+@db.event.listens_for(db.session, 'after_commit')
+def _keep_created_blobs(db_session):
+    db_session.info.pop('blob_creations', None)
+
+
+@db.event.listens_for(db.session, 'after_commit')
+def _restore_shared_blobs(db_session):
+    """
+    Puts a file back from this transaction's own copy if a concurrent upload of the same
+    content rolled back (or a release committed) and removed it before our row was committed.
+    """
+    copies = db_session.info.get('blob_copies')
+    if not copies:
+        return
+    with blob_store_lock():
+        for folder, filename, copy_path in copies:
+            final_path = os.path.join(BLOB_FOLDERS[folder], filename)
+            if not os.path.exists(final_path) and os.path.exists(copy_path):
+                os.link(copy_path, final_path)
+
+
+@db.event.listens_for(db.session, 'after_transaction_end')
+def _discard_uncommitted_blobs(db_session, transaction):
+    """
+    Files written by save_upload_blob in a transaction that was rolled back, or closed
+    without a commit, have no StoredBlob row to find them by, so they are removed here.
+    A file another request has since committed a row for is kept.
+    """
+    if transaction.parent is not None:
+        return
+    for folder, filename, copy_path in db_session.info.pop('blob_copies', []):
+        try:
+            if os.path.exists(copy_path):
+                os.remove(copy_path)
+        except OSError as e:
+            print(f"Error deleting upload copy {copy_path}: {e}")
+    created = db_session.info.pop('blob_creations', None)
+    if not created:
+        return
+    # Under the lock, so a concurrent upload of the same content either committed its row
+    # before this check or restores the file from its own copy once it commits
+    with blob_store_lock(), db.engine.connect() as conn:
+        for folder, filename in created:
+            committed = conn.execute(
+                db.select(StoredBlob.id).where(StoredBlob.folder == folder, StoredBlob.filename == filename)
+            ).first()
+            if committed is not None:
+                continue
+            path = os.path.join(BLOB_FOLDERS[folder], filename)
+            for target in [path] + [derivative_path(path, size) for size in IMAGE_DERIVATIVE_SIZES]:
+                try:
+                    if os.path.exists(target):
+                        os.remove(target)
+                except OSError as e:
+                    print(f"Error deleting uncommitted upload {target}: {e}")
+
+
+# --- Static asset fingerprinting ---
+# Every url_for('static', ...) gets "?v=<content hash>" appended. A request that carries the
+# current hash is answered with a year-long immutable Cache-Control, so browsers never ask
+# again until the file changes (and the URL with it). Strong ETags cover everything else.
+STATIC_ASSET_MAX_AGE = 365 * 24 * 60 * 60
+STATIC_FINGERPRINT_LENGTH = 16
+CONTENT_ADDRESSED_NAME = re.compile(r'[0-9a-f]{64}')
+
+
+class StaticManifest:
+    """
+    Maps static paths to content fingerprints. Entries are keyed on mtime and size,
+    so edited or newly uploaded files are re-hashed the next time they are linked.
+    """
+
+    def __init__(self, static_folder):
+        self.static_folder = static_folder
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def fingerprint(self, filename):
+        path = safe_join(self.static_folder, filename)
+        if path is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(filename)
+        if entry and entry[0] == key:
+            return entry[1]
+
+        stem = os.path.splitext(os.path.basename(filename))[0]
+        if CONTENT_ADDRESSED_NAME.fullmatch(stem):
+            digest = stem # Blob-store uploads are already named by their sha256
+        else:
+            hasher = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(BLOB_CHUNK_SIZE), b''):
+                    hasher.update(chunk)
+            digest = hasher.hexdigest()
+        digest = digest[:STATIC_FINGERPRINT_LENGTH]
+        with self._lock:
+            self._entries[filename] = (key, digest)
+        return digest
+
+
+static_manifest = StaticManifest(app.static_folder)
+
+
+@app.url_defaults
+def fingerprint_static_url(endpoint, values):
+    if endpoint == 'static' and 'filename' in values and 'v' not in values:
+        digest = static_manifest.fingerprint(values['filename'])
+        if digest:
+            values['v'] = digest
+
+
+def send_fingerprinted_static(filename):
+    """Replacement for Flask's static view: content-hash ETags, immutable caching for ?v= URLs."""
+    digest = static_manifest.fingerprint(filename)
+    if digest and request.args.get('v') == digest:
+        response = send_from_directory(app.static_folder, filename, etag=digest, max_age=STATIC_ASSET_MAX_AGE)
+        response.cache_control.immutable = True
+        return response
+    # Unversioned or stale link: serve it, but make the browser revalidate against the ETag
+    response = send_from_directory(app.static_folder, filename, etag=digest or True, max_age=0)
+    response.cache_control.no_cache = True
+    return response
+
+
+app.view_functions['static'] = send_fingerprinted_static
+
+
+# --- Image derivatives ---
+# Every stored picture gets resized WebP copies next to it ("<name>.thumb.webp",
+# "<name>.medium.webp"), made on a background thread so uploads return straight away.
+# Templates call image_url() to pick a size; it serves the original until the copy exists.
+IMAGE_DERIVATIVE_SIZES = {'thumb': 200, 'medium': 640} # longest edge in pixels
+IMAGE_DERIVATIVE_QUALITY = 80
+IMAGE_DERIVATIVE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.webp'}
+
+image_derivative_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='image-derivatives')
+_pending_derivatives = set()
+_pending_derivatives_lock = threading.Lock()
+
+
+def derivative_path(original_path, size):
+    """Path (or static-relative name) of the WebP copy of original_path at the given size."""
+    stem, _ = os.path.splitext(original_path)
+    return f'{stem}.{size}.webp'
+
+
+def is_image_derivative(path):
+    return any(path.endswith(f'.{size}.webp') for size in IMAGE_DERIVATIVE_SIZES)
+
+
+def generate_image_derivatives(original_path):
+    """Writes any missing WebP sizes for one image. Safe to call repeatedly."""
+    try:
+        with Image.open(original_path) as opened:
+            image = ImageOps.exif_transpose(opened) # Phone photos: apply the rotation flag before resizing
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if image.mode in ('P', 'LA') or 'transparency' in image.info else 'RGB')
+            for size, edge in IMAGE_DERIVATIVE_SIZES.items():
+                target = derivative_path(original_path, size)
+                if os.path.exists(target):
+                    continue
+                resized = image.copy()
+                resized.thumbnail((edge, edge), Image.LANCZOS) # never upscales
+                temp_target = f'{target}.tmp'
+                resized.save(temp_target, 'WEBP', quality=IMAGE_DERIVATIVE_QUALITY, method=4)
+                os.replace(temp_target, target)
+    except Exception as e:
+        print(f"Error creating image derivatives for {original_path}: {e}")
+    finally:
+        with _pending_derivatives_lock:
+            _pending_derivatives.discard(original_path)
+
+
+def schedule_image_derivatives(original_path):
+    """Queues derivative generation for an image unless it is already queued."""
+    if os.path.splitext(original_path)[1].lower() not in IMAGE_DERIVATIVE_EXTENSIONS or is_image_derivative(original_path):
+        return
+    with _pending_derivatives_lock:
+        if original_path in _pending_derivatives:
+            return
+        _pending_derivatives.add(original_path)
+    image_derivative_executor.submit(generate_image_derivatives, original_path)
+
+
+def queue_image_derivatives(original_path):
+    """Schedules derivatives once the surrounding commit succeeds; a rolled-back upload's file is removed instead."""
+    db.session.info.setdefault('image_derivatives', set()).add(original_path)
+
+
+@db.event.listens_for(db.session, 'after_commit')
+def _schedule_committed_image_derivatives(db_session):
+    for original_path in db_session.info.pop('image_derivatives', ()):
+        schedule_image_derivatives(original_path)
+
+
+@db.event.listens_for(db.session, 'after_rollback')
+def _forget_image_derivatives(db_session):
+    db_session.info.pop('image_derivatives', None)
+
+
+@app.template_global()
+def image_url(path, size='thumb'):
+    """
+    URL of the resized WebP copy of a static image. path is relative to the static
+    folder ('uploads/abc.png') or a stored static URL ('/static/uploads/abc.png').
+    Falls back to the original, queueing the copy for images that predate the pipeline.
+    """
+    if not path:
+        return ''
+    if path.startswith(('http://', 'https://')):
+        return path
+    static_prefix = app.static_url_path + '/'
+    relative = path[len(static_prefix):] if path.startswith(static_prefix) else path.lstrip('/')
+    original = os.path.join(app.static_folder, relative)
+    if os.path.exists(derivative_path(original, size)):
+        return url_for('static', filename=derivative_path(relative, size))
+    if os.path.exists(original):
+        schedule_image_derivatives(original)
+    return url_for('static', filename=relative)
+
+
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png'}
 
@@ -676,9 +2760,7 @@ def create_community():
         profile_picture = request.files['profile_picture']  # this is a FileStorage object
 
         if profile_picture:
-            filename = secure_filename(profile_picture.filename)
-            filepath = os.path.join('static/uploads', filename)  # choose your upload folder
-            profile_picture.save(filepath)  # save the file
+            filename = save_upload_blob(profile_picture, 'uploads', IMAGE_KINDS)  # deduplicated by content
 
             # Now save only the filename (or filepath) to the database
             new_community = Community(
@@ -856,25 +2938,468 @@ def privatechat():
         flash('Friend not found.', 'danger')
         return redirect(url_for('friendrequest')) # Redirect if friend doesn't exist
 
-    # Fetch existing messages for this chat (optional, but good for persistence)
-    # This example assumes a Message model with sender_id, recipient_id, encrypted_content
-    # You might need to adjust this based on your actual Message model structure
-    messages = Message.query.filter(
-        ((Message.sender_id == user.id) & (Message.recipient_id == friend.id)) |
-        ((Message.sender_id == friend.id) & (Message.recipient_id == user.id))
-    ).order_by(Message.timestamp.asc()).all()
+    # Only the latest page of the conversation; older pages come from chat_history_api.
+    # PrivateChat is where the Socket.IO gateway stores messages.
+    messages, history_cursor = chat_history_page(PrivateChat, user.id, friend.id)
 
     # Pass all necessary data to the template
     return render_template('chat.html',
                            user=user,
                            friend=friend, # Pass the entire friend object
-                           messages=messages,
+                           messages=[serialize_chat_message(message) for message in messages],
+                           history_cursor=history_cursor,
                            current_user_public_key=user.public_key, # Assuming public_key is stored in User model
                            friend_public_key=friend.public_key) # Assuming public_key is stored in User model
 
+# --- Chat history ---
+CHAT_PAGE_SIZE = 50
+CHAT_PAGE_MAX_SIZE = 200
+CHAT_HISTORY_MODELS = {'private': PrivateChat, 'message': Message}
+
+
+def chat_history_page(model, user_id, friend_id, cursor=None, limit=CHAT_PAGE_SIZE):
+    """
+    One page of a conversation (model is PrivateChat or Message), found with a single
+    seek on (conversation_id, timestamp, id). Returns (messages oldest first,
+    cursor for the next older page or None). A malformed cursor raises ValueError.
+    """
+    query = model.query.filter(model.conversation_id == conversation_key(user_id, friend_id))
+    if cursor:
+        last_timestamp, last_id = decode_keyset_cursor(cursor)
+        last_timestamp = datetime.fromisoformat(last_timestamp)
+        query = query.filter(db.or_(
+            model.timestamp < last_timestamp,
+            db.and_(model.timestamp == last_timestamp, model.id < last_id)
+        ))
+    messages = query.order_by(model.timestamp.desc(), model.id.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(messages) > limit:
+        messages = messages[:limit]
+        next_cursor = encode_keyset_cursor(messages[-1].timestamp, messages[-1].id)
+    messages.reverse()
+    return messages, next_cursor
+
+
+def serialize_chat_message(message, binary=False):
+    """
+    JSON form of a stored message; encrypted_message is {ciphertext, nonce} in libsodium
+    base64 (None if unreadable). binary=True keeps raw bytes for Socket.IO attachments.
+    """
+    if getattr(message, 'envelope_version', CHAT_ENVELOPE_LEGACY) == CHAT_ENVELOPE_BINARY:
+        if binary:
+            encrypted_message = {'ciphertext': message.ciphertext, 'nonce': message.nonce}
+        else:
+            encrypted_message = {'ciphertext': sodium_b64encode(message.ciphertext), 'nonce': sodium_b64encode(message.nonce)}
+    else:
+        try:
+            encrypted_message = json.loads(message.encrypted_content)
+        except ValueError:
+            encrypted_message = None
+    return {
+        'id': message.id,
+        'uid': getattr(message, 'message_uid', None),
+        'sender_id': message.sender_id,
+        'recipient_id': message.recipient_id,
+        'encrypted_message': encrypted_message,
+        'timestamp': message.timestamp.isoformat() if message.timestamp else None,
+    }
+
+
+@app.route('/api/chat/<int:friend_id>/history')
+def chat_history_api(friend_id):
+    """Older messages for the chat page's "load older" button."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Please log in to access chat.'}), 401
+    model = CHAT_HISTORY_MODELS.get(request.args.get('source', 'private'))
+    if model is None:
+        return jsonify({'error': 'Unknown message source.'}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', CHAT_PAGE_SIZE)), 1), CHAT_PAGE_MAX_SIZE)
+        messages, next_cursor = chat_history_page(model, session['user_id'], friend_id, request.args.get('cursor'), limit)
+    except (ValueError, TypeError):
+        return jsonify({'error': 'Invalid cursor or limit.'}), 400
+    return jsonify({
+        'messages': [serialize_chat_message(message) for message in messages],
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None,
+    })
+
+
 # --- SocketIO Events ---
+# Every user joins a room named after their id, so a message is relayed with one
+# emit to that room whichever worker or tab they are connected on.
+CHAT_MAX_CIPHERTEXT_BYTES = 12 * 1024
+CHAT_NONCE_BYTES = 24 # crypto_box_NONCEBYTES
+CHAT_ENVELOPE_LEGACY = 0 # JSON text in PrivateChat.encrypted_content
+CHAT_ENVELOPE_BINARY = 1 # PrivateChat.ciphertext / PrivateChat.nonce
+CHAT_MIGRATION_BATCH_SIZE = 1000
 
+
+def sodium_b64encode(data):
+    """libsodium's default base64 variant (URL-safe, unpadded), which is what chat.html decodes."""
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def sodium_b64decode(text):
+    """Accepts any base64 variant (older clients and rows); raises ValueError on garbage."""
+    text = text.strip().replace('+', '-').replace('/', '_').rstrip('=')
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def run_blocking(function, *args):
+    """
+    Runs a blocking call (SQLite has no cooperative driver) on a native thread when the
+    gateway runs on eventlet/gevent, so one slow write never stalls the other connections.
+    """
+    mode = socketio.async_mode
+    if mode == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(function, *args)
+    if mode == 'gevent':
+        from gevent import get_hub
+        return get_hub().threadpool.apply(function, args)
+    return function(*args)
+
+
+# --- Write-behind chat persistence ---
+# The gateway relays a message at once and hands it to chat_write_behind, which appends
+# it to a local journal (fsynced before the sender's ack) and writes PrivateChat rows in
+# batched transactions. After a crash the journal is replayed into the database.
+# With several workers (SOCKETIO_MESSAGE_QUEUE) each keeps chat-journal-<pid>.bin and a
+# starting worker also replays journals left behind by workers that died.
+CHAT_FLUSH_INTERVAL_SECONDS = 0.005
+CHAT_FLUSH_BATCH_SIZE = 256
+CHAT_JOURNAL_DIR = os.environ.get('CHAT_JOURNAL_DIR') or app.instance_path
+CHAT_JOURNAL_HEADER = struct.Struct('<II') # body length, crc32 of body
+CHAT_JOURNAL_RECORD = struct.Struct('<16sqqq') # uid, sender_id, recipient_id, timestamp (µs since epoch); then nonce + ciphertext
+CHAT_EPOCH = datetime(1970, 1, 1)
+
+
+def new_chat_message(sender_id, recipient_id, ciphertext, nonce):
+    """A PrivateChat row (as insert parameters) with its uid and timestamp fixed up front."""
+    return {
+        'message_uid': uuid.uuid4().hex,
+        'sender_id': sender_id,
+        'recipient_id': recipient_id,
+        'conversation_id': conversation_key(sender_id, recipient_id),
+        'ciphertext': ciphertext,
+        'nonce': nonce,
+        'envelope_version': CHAT_ENVELOPE_BINARY,
+        'encrypted_content': '',
+        'timestamp': datetime.utcnow(),
+    }
+
+
+def encode_chat_journal_record(message):
+    body = CHAT_JOURNAL_RECORD.pack(
+        bytes.fromhex(message['message_uid']), message['sender_id'], message['recipient_id'],
+        (message['timestamp'] - CHAT_EPOCH) // timedelta(microseconds=1)
+    ) + message['nonce'] + message['ciphertext']
+    return CHAT_JOURNAL_HEADER.pack(len(body), zlib.crc32(body)) + body
+
+
+def decode_chat_journal_record(body):
+    uid, sender_id, recipient_id, micros = CHAT_JOURNAL_RECORD.unpack_from(body)
+    rest = body[CHAT_JOURNAL_RECORD.size:]
+    message = new_chat_message(sender_id, recipient_id, rest[CHAT_NONCE_BYTES:], rest[:CHAT_NONCE_BYTES])
+    message.update(message_uid=uid.hex(), timestamp=CHAT_EPOCH + timedelta(microseconds=micros))
+    return message
+
+
+def parse_chat_journal(data):
+    """Yields every intact message in a journal's bytes; a torn or corrupt tail (crash mid-write) ends the scan."""
+    offset = 0
+    while offset + CHAT_JOURNAL_HEADER.size <= len(data):
+        length, crc = CHAT_JOURNAL_HEADER.unpack_from(data, offset)
+        body = data[offset + CHAT_JOURNAL_HEADER.size:offset + CHAT_JOURNAL_HEADER.size + length]
+        if len(body) < length or zlib.crc32(body) != crc:
+            break
+        yield decode_chat_journal_record(body)
+        offset += CHAT_JOURNAL_HEADER.size + length
+
+
+class ChatJournal:
+    """
+    Append-only file of chat messages that may not be in the database yet. fsyncs are
+    group-committed: the first waiter syncs for every record written before it, so a
+    burst of messages costs one fsync rather than one each. Emptied whenever the
+    database has caught up with everything written.
+    """
+
+    def __init__(self, directory, name=None):
+        self.directory = directory
+        self.name = name # None: chat-journal-<pid>.bin, decided when first opened (after any fork)
+        self.path = None
+        self._file = None
+        self._lock = threading.Lock()
+        self._synced = threading.Condition(self._lock)
+        self._syncing = False
+        self._written = 0 # Sequence number of the last record appended
+        self._durable = 0 # ... of the last record known to be on disk
+        self._committed = 0 # ... of the last record known to be in the database
+
+    def _open(self):
+        if self._file is None:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, self.name or f'chat-journal-{os.getpid()}.bin')
+            journal = open(path, 'a+b')
+            if fcntl is not None:
+                try:
+                    fcntl.flock(journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    journal.close()
+                    raise RuntimeError(f'{path} is in use by another process; run multiple workers with SOCKETIO_MESSAGE_QUEUE set.')
+            self.path, self._file = path, journal
+        return self._file
+
+    def read_records(self):
+        """Yields every intact message in this process's journal."""
+        with self._lock:
+            journal = self._open()
+            journal.seek(0)
+            data = journal.read()
+        return parse_chat_journal(data)
+
+    def orphaned_journals(self):
+        """
+        Open, locked handles on other journals in the directory that no live process holds,
+        i.e. left by a worker that died. Without fcntl that can't be told, so none.
+        """
+        if fcntl is None:
+            return []
+        with self._lock:
+            self._open()
+        orphans = []
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if not (name.startswith('chat-journal') and name.endswith('.bin')) or path == self.path:
+                continue
+            handle = open(path, 'a+b')
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                handle.close() # A live worker's journal
+                continue
+            try:
+                replaced = os.stat(path).st_ino != os.fstat(handle.fileno()).st_ino
+            except FileNotFoundError:
+                replaced = True
+            if replaced: # Another worker replayed and unlinked it between our open and flock
+                handle.close()
+                continue
+            orphans.append(handle)
+        return orphans
+
+    def append(self, record):
+        """Writes one encoded record and returns its sequence number (not yet fsynced)."""
+        with self._lock:
+            journal = self._open()
+            journal.write(record)
+            journal.flush()
+            self._written += 1
+            return self._written
+
+    def wait_durable(self, seq):
+        """Blocks until record seq is on disk."""
+        with self._lock:
+            while self._durable < seq:
+                if self._syncing:
+                    self._synced.wait()
+                    continue
+                self._syncing = True
+                target = self._written
+                fileno = self._file.fileno()
+                self._lock.release()
+                try:
+                    os.fsync(fileno)
+                finally:
+                    self._lock.acquire()
+                    self._syncing = False
+                    self._synced.notify_all()
+                self._durable = max(self._durable, target)
+
+    def mark_committed(self, seq):
+        """Everything up to seq is in the database; truncate once nothing newer is waiting."""
+        with self._lock:
+            self._committed = max(self._committed, seq)
+            if self._committed == self._written and self._file is not None:
+                self._file.truncate(0)
+                self._durable = self._written
+                self._synced.notify_all()
+
+
+def _private_chat_insert_ignore():
+    """INSERT that skips rows whose message_uid is already stored (journal replay after a partial flush)."""
+    if db.engine.dialect.name == 'mysql':
+        return db.insert(PrivateChat).prefix_with('IGNORE')
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    return dialect_insert(PrivateChat).on_conflict_do_nothing(index_elements=['message_uid'])
+
+
+class ChatWriteBehind:
+    """Queues chat messages in memory and writes them to PrivateChat in batches from a background thread."""
+
+    def __init__(self, journal):
+        self.journal = journal
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._queue = [] # (journal seq, row), in seq order
+        self._stored = [] # (id, message_uid, sender_id, recipient_id) of flushed rows not yet announced
+        self._wake = threading.Event()
+        self._batch_full = threading.Event()
+        self._thread = None
+        self._replayed = False
+
+    def start(self):
+        """Replays the journal left by a previous run (first call only) and starts the flusher thread."""
+        with self._lock:
+            self._start_locked()
+
+    def _start_locked(self):
+        if not self._replayed:
+            with app.app_context():
+                self.replay()
+            self._replayed = True
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='chat-write-behind', daemon=True)
+            self._thread.start()
+
+    def replay(self):
+        """
+        Writes every message in our journal, and in journals of dead workers, to the
+        database. Needs an app context; returns the count.
+        """
+        orphans = self.journal.orphaned_journals()
+        messages = list(self.journal.read_records())
+        for handle in orphans:
+            handle.seek(0)
+            messages.extend(parse_chat_journal(handle.read()))
+        for start in range(0, len(messages), CHAT_FLUSH_BATCH_SIZE):
+            db.session.execute(_private_chat_insert_ignore(), messages[start:start + CHAT_FLUSH_BATCH_SIZE])
+        db.session.commit()
+        self.journal.mark_committed(0) # Nothing appended yet this run, so this empties the file
+        for handle in orphans:
+            try:
+                os.unlink(handle.name) # Still locked by us, so no other worker replays it as well
+            except FileNotFoundError:
+                pass # Already removed by a worker that replayed it too; the rows were inserted idempotently
+            handle.close()
+        return len(messages)
+
+    def submit(self, message):
+        """Journals one message (from new_chat_message) and queues it; returns once the journal record is on disk."""
+        self.journal.wait_durable(self.enqueue(message))
+
+    def enqueue(self, message):
+        """
+        Appends one message to the journal and queues it, without waiting for the fsync.
+        Returns the journal sequence number to pass to journal.wait_durable().
+        """
+        record = encode_chat_journal_record(message)
+        with self._lock:
+            self._start_locked()
+            # Appending under our lock keeps the queue in journal order, which mark_committed relies on
+            seq = self.journal.append(record)
+            self._queue.append((seq, message))
+            queued = len(self._queue)
+        if queued == 1:
+            self._wake.set()
+        if queued >= CHAT_FLUSH_BATCH_SIZE:
+            self._batch_full.set()
+        return seq
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            self._batch_full.wait(CHAT_FLUSH_INTERVAL_SECONDS) # Let a burst accumulate into one transaction
+            self._batch_full.clear()
+            try:
+                run_blocking(self.flush)
+                self.announce_stored()
+            except Exception as e:
+                print(f"Chat write-behind error: {e}")
+                time.sleep(1) # Rows stay queued (and journaled); retry
+                self._wake.set()
+
+    def flush(self):
+        """Writes everything queued so far, CHAT_FLUSH_BATCH_SIZE rows per transaction."""
+        with self._flush_lock, app.app_context():
+            while True:
+                with self._lock:
+                    batch = self._queue[:CHAT_FLUSH_BATCH_SIZE]
+                if not batch:
+                    return
+                try:
+                    db.session.execute(_private_chat_insert_ignore(), [message for _, message in batch])
+                    stored = db.session.execute(
+                        db.select(PrivateChat.id, PrivateChat.message_uid, PrivateChat.sender_id, PrivateChat.recipient_id)
+                        .where(PrivateChat.message_uid.in_([message['message_uid'] for _, message in batch]))
+                    ).all()
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    raise
+                with self._lock:
+                    del self._queue[:len(batch)] # Only flush() removes entries, so these are still the head
+                    self._stored.extend(stored)
+                self.journal.mark_committed(batch[-1][0])
+
+    def announce_stored(self):
+        """
+        Tells both participants the ids that flushed messages were stored under. Live messages
+        are relayed with only a uid, and this is what lets a client move its sync cursor past them.
+        """
+        with self._lock:
+            stored, self._stored = self._stored, []
+        by_room = {}
+        for row in stored:
+            for user_id, friend_id in ((row.sender_id, row.recipient_id), (row.recipient_id, row.sender_id)):
+                by_room.setdefault((user_id, friend_id), []).append({'uid': row.message_uid, 'id': row.id})
+        for (user_id, friend_id), messages in by_room.items():
+            socketio.emit('messages_stored', {'friend_id': friend_id, 'messages': messages}, room=str(user_id))
+
+
+chat_write_behind = ChatWriteBehind(ChatJournal(CHAT_JOURNAL_DIR, None if SOCKETIO_MESSAGE_QUEUE else 'chat-journal.bin'))
+
+
+def load_public_key(user_id):
+    with app.app_context():
+        target_user = db.session.get(User, user_id)
+        return target_user.public_key if target_user else None
+
+
+def decode_encrypted_message(encrypted_message):
+    """
+    Returns (ciphertext, nonce) as bytes from {ciphertext, nonce}. Current clients send
+    Socket.IO binary attachments, which arrive as bytes and are used as-is; older clients
+    send base64 strings, decoded once here. Raises ValueError if the envelope is malformed.
+    """
+    if not isinstance(encrypted_message, dict):
+        raise ValueError('encrypted_message must be an object')
+    fields = []
+    for field in ('ciphertext', 'nonce'):
+        value = encrypted_message.get(field)
+        if isinstance(value, str):
+            value = sodium_b64decode(value)
+        elif isinstance(value, bytearray):
+            value = bytes(value)
+        elif not isinstance(value, bytes):
+            raise ValueError(f'{field} must be bytes or base64')
+        fields.append(value)
+    ciphertext, nonce = fields
+    if len(nonce) != CHAT_NONCE_BYTES or not 0 < len(ciphertext) <= CHAT_MAX_CIPHERTEXT_BYTES:
+        raise ValueError('ciphertext or nonce has the wrong size')
+    return ciphertext, nonce
+
+
+@socketio.on('connect')
 def handle_connect():
+    ensure_database_ready() # Socket.IO events skip before_request
+    start_background_services()
     user_id = session.get('user_id')
     if user_id:
         join_room(str(user_id))
@@ -883,53 +3408,72 @@ def handle_connect():
         print("Unauthenticated user tried to connect to SocketIO.")
         return False
 
+@socketio.on('disconnect')
 def handle_disconnect():
     user_id = session.get('user_id')
     if user_id:
         leave_room(str(user_id))
         print(f"User {user_id} disconnected.")
 
+@socketio.on('send_encrypted_message')
 def handle_send_encrypted_message(data):
     sender_id = session.get('user_id')
+    if not sender_id or not isinstance(data, dict):
+        return {'ok': False, 'error': 'Invalid message.'}
     recipient_id = data.get('recipient_id')
     encrypted_message = data.get('encrypted_message') # This is the object: {ciphertext, nonce}
 
-    if not sender_id or not recipient_id or not encrypted_message:
+    try:
+        recipient_id = int(recipient_id)
+        ciphertext, nonce = decode_encrypted_message(encrypted_message)
+    except (TypeError, ValueError):
+        recipient_id = None
+    if not recipient_id:
         print("Invalid encrypted message data received.")
-        return
+        return {'ok': False, 'error': 'Invalid message.'}
 
-    # **Store the encrypted message in the database**
-    # Store the encrypted_message object as a JSON string
-    new_message = PrivateChat(
-        sender_id=sender_id,
-        recipient_id=recipient_id,
-        encrypted_content=json.dumps(encrypted_message) # Convert dict to JSON string
-    )
-    db.session.add(new_message)
-    db.session.commit()
-    print(f"Stored encrypted message from {sender_id} to {recipient_id} in DB.")
+    message = new_chat_message(sender_id, recipient_id, ciphertext, nonce)
+    timestamp = message['timestamp'].isoformat()
+
+    # **Store the encrypted message**: appended to the journal before anyone sees it, written to
+    # the database by the write-behind flusher a few milliseconds later (on a native thread, see run_blocking)
+    try:
+        seq = run_blocking(chat_write_behind.enqueue, message)
+    except Exception as e:
+        print(f"Could not journal chat message from {sender_id}: {e}")
+        return {'ok': False, 'error': 'Message could not be saved. Please try again.'}
 
-    # Relay the encrypted message to the recipient's room
-    # The server does NOT decrypt the message here.
+    # Relay the encrypted message to the recipient's room straight away, as binary attachments:
+    # the same bytes we received, never re-encoded. The server does NOT decrypt the message here.
     emit('receive_encrypted_message', {
+        'uid': message['message_uid'],
         'sender_id': sender_id,
-        'encrypted_message': encrypted_message
+        'encrypted_message': {'ciphertext': ciphertext, 'nonce': nonce},
+        'timestamp': timestamp
     }, room=str(recipient_id))
-    print(f"Relayed encrypted message from {sender_id} to {recipient_id}")
 
+    # The fsync overlaps the relay; the sender's ack still waits for the record to be on disk
+    try:
+        run_blocking(chat_write_behind.journal.wait_durable, seq)
+    except Exception as e:
+        print(f"Could not sync chat journal for message {message['message_uid']}: {e}")
+        return {'ok': False, 'uid': message['message_uid'], 'error': 'Message may not have been saved.'}
+    return {'ok': True, 'uid': message['message_uid'], 'timestamp': timestamp} # Acknowledgement for the sender
+
+@socketio.on('request_public_key')
 def handle_request_public_key(data):
     requester_id = session.get('user_id')
-    target_user_id = data.get('target_user_id')
+    target_user_id = data.get('target_user_id') if isinstance(data, dict) else None
 
     if not requester_id or not target_user_id:
         print("Invalid public key request.")
         return
 
-    target_user = User.query.get(target_user_id)
-    if target_user and target_user.public_key:
+    public_key = run_blocking(load_public_key, target_user_id)
+    if public_key:
         emit('receive_public_key', {
             'user_id': target_user_id,
-            'public_key': target_user.public_key
+            'public_key': public_key
         }, room=str(requester_id))
         print(f"Sent public key of {target_user_id} to {requester_id}")
     else:
@@ -937,6 +3481,104 @@ def handle_request_public_key(data):
         emit('public_key_not_found', {'user_id': target_user_id}, room=str(requester_id))
 
 
+# --- Delta sync ---
+# On (re)connect the client sends sync_conversations with the newest PrivateChat id it has
+# per conversation. Only newer rows come back, CHAT_SYNC_BATCH_SIZE per sync_batch; the
+# client answers each batch with sync_ack, which is recorded in ChatSyncState and releases
+# the next batch, so a sync cut off by a dropped connection resumes where it stopped.
+# ids are assigned in the order rows are flushed, so a message the write-behind stored
+# late is still "after" anything the client saw before it. Messages relayed live carry
+# only a uid; messages_stored later maps uids to ids so the client's cursor keeps up, and
+# the client acks that cursor too, keeping ChatSyncState current for cursorless resumes.
+CHAT_SYNC_BATCH_SIZE = 100
+CHAT_SYNC_MAX_CONVERSATIONS = 50
+
+
+def load_sync_batch(user_id, friend_id, after_id):
+    """
+    Messages in the conversation with id > after_id (falls back to the last id the user
+    acknowledged). Returns (serialized messages, has_more); nothing without a starting point,
+    since a client without history loads the chat page instead.
+    """
+    chat_write_behind.flush() # So messages still queued in this process are included
+    with app.app_context():
+        key = conversation_key(user_id, friend_id)
+        if after_id is None:
+            state = ChatSyncState.query.filter_by(user_id=user_id, conversation_id=key).first()
+            if state is None:
+                return [], False
+            after_id = state.last_acked_id
+        messages = PrivateChat.query.filter(
+            PrivateChat.conversation_id == key, PrivateChat.id > after_id
+        ).order_by(PrivateChat.id).limit(CHAT_SYNC_BATCH_SIZE + 1).all()
+        has_more = len(messages) > CHAT_SYNC_BATCH_SIZE
+        return [serialize_chat_message(message, binary=True) for message in messages[:CHAT_SYNC_BATCH_SIZE]], has_more
+
+
+def record_sync_ack(user_id, friend_id, last_id):
+    with app.app_context():
+        key = conversation_key(user_id, friend_id)
+        state = ChatSyncState.query.filter_by(user_id=user_id, conversation_id=key).first()
+        if state is None:
+            state = ChatSyncState(user_id=user_id, conversation_id=key, last_acked_id=0)
+            db.session.add(state)
+        state.last_acked_id = max(state.last_acked_id or 0, last_id)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback() # Another tab created the row first; its ack is as good as ours
+
+
+def emit_sync_batch(user_id, friend_id, after_id):
+    messages, has_more = run_blocking(load_sync_batch, user_id, friend_id, after_id)
+    chat_write_behind.announce_stored() # Rows the sync's flush wrote
+    emit('sync_batch', {
+        'friend_id': friend_id,
+        'messages': messages,
+        'last_id': messages[-1]['id'] if messages else after_id,
+        'has_more': has_more
+    }) # To this socket only
+    return len(messages)
+
+
+def optional_int(value):
+    if value is None:
+        return None
+    value = int(value)
+    if value < 0:
+        raise ValueError('negative id')
+    return value
+
+
+@socketio.on('sync_conversations')
+def handle_sync_conversations(data):
+    user_id = session.get('user_id')
+    conversations = data.get('conversations') if isinstance(data, dict) else None
+    if not user_id or not isinstance(conversations, list) or len(conversations) > CHAT_SYNC_MAX_CONVERSATIONS:
+        return {'ok': False, 'error': 'Invalid sync request.'}
+    try:
+        wanted = [(int(entry['friend_id']), optional_int(entry.get('last_seen_id'))) for entry in conversations]
+    except (TypeError, ValueError, KeyError):
+        return {'ok': False, 'error': 'Invalid sync request.'}
+    sent = sum(emit_sync_batch(user_id, friend_id, last_seen_id) for friend_id, last_seen_id in wanted)
+    return {'ok': True, 'messages': sent}
+
+
+@socketio.on('sync_ack')
+def handle_sync_ack(data):
+    user_id = session.get('user_id')
+    try:
+        friend_id = int(data['friend_id'])
+        last_id = optional_int(data['last_id'])
+    except (TypeError, ValueError, KeyError):
+        return {'ok': False, 'error': 'Invalid acknowledgement.'}
+    if not user_id or last_id is None:
+        return {'ok': False, 'error': 'Invalid acknowledgement.'}
+    run_blocking(record_sync_ack, user_id, friend_id, last_id)
+    if data.get('has_more'):
+        emit_sync_batch(user_id, friend_id, last_id)
+    return {'ok': True}
+
 
 @app.route('/block-user', methods=['POST'])
 def block_user():
@@ -1042,6 +3684,7 @@ def upload_project():
         'projectDescription': '',
         'keyInnovations': '',
         'contactEmail': '',
+        'projectTags': '',
         'visibility': 'public'  # Default to public for initial GET request or repopulation
     }
 
@@ -1050,6 +3693,7 @@ def upload_project():
         project_description = request.form.get('projectDescription', '').strip()
         key_innovations = request.form.get('keyInnovations', '').strip()
         contact_email = request.form.get('contactEmail', '').strip()
+        project_tags_raw = request.form.get('projectTags', '').strip()
         # --- NEW: Get visibility from form ---
         visibility = request.form.get('visibility', 'public') # Default to 'public' if not found
 
@@ -1058,6 +3702,7 @@ def upload_project():
         form_data['projectDescription'] = project_description
         form_data['keyInnovations'] = key_innovations
         form_data['contactEmail'] = contact_email
+        form_data['projectTags'] = project_tags_raw
         form_data['visibility'] = visibility # --- NEW: Repopulate visibility ---
 
         # --- Validation ---
@@ -1076,6 +3721,10 @@ def upload_project():
         if key_innovations and len(key_innovations) > 2000:
             errors['keyInnovations'] = 'Key Innovations cannot exceed 2000 characters.'
 
+        tag_names = parse_tag_names(project_tags_raw)
+        if len(tag_names) > MAX_TAGS_PER_PROJECT:
+            errors['projectTags'] = f'Please use at most {MAX_TAGS_PER_PROJECT} tags.'
+
         if not contact_email:
             errors['contactEmail'] = 'Your Contact Email is required.'
         elif not is_valid_email(contact_email): # Assuming is_valid_email is defined elsewhere
@@ -1099,10 +3748,9 @@ def upload_project():
                         errors['supportingFiles'] = f'File "{file_storage.filename}" is not an allowed type. Accepted: {", ".join(app.config["UPLOADED_PROJECTS_ALLOW"])}'
                         break
                     
-                    # Validate file size
-                    file_storage.seek(0, os.SEEK_END)
-                    file_size = file_storage.tell()
-                    file_storage.seek(0)
+                    # Validate file size (oversized files are normally stopped with a 413 while
+                    # streaming, see UPLOAD_STREAM_RULES; this keeps the inline form error)
+                    file_size = uploaded_size(file_storage)
                     
                     if file_size > max_file_size_bytes:
                         errors['supportingFiles'] = f'File "{file_storage.filename}" exceeds the {max_file_size_bytes / (1024 * 1024):.0f}MB limit.'
@@ -1110,7 +3758,7 @@ def upload_project():
                     
                     # If file is valid, save it
                     try:
-                        filename = projects_uploads.save(file_storage)
+                        filename = save_upload_blob(file_storage, 'project_uploads')
                         uploaded_file_paths.append(filename)
                     except Exception as e:
                         errors['supportingFiles'] = f'Could not save file "{file_storage.filename}": {e}'
@@ -1131,6 +3779,9 @@ def upload_project():
                 visibility=visibility  # --- NEW: Save visibility ---
             )
             db.session.add(new_project_idea)
+            set_project_tags(new_project_idea, tag_names)
+            db.session.flush() # Assigns the id used as the search index rowid
+            index_project_idea(new_project_idea)
             db.session.commit()
             flash('Your project idea has been submitted successfully!', 'success')
             return redirect(url_for('dashboard')) # Redirect to a confirmation page or dashboard
@@ -1144,6 +3795,204 @@ def upload_project():
 
 
 
+# --- Project catalog (shared by view_projects, browse_projects, admin and fork pages) ---
+PROJECT_PAGE_SIZE = 20
+
+
+def encode_keyset_cursor(sort_value, row_id):
+    """Opaque cursor pointing just past the last row of a page."""
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+    raw = json.dumps([sort_value, row_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_keyset_cursor(cursor):
+    """Returns (sort_value, id) or raises ValueError for a malformed cursor."""
+    try:
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return sort_value, int(row_id)
+    except Exception:
+        raise ValueError('Invalid cursor.')
+
+
+def project_catalog_query(viewer_id=None, include_private=False, owner_id=None):
+    """
+    Base catalog query with visibility applied in SQL: admins (include_private) see
+    everything, an owner listing sees all of their own projects, everyone else sees
+    public projects plus their own private ones. The author is joined into the same
+    query and tags come from one selectin query, so a page costs two queries.
+    """
+    query = ProjectIdea.query.options(db.joinedload(ProjectIdea.author))
+    if owner_id is not None:
+        query = query.filter(ProjectIdea.user_id == owner_id)
+    elif not include_private:
+        visible = ProjectIdea.visibility == 'public'
+        if viewer_id is not None:
+            visible = db.or_(visible, ProjectIdea.user_id == viewer_id)
+        query = query.filter(visible)
+    return query
+
+
+def project_catalog_page(query, cursor=None, limit=PROJECT_PAGE_SIZE):
+    """
+    Newest-first page of a catalog query, keyset-paginated on (submission_date, id).
+    Returns (projects, next_cursor); an invalid cursor restarts from the first page.
+    """
+    if cursor:
+        try:
+            last_date, last_id = decode_keyset_cursor(cursor)
+            last_date = datetime.fromisoformat(last_date)
+            query = query.filter(db.or_(
+                ProjectIdea.submission_date < last_date,
+                db.and_(ProjectIdea.submission_date == last_date, ProjectIdea.id < last_id)
+            ))
+        except (ValueError, TypeError):
+            pass
+    projects = query.order_by(ProjectIdea.submission_date.desc(), ProjectIdea.id.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(projects) > limit:
+        projects = projects[:limit]
+        next_cursor = encode_keyset_cursor(projects[-1].submission_date, projects[-1].id)
+    return projects, next_cursor
+
+
+# --- Project idea search (SQLite FTS5) ---
+PROJECT_SEARCH_LIMIT = 200
+
+# One FTS5 row per ProjectIdea (rowid = project id). The author column holds the
+# submitter's name and reg number so "all fields" search needs no join to User;
+# attachments holds the text extracted from its uploaded documents.
+PROJECT_SEARCH_DDL = """CREATE VIRTUAL TABLE IF NOT EXISTS project_search USING fts5(
+    title, description, innovations, contact_email, author, attachments, tokenize='porter unicode61 remove_diacritics 2')"""
+
+# bm25() weights, in column order: a title hit outranks a description hit, and so on
+PROJECT_SEARCH_WEIGHTS = (10.0, 4.0, 3.0, 1.0, 2.0, 1.5)
+
+# search_type values from search_projects.html that map to a single FTS column
+PROJECT_SEARCH_COLUMNS = {'title': 'title', 'description': 'description', 'innovations': 'innovations', 'author': 'author'}
+
+# snippet() wraps matches in these control characters; they are swapped for <mark>
+# only after the snippet text has been HTML-escaped
+SNIPPET_OPEN, SNIPPET_CLOSE = '\x02', '\x03'
+
+
+def fts_table_available(sess, table_name):
+    """True when the named FTS table exists on the session's (SQLite) database."""
+    if sess.get_bind().dialect.name != 'sqlite':
+        return False
+    return sess.execute(db.text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+    ), {'name': table_name}).first() is not None
+
+
+def _project_search_row(idea):
+    author = idea.author
+    return {
+        'id': idea.id,
+        'title': idea.title,
+        'description': idea.description,
+        'innovations': idea.innovations or '',
+        'contact_email': idea.contact_email,
+        'author': f'{author.fullname} {author.regno}' if author else '',
+        'attachments': project_attachment_text(idea),
+    }
+
+
+def index_project_idea(idea):
+    """
+    Adds or replaces one project's row in project_search. Runs in the caller's
+    transaction, so the index commits (or rolls back) together with the project.
+    """
+    if not fts_table_available(db.session, 'project_search'):
+        return
+    db.session.execute(db.text("DELETE FROM project_search WHERE rowid = :id"), {'id': idea.id})
+    db.session.execute(db.text(
+        "INSERT INTO project_search(rowid, title, description, innovations, contact_email, author, attachments) "
+        "VALUES (:id, :title, :description, :innovations, :contact_email, :author, :attachments)"
+    ), _project_search_row(idea))
+
+
+def unindex_project_idea(project_id):
+    """Removes a deleted project from project_search."""
+    if fts_table_available(db.session, 'project_search'):
+        db.session.execute(db.text("DELETE FROM project_search WHERE rowid = :id"), {'id': project_id})
+
+
+def ensure_project_search_index(rebuild=False):
+    """Creates project_search on SQLite and fills it when it is new (or when rebuild=True)."""
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    try:
+        existed = fts_table_available(db.session, 'project_search')
+        if existed:
+            columns = {row[1] for row in db.session.execute(db.text("PRAGMA table_info(project_search)"))}
+            if 'attachments' not in columns: # Created before attachment text was indexed
+                db.session.execute(db.text("DROP TABLE project_search"))
+                existed = False
+        db.session.execute(db.text(PROJECT_SEARCH_DDL))
+        if rebuild or not existed:
+            db.session.execute(db.text("DELETE FROM project_search"))
+            for idea in ProjectIdea.query.options(db.joinedload(ProjectIdea.author)).yield_per(500):
+                index_project_idea(idea)
+        db.session.commit()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        print(f"Project search index unavailable: {e}")
+        return False
+
+
+def build_project_match(search_text, search_type='all'):
+    """
+    Turns free text into an FTS5 query: every word must match, as a prefix, so
+    "smart agri" finds "Smart Agriculture". Returns None when there is nothing to search.
+    """
+    terms = re.findall(r'\w+', search_text)
+    if not terms:
+        return None
+    expression = ' '.join(f'"{term}"*' for term in terms)
+    column = PROJECT_SEARCH_COLUMNS.get(search_type)
+    return f'{column} : ({expression})' if column else expression
+
+
+def search_project_ideas(search_text, search_type='all', viewer_id=None, tag_name=None, limit=PROJECT_SEARCH_LIMIT):
+    """
+    One probe of project_search, ranked by BM25. Returns (project ids best match
+    first, {project id: highlighted snippet as Markup}). Visibility (public projects
+    plus the viewer's own, as in project_catalog_query) and the optional tag are
+    applied in the same query, before the limit, so hidden matches can't crowd
+    visible ones out of the top results.
+    """
+    match = build_project_match(search_text, search_type)
+    if not match:
+        return [], {}
+    conditions = ["project_search MATCH :match", "(project_idea.visibility = 'public' OR project_idea.user_id = :viewer_id)"]
+    if tag_name:
+        conditions.append(
+            "EXISTS (SELECT 1 FROM project_tags JOIN tag ON tag.id = project_tags.tag_id "
+            "WHERE project_tags.project_id = project_idea.id AND tag.name = :tag_name)"
+        )
+    rows = db.session.execute(db.text(
+        "SELECT project_search.rowid, snippet(project_search, -1, :open, :close, '...', 16) "
+        "FROM project_search JOIN project_idea ON project_idea.id = project_search.rowid "
+        f"WHERE {' AND '.join(conditions)} "
+        f"ORDER BY bm25(project_search, {', '.join(str(w) for w in PROJECT_SEARCH_WEIGHTS)}) LIMIT :limit"
+    ), {'open': SNIPPET_OPEN, 'close': SNIPPET_CLOSE, 'match': match, 'viewer_id': viewer_id,
+        'tag_name': tag_name, 'limit': limit}).all()
+
+    snippets = {}
+    for project_id, snippet in rows:
+        escaped = str(escape(snippet))
+        snippets[project_id] = Markup(escaped.replace(SNIPPET_OPEN, '<mark>').replace(SNIPPET_CLOSE, '</mark>'))
+    return [project_id for project_id, _ in rows], snippets
+
+
+def year_range_filter(column, year):
+    """column falls within the calendar year, as a range the column's index can use."""
+    return db.and_(column >= datetime(year, 1, 1), column < datetime(year + 1, 1, 1))
+
+
 # NEW ROUTE: Tag & Search Projects
 @app.route('/browse_projects')
 def browse_projects():
@@ -1160,67 +4009,66 @@ def browse_projects():
         flash("You are not eligible to vote. Please ensure your dues are cleared.", "warning")
         return redirect(url_for('dashboard'))
 
-    # Initialize query with all projects
-    query = ProjectIdea.query.order_by(ProjectIdea.submission_date.desc())
+    # Public projects plus the viewer's own private ones
+    query = project_catalog_query(viewer_id=user.id)
 
     search_query = request.args.get('search_query', '').strip()
     search_type = request.args.get('search_type', 'all').strip()
     selected_tag_name = request.args.get('tag', '').strip() # For tag filtering
 
+    snippets = {}
+    ranked_ids = None
     if search_query:
-        if search_type == 'title':
-            query = query.filter(ProjectIdea.title.ilike(f'%{search_query}%'))
-        elif search_type == 'description':
-            query = query.filter(ProjectIdea.description.ilike(f'%{search_query}%'))
-        elif search_type == 'innovations':
-            query = query.filter(ProjectIdea.innovations.ilike(f'%{search_query}%'))
-        elif search_type == 'author':
-            # This assumes 'author' (User model) has a 'fullname' or 'regno' field
-            query = query.join(User).filter(
-                (User.fullname.ilike(f'%{search_query}%')) |
-                (User.regno.ilike(f'%{search_query}%'))
-            )
-        elif search_type == 'year':
-            # Assuming submission_date is a DateTime object
+        if search_type == 'year':
             try:
                 search_year = int(search_query)
-                query = query.filter(func.strftime('%Y', ProjectIdea.submission_date) == str(search_year))
+                query = query.filter(year_range_filter(ProjectIdea.submission_date, search_year))
             except ValueError:
                 flash('Invalid year format for search.', 'danger')
                 search_query = '' # Clear invalid query
-        else: # 'all' or no specific type
+        elif fts_table_available(db.session, 'project_search'):
+            # One ranked probe of the full-text index instead of an ILIKE scan per column
+            ranked_ids, snippets = search_project_ideas(search_query, search_type, viewer_id=user.id, tag_name=selected_tag_name)
+            query = query.filter(ProjectIdea.id.in_(ranked_ids))
+        elif search_type in PROJECT_SEARCH_COLUMNS and search_type != 'author':
+            query = query.filter(getattr(ProjectIdea, search_type).ilike(f'%{search_query}%'))
+        elif search_type == 'author':
+            # This assumes 'author' (User model) has a 'fullname' or 'regno' field
+            query = query.join(User).filter(
+                (User.fullname.ilike(f'%{search_query}%')) |
+                (User.regno.ilike(f'%{search_query}%'))
+            )
+        else: # 'all' or no specific type, on databases without FTS5
             query = query.filter(
                 (ProjectIdea.title.ilike(f'%{search_query}%')) |
                 (ProjectIdea.description.ilike(f'%{search_query}%')) |
                 (ProjectIdea.innovations.ilike(f'%{search_query}%')) |
                 (ProjectIdea.contact_email.ilike(f'%{search_query}%')) |
-                # Add author search to 'all' if user model is joined
                 (ProjectIdea.author.has(
                     (User.fullname.ilike(f'%{search_query}%')) |
                     (User.regno.ilike(f'%{search_query}%'))
                 ))
             )
-            # If using actual tags relationship, add tag search here for 'all'
-            # query = query.filter(ProjectIdea.tags.any(Tag.name.ilike(f'%{search_query}%')))
 
 
-    # Filter by specific tag if selected
+    # Filter by specific tag if selected: one join through ix_project_tags_tag_project,
+    # combined with any text search above
     if selected_tag_name:
-        # If using Tag model and relationship:
-        # query = query.join(ProjectIdea.tags).filter(Tag.name == selected_tag_name)
-
-        # If tags are comma-separated in ProjectIdea.file_paths (bad practice, but handles existing data)
-        # This is a very inefficient way to search tags, reconsider your model
-        # query = query.filter(ProjectIdea.file_paths.ilike(f'%{selected_tag_name}%'))
-        pass # Handle tags based on your actual model setup
-
-    project_ideas = query.all()
+        query = query.join(project_tags, project_tags.c.project_id == ProjectIdea.id) \
+                     .join(Tag, Tag.id == project_tags.c.tag_id) \
+                     .filter(Tag.name == selected_tag_name)
+
+    next_cursor = None
+    if ranked_ids is not None:
+        # Ranked search results (capped at PROJECT_SEARCH_LIMIT) keep the BM25 order
+        project_ideas = query.all()
+        rank = {project_id: position for position, project_id in enumerate(ranked_ids)}
+        project_ideas.sort(key=lambda idea: rank[idea.id])
+    else:
+        project_ideas, next_cursor = project_catalog_page(query, request.args.get('cursor'))
 
-    # Get all unique tags for the tag cloud/filter (if you have a Tag model)
-    # If using ProjectIdea.tags relationship:
-    all_tags = Tag.query.order_by(Tag.name).all()
-    # If not using a Tag model, you'd need to parse tags from ProjectIdea.file_paths
-    # or a dedicated 'tags' column, which would be more complex and less efficient.
+    # Tag cloud with per-tag project counts (cached; see TagCloudCache)
+    all_tags = tag_cloud_cache.tags()
 
     return render_template(
         'search_projects.html',
@@ -1228,7 +4076,9 @@ def browse_projects():
         search_query=search_query,
         search_type=search_type,
         all_tags=all_tags,
-        selected_tag_name=selected_tag_name
+        selected_tag_name=selected_tag_name,
+        snippets=snippets,
+        next_cursor=next_cursor
     )
 
 
@@ -1241,9 +4091,10 @@ def view_projects():
         flash('Please log in to upload a project.', 'danger')
         return redirect(url_for('login'))
 
-    # Fetch all project ideas from the database, ordered by submission date (newest first)
-    project_ideas = ProjectIdea.query.order_by(ProjectIdea.submission_date.desc()).all()
-    return render_template('view_projects.html', project_ideas=project_ideas)
+    # One page of visible project ideas, newest first
+    project_ideas, next_cursor = project_catalog_page(project_catalog_query(viewer_id=session['user_id']),
+                                                      request.args.get('cursor'))
+    return render_template('view_projects.html', project_ideas=project_ideas, next_cursor=next_cursor)
 
 
 # Route for displaying a single project's details
@@ -1266,7 +4117,7 @@ def edit_project(project_id):
     project = ProjectIdea.query.get_or_404(project_id)
     if project.user_id != session['user_id']:
         flash('You are not authorized to edit this project.', 'danger')
-        return redirect(url_for('my_projects'))
+        return redirect(url_for('view_projects'))
     return f"<h1>Edit Project: {project.title}</h1><p>This would be the project editing form.</p>"
 
 @app.route("/delete_project/<int:project_id>")
@@ -1277,12 +4128,16 @@ def delete_project(project_id):
     project = ProjectIdea.query.get_or_404(project_id)
     if project.user_id != session['user_id']:
         flash('You are not authorized to delete this project.', 'danger')
-        return redirect(url_for('my_projects'))
+        return redirect(url_for('view_projects'))
     
+    clear_project_tags(project)
+    for file_path in (project.file_paths or '').split(','):
+        release_blob(file_path.strip(), 'project_uploads')
     db.session.delete(project)
+    unindex_project_idea(project.id)
     db.session.commit()
     flash(f'Project "{project.title}" deleted successfully!', 'success')
-    return redirect(url_for('my_projects'))
+    return redirect(url_for('view_projects'))
 
 # If this page lists ALL forked/collaborated work for the user
 @app.route("/fork_collaborate_page")
@@ -1294,12 +4149,13 @@ def fork_collaborate_page():
     current_user_id = session['user_id']
     # Fetch projects where the user is the owner, and perhaps also filter for those that were forked
     # (You might need a new column in ProjectIdea, like `original_project_id` if you want to track forks specifically)
-    forked_projects = ProjectIdea.query.filter_by(user_id=current_user_id).order_by(ProjectIdea.submission_date.desc()).all()
+    forked_projects, next_cursor = project_catalog_page(project_catalog_query(owner_id=current_user_id),
+                                                        request.args.get('cursor'))
     # Or, if you want a page specifically for FORKS, you need a way to differentiate them.
     # For now, let's just assume it lists *all* projects of the user if you don't have a 'forked' flag.
     # If you have a column like 'is_forked_from_id', you'd filter by that.
 
-    return render_template('fork.html', project_ideas=forked_projects) # Assuming fork.html iterates over project_ideas
+    return render_template('fork.html', project_ideas=forked_projects, next_cursor=next_cursor) # Assuming fork.html iterates over project_ideas
 
 
 
@@ -1464,14 +4320,15 @@ def create_blog_post():
     media_type = None
 
     if media_file and allowed_file(media_file.filename):
-        filename = secure_filename(media_file.filename)
-        unique_filename = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{filename}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
         try:
-            media_file.save(filepath)
-            media_path = url_for('static', filename=f'uploads/{unique_filename}')
+            # Content-addressed name: re-posting the same picture reuses the stored file
+            stored_filename = save_upload_blob(media_file, 'uploads', IMAGE_KINDS)
+            media_path = url_for('static', filename=f'uploads/{stored_filename}')
             media_type = media_file.mimetype.split('/')[0] # 'image' or 'video'
             flash('Media uploaded successfully!', 'info')
+        except UploadRejected as e:
+            flash(str(e), 'error')
+            return redirect(url_for('create_blog_post_page', status='error', message='Invalid media file type!'))
         except Exception as e:
             print(f"Error saving file: {e}")
             flash('Error uploading media. Please try again.', 'error')
@@ -1735,48 +4592,395 @@ def admin_logout():
 
 
 # --- Helper Functions for Text Extraction ---
+# Project attachments are read in a process pool once their upload commits, so the
+# request returns straight away. Results are cached in ExtractedText by content hash
+# and feed the "attachments" column of project_search.
+TEXT_EXTRACTION_WORKERS = os.cpu_count() or 1 # OCR is CPU bound: one worker per core
+EXTRACTED_TEXT_MAX_CHARS = 1000000 # stored per document
+EXTRACTED_TEXT_INDEX_CHARS = 100000 # per document in project_search
+DOCX_MAX_XML_BYTES = 50 * 1024 * 1024 # refuse zip-bomb sized document.xml
+DOCX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+EXTRACTABLE_MIMETYPES = {'application/pdf', DOCX_MIMETYPE, 'text/plain', 'image/png', 'image/jpeg'}
+WORD_NAMESPACE = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+# Scans and photos: each page is rasterized, cleaned up and OCR'd as its own pool job
+OCR_DPI = 200
+OCR_MAX_EDGE = 3500 # pixels; bigger pages are downscaled before Tesseract sees them
+OCR_BINARIZE_THRESHOLD = 180 # 0-255, after autocontrast
+OCR_MIN_CHARS_PER_PAGE = 40 # a PDF with less real text than this is treated as scanned
+
+_text_extraction_pool = None
+_text_extraction_pool_lock = threading.Lock()
+_pending_extractions = set()
+_pending_extractions_lock = threading.Lock()
+
+
+class NeedsOcr(Exception):
+    """Raised by a worker when a document has no usable text layer; carries its page count."""
+
+    def __init__(self, pages):
+        super().__init__(pages)
+        self.pages = pages
+
+
+def prepare_page_for_ocr(image):
+    """Grayscale, downscale and binarize: Tesseract is faster and steadier on clean 1-bit pages."""
+    image = ImageOps.exif_transpose(image).convert('L')
+    image.thumbnail((OCR_MAX_EDGE, OCR_MAX_EDGE))
+    image = ImageOps.autocontrast(image)
+    return image.point(lambda value: 255 if value > OCR_BINARIZE_THRESHOLD else 0, mode='1')
+
+
+def pdf_page_count(doc_path):
+    if fitz is not None:
+        with fitz.open(doc_path) as pdf:
+            return len(pdf)
+    if pdfium is not None:
+        pdf = pdfium.PdfDocument(doc_path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+    if PyPDF2 is not None:
+        return len(PyPDF2.PdfReader(doc_path).pages)
+    raise RuntimeError('No PDF library installed (PyMuPDF, pypdfium2 or PyPDF2)')
+
+
+def render_pdf_page(doc_path, page_index):
+    """Rasterizes one PDF page to a grayscale PIL image at OCR_DPI."""
+    if fitz is not None:
+        with fitz.open(doc_path) as pdf:
+            pixmap = pdf[page_index].get_pixmap(dpi=OCR_DPI, colorspace=fitz.csGRAY)
+            return Image.frombytes('L', (pixmap.width, pixmap.height), pixmap.samples)
+    if pdfium is not None:
+        pdf = pdfium.PdfDocument(doc_path)
+        try:
+            return pdf[page_index].render(scale=OCR_DPI / 72, grayscale=True).to_pil()
+        finally:
+            pdf.close()
+    raise RuntimeError('No PDF rasterizer installed (PyMuPDF or pypdfium2)')
+
+
 def extract_text_from_image(image_path):
-    """Extracts text from an image using Tesseract OCR."""
+    """Extracts text from an image using Tesseract OCR. Returns (text, extractor)."""
+    if pytesseract is None:
+        raise RuntimeError('pytesseract is not installed')
+    with Image.open(image_path) as img:
+        return pytesseract.image_to_string(prepare_page_for_ocr(img)), 'tesseract'
+
+
+def extract_text_from_document(doc_path, mimetype):
+    """
+    Extracts text from a document based on its MIME type. Returns (text, extractor);
+    raises when the type is unsupported or no installed library can read it.
+    """
+    if mimetype == 'application/pdf':
+        if fitz is not None: # PyMuPDF is much faster than PyPDF2 and handles more layouts
+            with fitz.open(doc_path) as pdf:
+                return '\n'.join(page.get_text() for page in pdf), 'pymupdf'
+        if PyPDF2 is not None:
+            reader = PyPDF2.PdfReader(doc_path)
+            return '\n'.join(page.extract_text() or '' for page in reader.pages), 'pypdf2'
+        raise RuntimeError('No PDF library installed (PyMuPDF or PyPDF2)')
+    if mimetype == DOCX_MIMETYPE:
+        if docx is not None and hasattr(docx, 'Document'):
+            document = docx.Document(doc_path)
+            return '\n'.join(paragraph.text for paragraph in document.paragraphs), 'python-docx'
+        # A .docx is a zip; paragraphs are <w:p> and their text runs <w:t> in word/document.xml
+        with zipfile.ZipFile(doc_path) as archive:
+            if archive.getinfo('word/document.xml').file_size > DOCX_MAX_XML_BYTES:
+                raise RuntimeError('word/document.xml is too large')
+            root = ElementTree.fromstring(archive.read('word/document.xml'))
+        paragraphs = [''.join(node.text or '' for node in p.iter(f'{WORD_NAMESPACE}t')) for p in root.iter(f'{WORD_NAMESPACE}p')]
+        return '\n'.join(paragraphs), 'docx-xml'
+    if mimetype == 'text/plain':
+        with open(doc_path, 'r', encoding='utf-8', errors='replace') as file:
+            return file.read(), 'plain'
+    # .doc (application/msword) and friends need external tools
+    raise RuntimeError(f'Unsupported document type for extraction: {mimetype}')
+
+
+def run_text_extraction(path, mimetype):
+    """
+    Process-pool entry point. Touches only the file, never the database. Photos and
+    PDFs without a real text layer raise NeedsOcr so their pages can be fanned out.
+    """
+    if mimetype.startswith('image/'):
+        raise NeedsOcr(1)
+    text, extractor = extract_text_from_document(path, mimetype)
+    if mimetype == 'application/pdf':
+        pages = pdf_page_count(path)
+        if len((text or '').strip()) < OCR_MIN_CHARS_PER_PAGE * max(pages, 1):
+            raise NeedsOcr(pages)
+    return (text or '')[:EXTRACTED_TEXT_MAX_CHARS], extractor
+
+
+def run_page_ocr(path, mimetype, page_index):
+    """Process-pool entry point for one page of a scan (a photo is page 0)."""
+    if pytesseract is None:
+        raise RuntimeError('pytesseract is not installed')
+    image = render_pdf_page(path, page_index) if mimetype == 'application/pdf' else Image.open(path)
+    with image:
+        return pytesseract.image_to_string(prepare_page_for_ocr(image))
+
+
+def text_extraction_pool():
+    global _text_extraction_pool
+    with _text_extraction_pool_lock:
+        if _text_extraction_pool is None:
+            _text_extraction_pool = ProcessPoolExecutor(max_workers=TEXT_EXTRACTION_WORKERS)
+        return _text_extraction_pool
+
+
+def attachment_sha256(filename, folder='project_uploads'):
+    """Content hash of a stored attachment: blob-store names carry it, legacy files are hashed."""
+    stem = os.path.splitext(filename)[0]
+    if CONTENT_ADDRESSED_NAME.fullmatch(stem):
+        return stem
+    path = os.path.join(BLOB_FOLDERS[folder], filename)
+    if not os.path.exists(path):
+        return None
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(BLOB_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def queue_text_extraction(sha256, path):
+    """
+    Schedules extraction for a stored document unless its text is already cached (or
+    being extracted). The job is submitted only after the surrounding commit succeeds.
+    """
+    mimetype = mimetypes.guess_type(path)[0]
+    if mimetype not in EXTRACTABLE_MIMETYPES:
+        return False
+    with db.session.no_autoflush:
+        if ExtractedText.query.filter_by(sha256=sha256).first() is not None:
+            return False
+    jobs = db.session.info.setdefault('text_extractions', {})
+    if sha256 not in jobs:
+        db.session.add(ExtractedText(sha256=sha256, status='pending'))
+        jobs[sha256] = (path, mimetype)
+    return True
+
+
+def submit_text_extraction(sha256, path, mimetype):
+    with _pending_extractions_lock:
+        if sha256 in _pending_extractions:
+            return
+        _pending_extractions.add(sha256)
+    future = text_extraction_pool().submit(run_text_extraction, path, mimetype)
+    future.add_done_callback(partial(_store_extracted_text, sha256, path, mimetype))
+
+
+def reindex_projects_with_attachment(filename):
+    for idea in ProjectIdea.query.filter(ProjectIdea.file_paths.contains(filename)):
+        index_project_idea(idea)
+
+
+def _store_extracted_text(sha256, path, mimetype, future):
+    """Runs in the parent process when a job finishes: saves the text and reindexes its projects."""
+    filename = os.path.basename(path)
+    ocr_running = False
     try:
-        img = Image.open(image_path)
-        text = pytesseract.image_to_string(img)
-        return text
+        with app.app_context():
+            record = ExtractedText.query.filter_by(sha256=sha256).first()
+            if record is None:
+                record = ExtractedText(sha256=sha256)
+                db.session.add(record)
+            try:
+                record.text, record.extractor = future.result()
+                record.status, record.error = 'done', None
+            except NeedsOcr as e:
+                ocr_running = start_page_ocr(record, path, mimetype, e.pages)
+            except Exception as e:
+                record.status, record.error = 'failed', str(e)[:255]
+            db.session.flush()
+            if record.status == 'done':
+                reindex_projects_with_attachment(filename)
+            db.session.commit()
     except Exception as e:
-        print(f"Error extracting text from image {image_path}: {e}")
-        return None
+        print(f"Error saving extracted text for {filename}: {e}")
+        ocr_running = False
+        _mark_extraction_failed(sha256, e)
+    finally:
+        if not ocr_running: # Page OCR clears the flag once its last page is stored
+            with _pending_extractions_lock:
+                _pending_extractions.discard(sha256)
 
-def extract_text_from_document(doc_path, mimetype):
-    """Extracts text from a document based on its MIME type."""
-    text = None
+
+def start_page_ocr(record, path, mimetype, pages):
+    """
+    Fans a scanned document's pages out over the pool. Pages stored by an earlier,
+    interrupted run are kept. Returns True while page jobs are outstanding.
+    """
+    if pytesseract is None:
+        record.status, record.error = 'failed', 'Scanned document needs OCR, but pytesseract is not installed'
+        return False
+    stored = {number for (number,) in db.session.query(ExtractedTextPage.page_number).filter_by(sha256=record.sha256)}
+    record.status, record.extractor, record.error = 'ocr', 'tesseract', None
+    record.pages_total, record.pages_done = pages, len(stored)
+    db.session.commit() # Progress is visible before the first page finishes
+    missing = [page_index for page_index in range(pages) if page_index not in stored]
+    if not missing:
+        finish_page_ocr(record, path)
+        return False
+    for page_index in missing:
+        future = text_extraction_pool().submit(run_page_ocr, path, mimetype, page_index)
+        future.add_done_callback(partial(_store_ocr_page, record.sha256, path, page_index))
+    return True
+
+
+def _store_ocr_page(sha256, path, page_index, future):
+    """Saves one OCR'd page as soon as it is ready; the last page assembles the document."""
+    finished = False
     try:
-        if mimetype == 'application/pdf':
-            with open(doc_path, 'rb') as file:
-                reader = PyPDF2.PdfReader(file)
-                num_pages = len(reader.pages)
-                extracted_pages_text = []
-                for i in range(num_pages):
-                    page = reader.pages[i]
-                    extracted_pages_text.append(page.extract_text())
-                text = "\n".join(extracted_pages_text)
-        elif mimetype == 'application/msword' or mimetype == 'application/vnd.openxmlformats-officedocument.wordprocessingml.document':
-            # For .doc (application/msword), you might need a library like antiword or python-docx's older version.
-            # For .docx (application/vnd.openxmlformats-officedocument.wordprocessingml.document), python-docx works well.
-            # This example focuses on .docx
-            if mimetype == 'application/vnd.openxmlformats-officedocument.wordprocessingml.document':
-                doc = docx.Document(doc_path)
-                extracted_pages_text = [paragraph.text for paragraph in doc.paragraphs]
-                text = "\n".join(extracted_pages_text)
-            else: # .doc files are harder to parse directly in Python without external tools
-                text = f"Text extraction for {mimetype} is not fully supported without external tools."
-        elif mimetype == 'text/plain':
-            with open(doc_path, 'r', encoding='utf-8') as file:
-                text = file.read()
-        else:
-            text = f"Unsupported document type for extraction: {mimetype}"
+        with app.app_context():
+            try:
+                text, error = future.result(), None
+            except Exception as e:
+                text, error = '', str(e)[:255]
+            db.session.add(ExtractedTextPage(sha256=sha256, page_number=page_index, text=text, error=error))
+            db.session.execute(
+                db.update(ExtractedText).where(ExtractedText.sha256 == sha256).values(pages_done=ExtractedText.pages_done + 1)
+            )
+            db.session.commit()
+            record = ExtractedText.query.filter_by(sha256=sha256).first()
+            if record.status == 'ocr' and record.pages_done >= record.pages_total:
+                finish_page_ocr(record, path)
+                finished = True
+    except Exception as e:
+        print(f"Error saving OCR page {page_index} of {os.path.basename(path)}: {e}")
+        finished = True # The document can't complete now; --retry-failed resumes from the stored pages
+        _mark_extraction_failed(sha256, e)
+    finally:
+        if finished:
+            with _pending_extractions_lock:
+                _pending_extractions.discard(sha256)
+
+
+def _mark_extraction_failed(sha256, error):
+    """Records an error from a completion handler so the document isn't left 'pending' or 'ocr' forever."""
+    try:
+        with app.app_context():
+            db.session.execute(
+                db.update(ExtractedText).where(ExtractedText.sha256 == sha256).values(status='failed', error=str(error)[:255])
+            )
+            db.session.commit()
     except Exception as e:
-        print(f"Error extracting text from document {doc_path} ({mimetype}): {e}")
+        print(f"Error marking text extraction {sha256} as failed: {e}")
+
+
+def finish_page_ocr(record, path):
+    """Joins the stored pages into the document's text and reindexes its projects."""
+    pages = ExtractedTextPage.query.filter_by(sha256=record.sha256).order_by(ExtractedTextPage.page_number).all()
+    failed = sum(1 for page in pages if page.error)
+    record.text = '\n'.join(page.text or '' for page in pages)[:EXTRACTED_TEXT_MAX_CHARS]
+    record.status = 'failed' if pages and failed == len(pages) else 'done'
+    record.error = f'{failed} of {len(pages)} pages could not be read' if failed else None
+    db.session.flush()
+    if record.status == 'done':
+        reindex_projects_with_attachment(os.path.basename(path))
+    db.session.commit()
+
+
+def extraction_progress(sha256):
+    """Status of one document's extraction, for the progress API."""
+    record = ExtractedText.query.filter_by(sha256=sha256).first()
+    if record is None:
         return None
-    return text
+    progress = {'status': record.status, 'extractor': record.extractor, 'error': record.error,
+                'pages_done': record.pages_done, 'pages_total': record.pages_total}
+    if record.status == 'done':
+        progress['percent'] = 100
+    elif record.pages_total:
+        progress['percent'] = round(100 * record.pages_done / record.pages_total)
+    else:
+        progress['percent'] = 0
+    return progress
+
+
+@app.route('/api/attachments/<path:filename>/extraction')
+def attachment_extraction_status(filename):
+    if 'user_id' not in session and 'admin_id' not in session:
+        return jsonify({'error': 'Please log in first.'}), 401
+    filename = os.path.basename(filename)
+    # Only attachments of a project the caller can see (the same rule as the catalog); 404 rather than leak the file exists
+    candidates = project_catalog_query(viewer_id=session.get('user_id'), include_private='admin_id' in session) \
+        .filter(ProjectIdea.file_paths.contains(filename))
+    if not any(filename in (name.strip() for name in idea.file_paths.split(',')) for idea in candidates):
+        return jsonify({'error': 'No text extraction for this file.'}), 404
+    sha256 = attachment_sha256(filename)
+    progress = extraction_progress(sha256) if sha256 else None
+    if progress is None:
+        return jsonify({'error': 'No text extraction for this file.'}), 404
+    progress['filename'] = filename
+    return jsonify(progress)
+
+
+@db.event.listens_for(db.session, 'after_commit')
+def _submit_text_extractions(db_session):
+    for sha256, (path, mimetype) in db_session.info.pop('text_extractions', {}).items():
+        submit_text_extraction(sha256, path, mimetype)
+
+
+@db.event.listens_for(db.session, 'after_rollback')
+def _forget_text_extractions(db_session):
+    db_session.info.pop('text_extractions', None)
+
+
+def project_attachment_text(idea):
+    """Cached text of a project's attachments, for its project_search row."""
+    digests = {attachment_sha256(name.strip()) for name in (idea.file_paths or '').split(',') if name.strip()}
+    digests.discard(None)
+    if not digests:
+        return ''
+    texts = db.session.execute(
+        db.select(ExtractedText.text).where(ExtractedText.sha256.in_(digests), ExtractedText.status == 'done')
+    ).scalars()
+    return '\n'.join(text[:EXTRACTED_TEXT_INDEX_CHARS] for text in texts if text)
+
+
+@app.cli.command('extract-project-text')
+@click.option('--retry-failed', is_flag=True, help='Also retry documents whose extraction failed.')
+@click.option('--timeout', default=3600, show_default=True, help='Seconds to wait for the jobs before giving up.')
+def extract_project_text(retry_failed, timeout):
+    """
+    Extracts text for project attachments that have none cached yet (e.g. files from
+    before the service) and resumes page OCR that was interrupted.
+    """
+    statuses = ['pending', 'ocr', 'failed'] if retry_failed else ['pending', 'ocr']
+    jobs = {}
+    for idea in ProjectIdea.query.filter(ProjectIdea.file_paths.isnot(None)):
+        for name in idea.file_paths.split(','):
+            name = name.strip()
+            path = os.path.join(BLOB_FOLDERS['project_uploads'], name)
+            mimetype = mimetypes.guess_type(path)[0]
+            sha256 = attachment_sha256(name) if name else None
+            if sha256 is None or mimetype not in EXTRACTABLE_MIMETYPES:
+                continue
+            record = ExtractedText.query.filter_by(sha256=sha256).first()
+            if record is None or record.status in statuses:
+                jobs[sha256] = (path, mimetype)
+    # Same pool and completion handlers as uploads; wait until every job (and OCR page) is stored
+    for sha256, (path, mimetype) in jobs.items():
+        submit_text_extraction(sha256, path, mimetype)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with _pending_extractions_lock:
+            if not _pending_extractions:
+                break
+        time.sleep(0.2)
+    with _pending_extractions_lock:
+        unfinished = len(_pending_extractions)
+    db.session.expire_all()
+    done = ExtractedText.query.filter(ExtractedText.sha256.in_(list(jobs)), ExtractedText.status == 'done').count()
+    click.echo(f'Extracted text from {done} of {len(jobs)} attachments.')
+    if unfinished:
+        text_extraction_pool().shutdown(wait=False, cancel_futures=True) # Don't let exit wait on queued pages
+        click.echo(f'Gave up waiting on {unfinished} after {timeout}s; run the command again to resume them.')
+
 
 # ---
 # Show Results Route
@@ -1873,12 +5077,8 @@ def add_candidate():
                     flash("Please upload a profile picture.", "danger")
                     return redirect(url_for('add_candidate'))
                 
-                # File save logic
-                filename = secure_filename(profile_pic.filename)
-                upload_folder = os.path.join('static', 'uploads')
-                os.makedirs(upload_folder, exist_ok=True)
-                profile_path = os.path.join(upload_folder, filename)
-                profile_pic.save(profile_path)
+                # File save logic (content-addressed, shared with identical uploads)
+                filename = save_upload_blob(profile_pic, 'uploads', IMAGE_KINDS)
 
                 new_candidate = ElectoralCandidate(
                     fullname=fullname,
@@ -1962,20 +5162,9 @@ def edit_candidate(candidate_id):
         profile_pic = request.files['profile_pic']
         
         if profile_pic and profile_pic.filename:
-            # Delete old image
-            try:
-                old_path = os.path.join('static', 'uploads', candidate.profile_pic)
-                if os.path.exists(old_path):
-                    os.remove(old_path)
-            except Exception as e:
-                print(f"Error deleting old profile picture: {e}") 
-                
-            # Save new image
-            filename = secure_filename(profile_pic.filename)
-            upload_folder = os.path.join('static', 'uploads')
-            os.makedirs(upload_folder, exist_ok=True)
-            profile_path = os.path.join(upload_folder, filename)
-            profile_pic.save(profile_path)
+            # Save the new image first, then drop the old one's reference
+            filename = save_upload_blob(profile_pic, 'uploads', IMAGE_KINDS)
+            release_blob(candidate.profile_pic, 'uploads')
             candidate.profile_pic = filename
             
         try:
@@ -2004,14 +5193,8 @@ def delete_candidate(candidate_id):
         # Delete candidate's votes first (optional, depending on DB foreign key constraints)
         Vote.query.filter_by(candidate_id=candidate.id).delete()
         
-        # Delete profile picture from file system
-        try:
-            profile_path = os.path.join('static', 'uploads', candidate.profile_pic)
-            if os.path.exists(profile_path):
-                os.remove(profile_path)
-        except Exception as e:
-            # Log the error, but don't stop the database deletion
-            print(f"Error deleting profile picture: {e}") 
+        # Release the profile picture; it is unlinked after commit if nothing else uses it
+        release_blob(candidate.profile_pic, 'uploads')
 
         # Delete the candidate record
         db.session.delete(candidate)
@@ -2131,15 +5314,12 @@ def admin_project_ideas():
         flash('Please log in as an administrator to view this page.', 'danger')
         return redirect(url_for('admin_login'))
 
-    # Fetch all project ideas, ordered by submission date (newest first)
-    project_ideas = ProjectIdea.query.order_by(ProjectIdea.submission_date.desc()).all()
-
-    # You might want to fetch the user object for each project idea
-    # if you want to display the submitter's name/email.
-    # We'll pass the whole project_ideas list to the template,
-    # and the template can access project_idea.author.fullname
-    # because of the backref='author' in the User model.
-    return render_template('admin_project_ideas.html', project_ideas=project_ideas)
+    # One page of all project ideas (public and private), newest first.
+    # Authors are joined into the page query, so project_idea.author.fullname
+    # in the template doesn't trigger a query per card.
+    project_ideas, next_cursor = project_catalog_page(project_catalog_query(include_private=True),
+                                                      request.args.get('cursor'))
+    return render_template('admin_project_ideas.html', project_ideas=project_ideas, next_cursor=next_cursor)
 
 @app.route('/admin/project_ideas/edit/<int:idea_id>', methods=['GET', 'POST'])
 def admin_edit_project_idea(idea_id):
@@ -2156,6 +5336,8 @@ def admin_edit_project_idea(idea_id):
         idea.innovations = request.form['innovations']
         idea.contact_email = request.form['contact_email']
         idea.visibility = request.form['visibility']
+        if 'tags' in request.form:
+            set_project_tags(idea, parse_tag_names(request.form['tags']))
 
         # Handle file uploads if any. This is a simplified example.
         # In a real application, you'd want to handle multiple files,
@@ -2166,8 +5348,7 @@ def admin_edit_project_idea(idea_id):
             new_file_paths = []
             for file in files:
                 if file and allowed_file(file.filename): # You'd need to define allowed_file
-                    filename = secure_filename(file.filename)
-                    file_path = projects_uploads.save(file, folder=str(idea.id)) # Save to a subfolder per idea
+                    file_path = save_upload_blob(file, 'project_uploads')
                     new_file_paths.append(file_path)
 
             if new_file_paths:
@@ -2178,6 +5359,7 @@ def admin_edit_project_idea(idea_id):
 
 
         try:
+            index_project_idea(idea)
             db.session.commit()
             flash('Project idea updated successfully!', 'success')
             return redirect(url_for('admin_project_ideas'))
@@ -2196,15 +5378,14 @@ def admin_delete_project_idea(idea_id):
 
     idea = ProjectIdea.query.get_or_404(idea_id)
     try:
-        # Optionally, delete associated files from the file system
+        # Drop this idea's references; files go once no other project uses the same content
         if idea.file_paths:
             for file_path in idea.file_paths.split(','):
-                full_path = os.path.join(app.config['UPLOADED_PROJECTS_DEST'], os.path.basename(file_path))
-                if os.path.exists(full_path):
-                    os.remove(full_path)
-                    print(f"Deleted file: {full_path}") # For debugging
+                release_blob(file_path.strip(), 'project_uploads')
 
+        clear_project_tags(idea)
         db.session.delete(idea)
+        unindex_project_idea(idea.id)
         db.session.commit()
         flash('Project idea deleted successfully!', 'success')
     except Exception as e:
@@ -2410,69 +5591,53 @@ def upload_results():
             flash('All course details are required.', 'error')
             return render_template('results_upload.html', form_data=request.form)
 
-        # Bulk Student Details Validation
-        student_names_raw = request.form.get('studentNamesBulk')
-        reg_numbers_raw = request.form.get('regNumbersBulk')
-        ca_scores_raw = request.form.get('caScoresBulk')
-        exam_scores_raw = request.form.get('examScoresBulk')
-
-        names = parse_bulk_input(student_names_raw)
-        reg_numbers = parse_bulk_input(reg_numbers_raw)
-        ca_scores = parse_bulk_input(ca_scores_raw)
-        exam_scores = parse_bulk_input(exam_scores_raw)
-
-        # Check if all bulk input arrays have the same length
-        if not (len(names) == len(reg_numbers) == len(ca_scores) == len(exam_scores)):
-            flash('All bulk student input fields must have the same number of entries.', 'error')
-            return render_template('results_upload.html', form_data=request.form)
-
-        if not names: # Check if there are any student entries at all
-            flash('At least one student entry is required for bulk upload.', 'error')
-            return render_template('results_upload.html', form_data=request.form)
-
-        # Validate and process scores
-        students_data = []
-        has_score_error = False
-        for i in range(len(names)):
-            try:
-                ca = float(ca_scores[i])
-                exam = float(exam_scores[i])
-
-                if not (0 <= ca <= 30):
-                    flash(f'CA Score for student {names[i]} (entry {i+1}) is invalid. Must be between 0 and 30.', 'error')
-                    has_score_error = True
-                if not (0 <= exam <= 70):
-                    flash(f'Exam Score for student {names[i]} (entry {i+1}) is invalid. Must be between 0 and 70.', 'error')
-                    has_score_error = True
-
-                total = ca + exam
-                if total > 100:
-                    flash(f'Total score for student {names[i]} (entry {i+1}) exceeds 100 ({total}). Capped at 100.', 'warning')
-                total = min(total, 100) # Cap total at 100
-
-                students_data.append({
-                    'name': names[i],
-                    'reg_number': reg_numbers[i],
-                    'ca_score': int(ca),
-                    'exam_score': int(exam),
-                    'total_score': int(total),
-                    'grade': calculate_grade(total)
-                })
-            except ValueError:
-                flash(f'Invalid score format for an entry at position {i+1}. Scores must be numbers.', 'error')
-                has_score_error = True
-            except IndexError:
-                flash(f'Missing score for an entry at position {i+1}. Please ensure all score fields have corresponding entries.', 'error')
-                has_score_error = True
-
-        if has_score_error:
-            return render_template('results_upload.html', form_data=request.form)
+        report = new_result_import_report()
+        grading_scale = get_grading_scale(session_written)
+        results_file = request.files.get('resultsFile')
+
+        if results_file and results_file.filename:
+            # Sheet upload: rows are streamed, validated and written chunk by chunk
+            extension = results_file.filename.rsplit('.', 1)[-1].lower() if '.' in results_file.filename else ''
+            if extension not in RESULT_SHEET_EXTENSIONS:
+                flash('Result sheets must be .csv or .xlsx files.', 'error')
+                return render_template('results_upload.html', form_data=request.form)
+            students = validate_result_rows(iter_result_sheet_rows(results_file), report, grading_scale)
+        else:
+            # Bulk Student Details Validation
+            student_names_raw = request.form.get('studentNamesBulk', '')
+            reg_numbers_raw = request.form.get('regNumbersBulk', '')
+            ca_scores_raw = request.form.get('caScoresBulk', '')
+            exam_scores_raw = request.form.get('examScoresBulk', '')
+
+            names = parse_bulk_input(student_names_raw)
+            reg_numbers = parse_bulk_input(reg_numbers_raw)
+            ca_scores = parse_bulk_input(ca_scores_raw)
+            exam_scores = parse_bulk_input(exam_scores_raw)
+
+            # Check if all bulk input arrays have the same length
+            if not (len(names) == len(reg_numbers) == len(ca_scores) == len(exam_scores)):
+                flash('All bulk student input fields must have the same number of entries.', 'error')
+                return render_template('results_upload.html', form_data=request.form)
+
+            if not names: # Check if there are any student entries at all
+                flash('At least one student entry is required for bulk upload.', 'error')
+                return render_template('results_upload.html', form_data=request.form)
+
+            # Textarea entries are small, so validate them all up front and
+            # write nothing if any score is wrong (same as before).
+            students = list(validate_result_rows(
+                iter_bulk_input_rows(names, reg_numbers, ca_scores, exam_scores), report, grading_scale
+            ))
+            if report['errors']:
+                flash('Please correct the errors listed in the import report.', 'error')
+                return render_template('results_upload.html', form_data=request.form, import_report=report)
 
         try:
             # --- DEBUGGED LOGIC START ---
             # First, try to find a course by its course_code.
             # This handles the scenario where course_code is unique in the DB.
             course = Course.query.filter_by(course_code=course_code).first()
+            course_is_new = course is None
 
             if course:
                 # If a course with this course_code exists, update its details.
@@ -2482,7 +5647,6 @@ def upload_results():
                 course.year = year
                 course.semester = semester
                 # No need to add to session, it's already managed by SQLAlchemy
-                flash(f"Course '{course_code}' updated with new session/year/semester details.", 'info')
             else:
                 # If no course with this course_code exists, create a new one.
                 course = Course(
@@ -2493,94 +5657,193 @@ def upload_results():
                     semester=semester
                 )
                 db.session.add(course)
-                flash(f"New course '{course_code}' added.", 'info')
 
-            db.session.commit() # Commit the new course or the updated course
+            db.session.flush() # Assigns course.id without committing; everything below is one transaction
 
             # --- DEBUGGED LOGIC END ---
 
-            # Add student results
-            for student_data in students_data:
-                try:
-                    # Check if student result for this course already exists
-                    existing_result = StudentResult.query.filter_by(
-                        course_id=course.id,
-                        reg_number=student_data['reg_number']
-                    ).first()
-
-                    if existing_result:
-                        # Update existing result
-                        existing_result.student_name = student_data['name']
-                        existing_result.ca_score = student_data['ca_score']
-                        existing_result.exam_score = student_data['exam_score']
-                        existing_result.total_score = student_data['total_score']
-                        existing_result.grade = student_data['grade']
-                        flash(f"Updated result for {student_data['name']} ({student_data['reg_number']}) in {course_code}.", 'info')
-                    else:
-                        # Add new result
-                        new_result = StudentResult(
-                            course_id=course.id,
-                            student_name=student_data['name'],
-                            reg_number=student_data['reg_number'],
-                            ca_score=student_data['ca_score'],
-                            exam_score=student_data['exam_score'],
-                            total_score=student_data['total_score'],
-                            grade=student_data['grade']
-                        )
-                        db.session.add(new_result)
-                        flash(f"Added result for {student_data['name']} ({student_data['reg_number']}) in {course_code}.", 'info')
-                    db.session.commit() # Commit each student result
-                except IntegrityError:
-                    db.session.rollback()
-                    flash(f"Duplicate entry: Student with registration number '{student_data['reg_number']}' already has results for this course.", 'warning')
-                except Exception as e:
-                    db.session.rollback()
-                    flash(f"An error occurred while adding result for {student_data['name']}: {str(e)}", 'error')
-                    # It's better to continue processing other students if possible,
-                    # or redirect to the form with an error, rather than index.html
-                    return render_template('results_upload.html', form_data=request.form)
+            # Add or update all student results for this course in batched upserts
+            import_student_results(course.id, students, report)
+
+            if report['added'] + report['updated'] == 0:
+                db.session.rollback()
+                if report['processed'] == 0:
+                    flash('At least one student entry is required for bulk upload.', 'error')
+                else:
+                    flash('No results were saved. See the import report for details.', 'error')
+                return render_template('results_upload.html', form_data=request.form, import_report=report)
+
+            # Course details may have changed too, so refresh every student on the course
+            refresh_student_transcripts(get_existing_result_reg_numbers(course.id))
+            db.session.commit()
+            student_results_surge_cache.invalidate()
 
-            flash('Course and student results processed successfully!', 'success')
-            return redirect(url_for('upload_results')) # Redirect to clear form
+            if course_is_new:
+                flash(f"New course '{course_code}' added.", 'info')
+            else:
+                flash(f"Course '{course_code}' updated with new session/year/semester details.", 'info')
+            flash(f"{report['added']} result(s) added and {report['updated']} result(s) updated in {course_code}.", 'success')
+            # Render instead of redirecting so the import report stays visible
+            return render_template('results_upload.html', form_data={}, import_report=report)
         except Exception as e:
             db.session.rollback()
             flash(f'An error occurred during submission: {str(e)}', 'error')
-            return render_template('results_upload.html', form_data=request.form)
+            return render_template('results_upload.html', form_data=request.form, import_report=report)
 
     return render_template('results_upload.html', form_data={})
+# --- Admin result listing (keyset pagination) ---
+RESULT_PAGE_SIZE = 100
+RESULT_PAGE_MAX_SIZE = 500
+
+# Sortable columns for the admin listing. StudentResult.id is always the tie-breaker,
+# so (sort value, id) uniquely identifies where a page ended.
+RESULT_SORT_COLUMNS = {
+    'reg_number': StudentResult.reg_number,
+    'student_name': StudentResult.student_name,
+    'course_code': Course.course_code,
+    'total_score': StudentResult.total_score,
+    'id': StudentResult.id,
+}
+
+
+def reg_number_prefix_filter(prefix, column=StudentResult.reg_number):
+    """
+    reg_number LIKE 'prefix%' written as ranges. SQLite's LIKE is case-insensitive
+    and cannot use the BINARY reg_number index; ranges always can. Reg numbers are
+    stored as uploaded, so the prefix is matched as typed, upper- and lower-cased
+    ("u18cs" finds U18CS001).
+    """
+    ranges = []
+    for variant in sorted({prefix, prefix.upper(), prefix.lower()}):
+        upper_bound = variant[:-1] + chr(ord(variant[-1]) + 1)
+        ranges.append(db.and_(column >= variant, column < upper_bound))
+    return db.or_(*ranges)
+
+
+def serialize_student_result(res):
+    """Shape of one result row as used by showresults.html and the results API."""
+    return {
+        'id': res.id,
+        'student_name': res.student_name,
+        'reg_number': res.reg_number,
+        'ca_score': res.ca_score,
+        'exam_score': res.exam_score,
+        'total_score': res.total_score,
+        'grade': res.grade,
+        'course': {
+            'id': res.course.id,
+            'course_code': res.course.course_code,
+            'course_title': res.course.course_title,
+            'year': res.course.year,
+            'semester': res.course.semester,
+            'session_written': res.course.session_written
+        }
+    }
+
+
+def query_student_results_page(filters, sort='reg_number', direction='asc', limit=RESULT_PAGE_SIZE, cursor=None):
+    """
+    Fetches one page of results, filtered and ordered in SQL.
+    filters may hold course_id, session, semester and reg_prefix.
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    sort_column = RESULT_SORT_COLUMNS[sort]
+    descending = direction == 'desc'
+
+    query = StudentResult.query.join(Course).options(db.contains_eager(StudentResult.course))
+    if filters.get('course_id'):
+        query = query.filter(StudentResult.course_id == filters['course_id'])
+    if filters.get('session'):
+        query = query.filter(Course.session_written == filters['session'])
+    if filters.get('semester'):
+        query = query.filter(Course.semester == filters['semester'])
+    if filters.get('reg_prefix'):
+        query = query.filter(reg_number_prefix_filter(filters['reg_prefix']))
+
+    if cursor:
+        last_value, last_id = decode_keyset_cursor(cursor)
+        if sort == 'id':
+            query = query.filter(StudentResult.id < last_id if descending else StudentResult.id > last_id)
+        elif descending:
+            query = query.filter(db.or_(sort_column < last_value,
+                                        db.and_(sort_column == last_value, StudentResult.id < last_id)))
+        else:
+            query = query.filter(db.or_(sort_column > last_value,
+                                        db.and_(sort_column == last_value, StudentResult.id > last_id)))
+
+    if sort == 'id':
+        order = [StudentResult.id.desc() if descending else StudentResult.id.asc()]
+    elif descending:
+        order = [sort_column.desc(), StudentResult.id.desc()]
+    else:
+        order = [sort_column.asc(), StudentResult.id.asc()]
+
+    # Fetch one extra row to know whether another page exists
+    rows = query.order_by(*order).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        last_value = last.course.course_code if sort == 'course_code' else getattr(last, sort)
+        next_cursor = encode_keyset_cursor(last_value, last.id)
+    return rows, next_cursor
+
+
+@app.route('/admin/api/results', methods=['GET'])
+def admin_results_api():
+    """
+    Keyset-paginated result listing for the admin views.
+    Query parameters: course_id, session, semester, reg_prefix, sort, direction, limit, cursor.
+    Pass the returned next_cursor back as cursor to get the following page.
+    """
+    if 'admin_id' not in session:
+        return jsonify({'success': False, 'message': 'Please login first!'}), 401
+
+    sort = request.args.get('sort', 'reg_number')
+    direction = request.args.get('direction', 'asc')
+    if sort not in RESULT_SORT_COLUMNS or direction not in ('asc', 'desc'):
+        return jsonify({'success': False, 'message': 'Unsupported sort or direction.'}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', RESULT_PAGE_SIZE)), 1), RESULT_PAGE_MAX_SIZE)
+        course_id = request.args.get('course_id', type=int)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'limit must be a number.'}), 400
+
+    filters = {
+        'course_id': course_id,
+        'session': request.args.get('session', '').strip(),
+        'semester': request.args.get('semester', '').strip(),
+        'reg_prefix': request.args.get('reg_prefix', '').strip(),
+    }
+    try:
+        rows, next_cursor = query_student_results_page(filters, sort, direction, limit, request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    return jsonify({
+        'success': True,
+        'results': [serialize_student_result(res) for res in rows],
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None
+    })
+
+
 @app.route('/uploaded_results')
 def display_uploaded_results():
     if 'admin_id' not in session:
         flash('Please login first!', 'warning')
         return redirect(url_for('admin_login'))
     """
-    Renders the page to display all uploaded student results.
-    Fetches all student results from the database and passes them to the template.
+    Renders the page to display uploaded student results.
+    Rows are no longer embedded in the page; showresults.html pulls them a page
+    at a time from /admin/api/results. Only the filter choices are rendered here.
     """
     try:
-        # Eager load the 'course' relationship and convert to serializable dictionaries
-        all_results_data = StudentResult.query.options(db.joinedload(StudentResult.course)).all()
-        serializable_results = []
-        for res in all_results_data:
-            serializable_results.append({
-                'id': res.id,
-                'student_name': res.student_name,
-                'reg_number': res.reg_number,
-                'ca_score': res.ca_score,
-                'exam_score': res.exam_score,
-                'total_score': res.total_score,
-                'grade': res.grade,
-                'course': {
-                    'id': res.course.id,
-                    'course_code': res.course.course_code,
-                    'course_title': res.course.course_title,
-                    'year': res.course.year,
-                    'semester': res.course.semester,
-                    'session_written': res.course.session_written
-                }
-            })
-        
-        return render_template('showresults.html', all_results=serializable_results)
+        courses = Course.query.order_by(Course.course_code).all()
+        sessions = sorted({course.session_written for course in courses})
+        semesters = sorted({course.semester for course in courses})
+        return render_template('showresults.html', courses=courses, sessions=sessions, semesters=semesters,
+                               page_size=RESULT_PAGE_SIZE)
     except Exception as e:
         # Log the error for debugging purposes
         print(f"Error fetching results for display_uploaded_results: {e}")
@@ -2604,13 +5867,19 @@ def edit_result(result_id):
         ca_score = int(data.get('ca_score'))
         exam_score = int(data.get('exam_score'))
         
-        # Update the scores and recalculate derived fields
+        if not (0 <= ca_score <= CA_SCORE_MAX) or not (0 <= exam_score <= EXAM_SCORE_MAX):
+            return jsonify({'success': False, 'message': 'CA Score must be between 0 and 30 and Exam Score between 0 and 70.'}), 400
+
+        # Update the scores and recalculate derived fields using the session's grading scale
+        scale = get_grading_scale(result_to_edit.course.session_written if result_to_edit.course else None)
         result_to_edit.ca_score = ca_score
         result_to_edit.exam_score = exam_score
         result_to_edit.total_score = ca_score + exam_score
-        result_to_edit.grade = calculate_grade(result_to_edit.total_score)
+        result_to_edit.grade = calculate_grade(result_to_edit.total_score, scale)
+        refresh_student_transcripts([result_to_edit.reg_number])
         
         db.session.commit()
+        student_results_surge_cache.invalidate()
         return jsonify({'success': True, 'message': 'Result updated successfully!'}), 200
         
     except (ValueError, TypeError) as e:
@@ -2629,7 +5898,9 @@ def delete_result(result_id):
     result_to_delete = StudentResult.query.get_or_404(result_id)
     try:
         db.session.delete(result_to_delete)
+        refresh_student_transcripts([result_to_delete.reg_number])
         db.session.commit()
+        student_results_surge_cache.invalidate()
         return jsonify({'success': True, 'message': 'Result deleted successfully!'}), 200
     except Exception as e:
         db.session.rollback()
@@ -2654,43 +5925,184 @@ def get_result(result_id):
 
 
 
-@app.route('/search_results', methods=['GET', 'POST'])
-def search_results():
+@app.route('/admin/grading_scales', methods=['GET', 'POST'])
+def admin_grading_scales():
     """
-    Allows an admin to search for student results by registration number or course code.
-    Displays a search form on GET and filtered results on POST.
+    Lists (GET) or creates/replaces (POST) the grading scale for an academic session.
+    POST expects JSON: {"session_written": "2024/2025", "boundaries": [[70, "A"], [60, "B"], ...], "fail_grade": "F"}
     """
     if 'admin_id' not in session:
-        flash('Please login first!', 'warning')
-        return redirect(url_for('admin_login'))
+        return jsonify({'success': False, 'message': 'Please login first!'}), 401
+
+    if request.method == 'GET':
+        scales = GradingScale.query.order_by(GradingScale.session_written).all()
+        return jsonify([{
+            'session_written': scale.session_written,
+            'boundaries': json.loads(scale.boundaries),
+            'fail_grade': scale.fail_grade
+        } for scale in scales])
+
+    data = request.json
+    if not data:
+        return jsonify({'success': False, 'message': 'Invalid JSON data'}), 400
+
+    session_written = (data.get('session_written') or '').strip()
+    boundaries = data.get('boundaries')
+    fail_grade = (data.get('fail_grade') or DEFAULT_FAIL_GRADE).strip()
+
+    if not session_written or not isinstance(boundaries, list) or not boundaries:
+        return jsonify({'success': False, 'message': 'session_written and a non-empty boundaries list are required.'}), 400
+    try:
+        cleaned = [(float(cutoff), str(grade).strip()) for cutoff, grade in boundaries]
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Each boundary must be a [minimum_total, grade] pair.'}), 400
+    if any(not (0 <= cutoff <= 100) or not (1 <= len(grade) <= 5) for cutoff, grade in cleaned):
+        return jsonify({'success': False, 'message': 'Cut-offs must be between 0 and 100 and grades 1-5 characters long.'}), 400
+    if len({cutoff for cutoff, _ in cleaned}) != len(cleaned):
+        return jsonify({'success': False, 'message': 'Each cut-off may only appear once.'}), 400
+
+    try:
+        scale = GradingScale.query.filter_by(session_written=session_written).first()
+        if not scale:
+            scale = GradingScale(session_written=session_written)
+            db.session.add(scale)
+        scale.boundaries = json.dumps(sorted(cleaned, reverse=True))
+        scale.fail_grade = fail_grade
+        db.session.commit()
+        return jsonify({'success': True, 'message': f'Grading scale for {session_written} saved.'}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': f'Error saving grading scale: {str(e)}'}), 500
+
+
+# --- Result search ---
+SEARCH_RESULT_LIMIT = 200
+
+# FTS5 trigram index over course code and title (SQLite 3.34+). It is an external-content
+# table over `course`, kept in sync by triggers, so substring searches like "PAD 3" or
+# "administration" never scan course rows by LIKE. Other databases fall back to ILIKE,
+# which is fine there because the course table is small.
+COURSE_SEARCH_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS course_search USING fts5(
+        course_code, course_title, content='course', content_rowid='id', tokenize='trigram')""",
+    """CREATE TRIGGER IF NOT EXISTS course_search_ai AFTER INSERT ON course BEGIN
+        INSERT INTO course_search(rowid, course_code, course_title) VALUES (new.id, new.course_code, new.course_title);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS course_search_ad AFTER DELETE ON course BEGIN
+        INSERT INTO course_search(course_search, rowid, course_code, course_title) VALUES ('delete', old.id, old.course_code, old.course_title);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS course_search_au AFTER UPDATE ON course BEGIN
+        INSERT INTO course_search(course_search, rowid, course_code, course_title) VALUES ('delete', old.id, old.course_code, old.course_title);
+        INSERT INTO course_search(rowid, course_code, course_title) VALUES (new.id, new.course_code, new.course_title);
+    END""",
+]
+# Trigram matching needs at least three characters
+COURSE_SEARCH_MIN_LENGTH = 3
+
+
+def ensure_course_search_index(engine=None):
+    """Creates (and back-fills) the course_search FTS table on SQLite. Returns True when it is usable."""
+    engine = engine or db.engine
+    if engine.dialect.name != 'sqlite':
+        return False
+    try:
+        with engine.begin() as conn:
+            for statement in COURSE_SEARCH_DDL:
+                conn.exec_driver_sql(statement)
+            conn.exec_driver_sql("INSERT INTO course_search(course_search) VALUES ('rebuild')")
+        return True
+    except Exception as e:
+        # Older SQLite builds without FTS5/trigram: search still works through ILIKE
+        print(f"Course search index unavailable: {e}")
+        return False
+
 
-    search_query = ""
+def matching_course_ids(search_text, sess=None):
+    """Ids of courses whose code or title contains search_text (case-insensitive)."""
+    sess = sess or db.session
+    if len(search_text) >= COURSE_SEARCH_MIN_LENGTH and fts_table_available(sess, 'course_search'):
+        phrase = '"' + search_text.replace('"', '""') + '"'
+        rows = sess.execute(db.text("SELECT rowid FROM course_search WHERE course_search MATCH :phrase"),
+                            {'phrase': phrase})
+        return [row[0] for row in rows]
+    pattern = f'%{search_text}%'
+    return [course_id for (course_id,) in sess.execute(
+        db.select(Course.id).where(db.or_(Course.course_code.ilike(pattern), Course.course_title.ilike(pattern)))
+    )]
+
+
+def search_student_results(search_text='', year=None, semester=None, reg_prefix=None,
+                           limit=SEARCH_RESULT_LIMIT, sess=None):
+    """
+    Admin result search. search_text matches a reg-number prefix or a course code/title
+    substring; year and semester filter through Course. Every branch is index-backed:
+    the reg-number range uses ix_student_result_reg_number_id and the course match is
+    resolved to ids first, then read through the (course_id, reg_number) unique index.
+    """
+    sess = sess or db.session
+    statement = db.select(StudentResult).join(Course).options(db.contains_eager(StudentResult.course))
+
+    if search_text:
+        conditions = [reg_number_prefix_filter(search_text)]
+        course_ids = matching_course_ids(search_text, sess)
+        if course_ids:
+            conditions.append(StudentResult.course_id.in_(course_ids))
+        statement = statement.where(db.or_(*conditions))
+    if reg_prefix:
+        statement = statement.where(reg_number_prefix_filter(reg_prefix))
+    if year:
+        statement = statement.where(Course.year == year)
+    if semester and semester != 'all':
+        statement = statement.where(Course.semester == semester)
+
+    statement = statement.order_by(StudentResult.reg_number, StudentResult.id).limit(limit)
+    return sess.execute(statement).scalars().all()
+
+
+def render_result_search():
+    """Shared by /search_results and /admin/searchresults; both POST the same form."""
+    search_query = request.form.get('search_query', '').strip()
+    year = request.form.get('year', '').strip()
+    semester = request.form.get('semester', '').strip()
+    reg_prefix = request.form.get('reg_prefix', '').strip()
     results = []
-    
+    search_performed = False
+
     if request.method == 'POST':
-        search_query = request.form.get('search_query', '').strip()
-        
-        if search_query:
-            # Query for results that match the student's registration number OR the course code
-            results = StudentResult.query.join(Course).filter(
-                (StudentResult.reg_number.ilike(f'%{search_query}%')) |
-                (Course.course_code.ilike(f'%{search_query}%'))
-            ).all()
-            
+        if search_query or year or (semester and semester != 'all') or reg_prefix:
+            search_performed = True
+            results = search_student_results(search_query, year, semester, reg_prefix)
             if not results:
-                flash(f'No results found for "{search_query}".', 'info')
+                flash('No results found for your search criteria.', 'info')
+            elif len(results) == SEARCH_RESULT_LIMIT:
+                flash(f'Showing the first {SEARCH_RESULT_LIMIT} matches. Narrow the search to see the rest.', 'info')
         else:
             flash('Please enter a search term.', 'warning')
-            
-    # For a GET request, or if the search was empty, we can show all results,
-    # or an empty list if you prefer. Here, we default to showing all.
-    if request.method == 'GET' or not search_query:
-        results = StudentResult.query.all()
-    
-    return render_template('searchresults.html', all_results=results, search_query=search_query)
-# In your app.py file
 
+    # A GET shows the empty form; browsing every result is done page by page on /uploaded_results.
+    filter_courses = Course.query.with_entities(Course.year, Course.semester).distinct().all()
+    return render_template('searcresults.html', all_results=results, search_query=search_query,
+                           search_performed=search_performed, year=year, semester=semester, reg_prefix=reg_prefix,
+                           years=sorted({c.year for c in filter_courses}),
+                           semesters=sorted({c.semester for c in filter_courses}))
+
+
+@app.route('/search_results', methods=['GET', 'POST'])
+def search_results():
+    """
+    Allows an admin to search for student results by registration number or course code.
+    Displays a search form on GET and filtered results on POST.
+    """
+    if 'admin_id' not in session:
+        flash('Please login first!', 'warning')
+        return redirect(url_for('admin_login'))
 
+    try:
+        return render_result_search()
+    except Exception as e:
+        print(f"Error searching results: {e}")
+        flash('An error occurred while fetching results.', 'danger')
+        return redirect(url_for('admin_dashboard'))
 
 
 # --- New Admin Search Route ---
@@ -2703,48 +6115,14 @@ def admin_search_results():
     """
     Renders the page for admins to search and display student results.
     Allows searching by year, semester, or the first four digits of the registration number.
+    Year and semester live on Course, so they are filtered through the join.
     """
-    all_results = []
-    search_performed = False
-
     try:
-        if request.method == 'POST':
-            search_performed = True
-            year = request.form.get('year')
-            semester = request.form.get('semester')
-            reg_prefix = request.form.get('reg_prefix')
-
-            query = StudentResult.query
-
-            if year:
-                try:
-                    query = query.filter_by(year=int(year))
-                except ValueError:
-                    flash('Invalid year entered. Please enter a number.', 'danger')
-                    return render_template('admin_search_results.html', all_results=[], search_performed=False)
-            if semester and semester != 'all':
-                query = query.filter_by(semester=semester)
-            if reg_prefix:
-                # Filter by registration number starting with the prefix
-                query = query.filter(StudentResult.reg_number.startswith(reg_prefix))
-
-            all_results = query.all()
-
-            if not all_results and search_performed:
-                flash('No results found for your search criteria.', 'info')
-
-        # If GET request or no specific search parameters on POST,
-        # we might want to show all results initially or an empty state.
-        # For this, let's just show an empty table on initial GET.
-        # If you want to display all results on initial load, remove the 'if request.method == 'POST':' block
-        # and set all_results = StudentResult.query.all() here.
-
+        return render_result_search()
     except Exception as e:
         print(f"Error searching results: {e}")
         flash('An error occurred while fetching results.', 'danger')
-        return render_template('admin_search_results.html', all_results=[], search_performed=False)
-
-    return render_template('admin_search_results.html', all_results=all_results, search_performed=search_performed)
+        return redirect(url_for('admin_dashboard'))
 
 
 
@@ -2790,10 +6168,9 @@ def admin_schedule_results():
 
         try:
             course_id = int(course_id)
-            # Use a time zone-aware datetime object for Lagos time
-            lagos_tz = pytz.timezone('Africa/Lagos')
-            publish_start = lagos_tz.localize(datetime.strptime(publish_start_str, '%Y-%m-%dT%H:%M'))
-            publish_end = lagos_tz.localize(datetime.strptime(publish_end_str, '%Y-%m-%dT%H:%M'))
+            # The picker gives Lagos wall-clock time; store it as-is (naive) so it compares with lagos_now()
+            publish_start = datetime.strptime(publish_start_str, '%Y-%m-%dT%H:%M')
+            publish_end = datetime.strptime(publish_end_str, '%Y-%m-%dT%H:%M')
 
             if publish_start >= publish_end:
                 flash('Publication end time must be after start time.', 'danger')
@@ -2819,6 +6196,9 @@ def admin_schedule_results():
             )
             db.session.add(new_schedule)
             db.session.commit()
+            publication_schedule_cache.invalidate()
+            student_results_surge_cache.invalidate()
+            publication_notifier.wake()
             flash('Result publication schedule created successfully!', 'success')
             return redirect(url_for('admin_dashboard'))
 
@@ -2862,7 +6242,6 @@ def admin_edit_publication(schedule_id):
 
     courses = Course.query.all()
     academic_sessions = ["2022/2023", "2023/2024", "2024/2025", "2025/2026"]
-    lagos_tz = pytz.timezone('Africa/Lagos')
 
     if request.method == 'POST':
         # Retrieve updated data from the form
@@ -2880,8 +6259,8 @@ def admin_edit_publication(schedule_id):
             # Update the schedule object with new values
             schedule.course_id = int(course_id)
             schedule.session_written = session_written
-            schedule.publish_start = lagos_tz.localize(datetime.strptime(publish_start_str, '%Y-%m-%dT%H:%M'))
-            schedule.publish_end = lagos_tz.localize(datetime.strptime(publish_end_str, '%Y-%m-%dT%H:%M'))
+            schedule.publish_start = datetime.strptime(publish_start_str, '%Y-%m-%dT%H:%M') # Lagos wall-clock time
+            schedule.publish_end = datetime.strptime(publish_end_str, '%Y-%m-%dT%H:%M')
             schedule.is_active = is_active
 
             if schedule.publish_start >= schedule.publish_end:
@@ -2890,6 +6269,9 @@ def admin_edit_publication(schedule_id):
             
             # Commit changes to the database
             db.session.commit()
+            publication_schedule_cache.invalidate()
+            student_results_surge_cache.invalidate()
+            publication_notifier.wake()
             flash('Publication schedule updated successfully!', 'success')
             return redirect(url_for('admin_schedule_results')) # Redirect back to the list of schedules
 
@@ -2909,6 +6291,38 @@ def admin_edit_publication(schedule_id):
                            academic_sessions=academic_sessions)
 
 
+# --- ADMIN API: PUBLICATION NOTIFICATION PROGRESS ---
+@app.route('/admin/api/notification_jobs')
+def admin_notification_jobs_api():
+    if 'admin_id' not in session:
+        return jsonify({'error': 'Please login first!'}), 401
+    jobs = PublicationNotificationJob.query.order_by(PublicationNotificationJob.id.desc()).limit(20).all()
+    return jsonify({'jobs': [notification_job_report(job) for job in jobs]})
+
+
+@app.route('/admin/api/notification_jobs/<int:job_id>')
+def admin_notification_job_api(job_id):
+    if 'admin_id' not in session:
+        return jsonify({'error': 'Please login first!'}), 401
+    job = PublicationNotificationJob.query.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Notification job not found.'}), 404
+    return jsonify(notification_job_report(job))
+
+
+@app.cli.command('notify-publications')
+def notify_publications():
+    """Announces any publication window that has opened without a notification run."""
+    publication_notifier.run_due()
+    for job in PublicationNotificationJob.query.filter(PublicationNotificationJob.status != 'fanned_out').all():
+        click.echo(f'Job {job.id} for schedule {job.schedule_id}: {job.status} {job.last_error or ""}')
+    recent = PublicationNotificationJob.query.order_by(PublicationNotificationJob.id.desc()).limit(5).all()
+    for job in recent:
+        report = notification_job_report(job)
+        click.echo(f"{report['course_code']}: {report['notifications_created']}/{report['total_recipients']} notified, "
+                   f"{report['emails']['outstanding']} emails outstanding")
+
+
 
 
 # --- NEW USER ROUTE: VIEW PUBLISHED RESULTS ---
@@ -2919,57 +6333,45 @@ def student_view_results():
     if 'user_id' not in session:
         flash('Please log in first.', 'danger')
         return redirect(url_for('login'))
-    
-    # Retrieve the user object using the session ID
-    user = User.query.get(session['user_id'])
-    if not user: # Defensive check if user_id is somehow invalid
-        flash('User session invalid. Please login again.', 'danger')
-        session.pop('user_id', None) # Clear invalid session
-        logout_user() # Ensure Flask-Login also logs out
-        return redirect(url_for('login'))
 
-    user_reg_number = user.regno # Use the retrieved user object
-    # Use a time zone-aware datetime object for the current time in Lagos
-    lagos_tz = pytz.timezone('Africa/Lagos')
-    current_time = datetime.now(lagos_tz)
+    # Currently open publication windows, served from memory between window boundaries
+    open_windows = publication_schedule_cache.open_windows()
+
+    # Release-day fast path: the payload was pre-rendered when the window opened
+    payload = student_results_surge_cache.get(session['user_id'], open_windows)
+    if payload is None:
+        cache_generation = student_results_surge_cache.generation() # Before reading any results
+        # Retrieve the user object using the session ID
+        user = User.query.get(session['user_id'])
+        if not user: # Defensive check if user_id is somehow invalid
+            flash('User session invalid. Please login again.', 'danger')
+            session.pop('user_id', None) # Clear invalid session
+            logout_user() # Ensure Flask-Login also logs out
+            return redirect(url_for('login'))
 
-    # Get active publication schedules
-    active_schedules = ResultPublicationSchedule.query.filter(
-        ResultPublicationSchedule.publish_start <= current_time,
-        ResultPublicationSchedule.publish_end >= current_time,
-        ResultPublicationSchedule.is_active == True
-    ).all()
+        transcripts = []
+        if open_windows:
+            # One indexed lookup on (reg_number, session_written) instead of a query per schedule
+            transcripts = load_student_transcripts([user.regno]).get(user.regno, [])
+        payload = build_student_results_payload(user.fullname, user.regno, transcripts, open_windows)
+        student_results_surge_cache.put(session['user_id'], payload, open_windows, cache_generation)
 
-    published_results = []
-    # Collect results for the current student that fall within active publication schedules
-    for schedule in active_schedules:
-        # Fetch results for the current student, for the specific course and session from the active schedule
-        student_course_results = StudentResult.query.filter_by(
-            reg_number=user_reg_number,
-            course_id=schedule.course_id
-        ).all()
+    return render_template(
+        'student_view_results.html',
+        results=payload['results'],
+        gpa_summary=payload['gpa_summary'],
+        user=payload['user']
+    )
 
-        for result in student_course_results:
-            # Check if the result's course's session matches the schedule's session
-            if result.course and result.course.session_written == schedule.session_written:
-                published_results.append({
-                    'course_code': result.course.course_code,
-                    'course_title': result.course.course_title,
-                    'session_written': result.course.session_written, # Or schedule.session_written
-                    'ca_score': result.ca_score,
-                    'exam_score': result.exam_score,
-                    'total_score': result.total_score,
-                    'grade': result.grade,
-                    'publish_start': schedule.publish_start,
-                    'publish_end': schedule.publish_end
-                })
-    
-    # Sort results for better display, e.g., by course code or session
-    published_results.sort(key=lambda x: (x['session_written'], x['course_code']))
 
-    return render_template('student_view_results.html', results=published_results, user=user) # Pass 'user'
 
 
+@app.route('/admin/results_cache_stats')
+def results_cache_stats():
+    """Hit/miss counters for the release-day student results cache."""
+    if 'admin_id' not in session:
+        return jsonify({'success': False, 'message': 'Please login first!'}), 401
+    return jsonify(student_results_surge_cache.stats())
 
 
 @app.route('/admin/all-admins')
@@ -3216,13 +6618,377 @@ def lecturer_dashboard():
 
 
 
+# --- CLI: benchmarks ---
+@app.cli.command('bench-grading')
+@click.option('--rows', default=100000, show_default=True, help='Number of synthetic results to grade.')
+def bench_grading(rows):
+    """Compares the scalar calculate_grade loop against grade_result_batch."""
+    rng = np.random.default_rng(2024)
+    ca_scores = rng.integers(0, CA_SCORE_MAX + 1, rows).tolist()
+    exam_scores = rng.integers(0, EXAM_SCORE_MAX + 1, rows).tolist()
+
+    start = time.perf_counter()
+    scalar_grades = []
+    for ca, exam in zip(ca_scores, exam_scores):
+        if 0 <= ca <= CA_SCORE_MAX and 0 <= exam <= EXAM_SCORE_MAX:
+            scalar_grades.append(calculate_grade(min(ca + exam, 100)))
+    scalar_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    graded = grade_result_batch(ca_scores, exam_scores)
+    batch_grades = graded['grades'][graded['ca_valid'] & graded['exam_valid']]
+    batch_seconds = time.perf_counter() - start
+
+    if batch_grades.tolist() != scalar_grades:
+        raise click.ClickException('Vectorized grades do not match calculate_grade.')
+    click.echo(f'{rows} rows')
+    click.echo(f'  scalar calculate_grade loop: {scalar_seconds * 1000:.1f} ms')
+    click.echo(f'  grade_result_batch:          {batch_seconds * 1000:.1f} ms ({scalar_seconds / batch_seconds:.1f}x)')
+
+
+@app.cli.command('bench-result-search')
+@click.option('--rows', default=1000000, show_default=True, help='Number of synthetic results to load.')
+@click.option('--courses', default=500, show_default=True, help='Number of synthetic courses.')
+@click.option('--repeat', default=20, show_default=True, help='Timed runs per query (median is reported).')
+def bench_result_search(rows, courses, repeat):
+    """Loads synthetic results into a scratch SQLite database and times search_student_results."""
+    import tempfile
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+
+    courses_per_student = 40
+    subjects = ['Public Administration', 'Local Government', 'Research Methods', 'Political Theory',
+                'Public Finance', 'Development Studies', 'Comparative Politics', 'Statistics']
+    years = ['first_year', 'second_year', 'third_year', 'fourth_year']
+
+    with tempfile.TemporaryDirectory() as scratch:
+        engine = create_engine(f"sqlite:///{os.path.join(scratch, 'bench.db')}")
+        db.metadata.create_all(engine, tables=[Course.__table__, StudentResult.__table__])
+        db.configure_mappers() # backrefs such as StudentResult.course are set up lazily
+        if not ensure_course_search_index(engine):
+            click.echo('FTS5 trigram unavailable; course matching falls back to ILIKE.')
+
+        start = time.perf_counter()
+        with engine.begin() as conn:
+            conn.execute(Course.__table__.insert(), [{
+                'id': i + 1,
+                'course_code': f'PAD{100 + i}',
+                'course_title': f'{subjects[i % len(subjects)]} {i // len(subjects) + 1}',
+                'session_written': f'{2015 + i % 10}/{2016 + i % 10}',
+                'year': years[i % len(years)],
+                'semester': 'first_semester' if i % 2 == 0 else 'second_semester',
+            } for i in range(courses)])
+            batch = []
+            for n in range(rows):
+                student, slot = divmod(n, courses_per_student)
+                total = (student * 31 + slot * 17) % 101
+                batch.append({
+                    'course_id': (student * 7 + slot) % courses + 1,
+                    'student_name': f'Student {student}',
+                    'reg_number': f'{2015 + student % 10}/{student:07d}',
+                    'ca_score': min(total, CA_SCORE_MAX),
+                    'exam_score': total - min(total, CA_SCORE_MAX),
+                    'total_score': total,
+                    'grade': calculate_grade(total),
+                })
+                if len(batch) == 10000:
+                    conn.execute(StudentResult.__table__.insert(), batch)
+                    batch = []
+            if batch:
+                conn.execute(StudentResult.__table__.insert(), batch)
+            conn.exec_driver_sql('ANALYZE')
+        click.echo(f'Loaded {rows} results over {courses} courses in {time.perf_counter() - start:.1f} s')
+
+        queries = [
+            ('reg-number prefix "2019/00123"', {'search_text': '2019/00123'}),
+            ('exact course code "PAD250"', {'search_text': 'PAD250'}),
+            ('course title substring "finance"', {'search_text': 'finance'}),
+            ('year + semester filter', {'year': 'third_year', 'semester': 'first_semester'}),
+            ('reg prefix + year filter', {'reg_prefix': '2021/', 'year': 'second_year'}),
+            ('no match', {'search_text': 'zzz-none'}),
+        ]
+        with Session(engine) as sess:
+            for label, kwargs in queries:
+                timings = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    found = search_student_results(sess=sess, **kwargs)
+                    timings.append(time.perf_counter() - start)
+                    sess.expunge_all()
+                click.echo(f'  {label:<36} {len(found):>4} rows  median {sorted(timings)[len(timings) // 2] * 1000:.2f} ms')
+        engine.dispose()
+
+
+@app.cli.command('build-image-derivatives')
+def build_image_derivatives():
+    """Creates the WebP thumb/medium copies for every picture already in the upload folders."""
+    folders = list(BLOB_FOLDERS.values()) + [os.path.join(app.static_folder, 'profile_pics')]
+    originals, original_bytes, derivative_bytes = 0, 0, 0
+    for folder in folders:
+        if not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            path = os.path.join(folder, name)
+            if is_image_derivative(name) or os.path.splitext(name)[1].lower() not in IMAGE_DERIVATIVE_EXTENSIONS:
+                continue
+            generate_image_derivatives(path)
+            thumb = derivative_path(path, 'thumb')
+            if os.path.exists(thumb):
+                originals += 1
+                original_bytes += os.path.getsize(path)
+                derivative_bytes += os.path.getsize(thumb)
+    click.echo(f'{originals} images: {original_bytes / 1024:.0f} KB originals, {derivative_bytes / 1024:.0f} KB as thumbnails.')
+
+
+@app.cli.command('rebuild-transcripts')
+def rebuild_transcripts():
+    """Rebuilds every StudentTranscript row from StudentResult (students without any are also rebuilt on first view)."""
+    reg_numbers = [reg_number for (reg_number,) in db.session.query(StudentResult.reg_number).distinct().all()]
+    refresh_student_transcripts(reg_numbers)
+    db.session.commit()
+    click.echo(f'Rebuilt transcripts for {len(reg_numbers)} students.')
+
+
+@app.cli.command('rebuild-project-search')
+def rebuild_project_search():
+    """Rebuilds the project_search full-text index from ProjectIdea (e.g. after authors rename)."""
+    if ensure_project_search_index(rebuild=True):
+        click.echo(f'Indexed {ProjectIdea.query.count()} project ideas.')
+    else:
+        click.echo('Full-text search needs SQLite with FTS5; browse_projects falls back to ILIKE.')
+
+
+def migrate_private_chat_envelopes(batch_size=CHAT_MIGRATION_BATCH_SIZE):
+    """
+    Converts legacy JSON-text PrivateChat rows to the binary envelope, batch_size rows per
+    transaction so the chat gateway is never locked out for long. Rows that don't decode
+    are left as they are. Returns (converted, skipped).
+    """
+    converted = skipped = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            db.select(PrivateChat.id, PrivateChat.encrypted_content)
+            .where(PrivateChat.envelope_version == CHAT_ENVELOPE_LEGACY, PrivateChat.id > last_id)
+            .order_by(PrivateChat.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return converted, skipped
+        updates = []
+        for row_id, content in rows:
+            try:
+                ciphertext, nonce = decode_encrypted_message(json.loads(content))
+            except (TypeError, ValueError):
+                skipped += 1
+                continue
+            updates.append({'id': row_id, 'ciphertext': ciphertext, 'nonce': nonce,
+                            'envelope_version': CHAT_ENVELOPE_BINARY, 'encrypted_content': ''})
+        if updates:
+            db.session.execute(db.update(PrivateChat), updates) # bulk UPDATE by primary key
+        db.session.commit()
+        converted += len(updates)
+        last_id = rows[-1][0]
+
+
+@app.cli.command('migrate-chat-envelopes')
+@click.option('--batch-size', default=CHAT_MIGRATION_BATCH_SIZE, show_default=True, help='Rows converted per transaction.')
+@click.option('--vacuum', is_flag=True, help='VACUUM afterwards so SQLite returns the freed space to the disk.')
+def migrate_chat_envelopes(batch_size, vacuum):
+    """Moves stored private chat messages from JSON text to the binary ciphertext/nonce columns."""
+    ensure_chat_envelope_columns()
+    converted, skipped = migrate_private_chat_envelopes(batch_size)
+    click.echo(f'Converted {converted} messages; {skipped} could not be decoded and were left as text.')
+    if vacuum:
+        with db.engine.connect() as conn:
+            conn.exec_driver_sql('VACUUM')
+
+
+def ensure_database_indexes():
+    """
+    db.create_all() skips tables that already exist, so indexes added to existing
+    models later would never reach an older database. Create any that are missing.
+    """
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+
+def ensure_conversation_columns():
+    """
+    Message and PrivateChat gained conversation_id after they shipped. Add it to older
+    databases and fill it in; must run before ensure_database_indexes() builds its index.
+    """
+    inspector = db.inspect(db.engine)
+    for table in ('message', 'private_chat'):
+        if table not in inspector.get_table_names():
+            continue
+        if 'conversation_id' not in {column['name'] for column in inspector.get_columns(table)}:
+            with db.engine.begin() as conn:
+                conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN conversation_id VARCHAR(40)")
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql(
+                f"UPDATE {table} SET conversation_id = "
+                "CAST(CASE WHEN sender_id < recipient_id THEN sender_id ELSE recipient_id END AS VARCHAR(20)) || ':' || "
+                "CAST(CASE WHEN sender_id < recipient_id THEN recipient_id ELSE sender_id END AS VARCHAR(20)) "
+                "WHERE conversation_id IS NULL"
+            )
+
+
+def ensure_chat_envelope_columns():
+    """
+    PrivateChat gained the binary envelope columns (and message_uid) after it shipped. Existing rows get
+    envelope_version 0 (JSON text) until `flask migrate-chat-envelopes` converts them.
+    """
+    inspector = db.inspect(db.engine)
+    if 'private_chat' not in inspector.get_table_names():
+        return
+    columns = {column['name'] for column in inspector.get_columns('private_chat')}
+    with db.engine.begin() as conn:
+        if 'ciphertext' not in columns:
+            conn.exec_driver_sql("ALTER TABLE private_chat ADD COLUMN ciphertext BLOB")
+        if 'nonce' not in columns:
+            conn.exec_driver_sql("ALTER TABLE private_chat ADD COLUMN nonce BLOB")
+        if 'envelope_version' not in columns:
+            conn.exec_driver_sql(f"ALTER TABLE private_chat ADD COLUMN envelope_version SMALLINT NOT NULL DEFAULT {CHAT_ENVELOPE_LEGACY}")
+        if 'message_uid' not in columns:
+            conn.exec_driver_sql("ALTER TABLE private_chat ADD COLUMN message_uid VARCHAR(32)")
+
+
+def ensure_project_submission_dates():
+    """
+    Rows stored before submission_date was set in Python hold SQLite's 'YYYY-MM-DD HH:MM:SS'.
+    Pad them to the '.ffffff' form SQLAlchemy binds, so keyset comparisons on the column line up.
+    """
+    if db.engine.dialect.name != 'sqlite' or 'project_idea' not in db.inspect(db.engine).get_table_names():
+        return
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql("UPDATE project_idea SET submission_date = submission_date || '.000000' WHERE length(submission_date) = 19")
+
+
+def ensure_tag_project_count_column():
+    """Tag.project_count was added after the tag table shipped; create_all won't add it to an existing table."""
+    columns = {column['name'] for column in db.inspect(db.engine).get_columns('tag')}
+    if 'project_count' not in columns:
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql("ALTER TABLE tag ADD COLUMN project_count INTEGER NOT NULL DEFAULT 0")
+
+
+def ensure_outbound_email_columns():
+    """OutboundEmail.claimed_by was added after the queue shipped."""
+    inspector = db.inspect(db.engine)
+    if 'outbound_email' not in inspector.get_table_names():
+        return
+    if 'claimed_by' not in {column['name'] for column in inspector.get_columns('outbound_email')}:
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql("ALTER TABLE outbound_email ADD COLUMN claimed_by VARCHAR(64)")
+
+
+def ensure_publication_job_columns():
+    """PublicationNotificationJob gained its resume cursor and heartbeat after it shipped."""
+    inspector = db.inspect(db.engine)
+    if 'publication_notification_job' not in inspector.get_table_names():
+        return
+    columns = {column['name'] for column in inspector.get_columns('publication_notification_job')}
+    with db.engine.begin() as conn:
+        if 'last_user_id' not in columns:
+            conn.exec_driver_sql("ALTER TABLE publication_notification_job ADD COLUMN last_user_id INTEGER NOT NULL DEFAULT 0")
+        if 'attempts' not in columns:
+            conn.exec_driver_sql("ALTER TABLE publication_notification_job ADD COLUMN attempts INTEGER NOT NULL DEFAULT 1")
+            # Older jobs that stopped part-way have no cursor; resuming them from the start would notify people twice
+            conn.exec_driver_sql(f"UPDATE publication_notification_job SET attempts = {NOTIFY_MAX_ATTEMPTS} "
+                                 "WHERE status != 'fanned_out' AND notifications_created > 0")
+        if 'claimed_at' not in columns:
+            conn.exec_driver_sql("ALTER TABLE publication_notification_job ADD COLUMN claimed_at DATETIME")
+
+
+def prepare_database():
+    """
+    Creates missing tables and applies the in-place upgrades above. Safe to run on every
+    start; a lock file makes worker processes starting together take turns. Needs an app context.
+    """
+    os.makedirs(app.instance_path, exist_ok=True)
+    with open(os.path.join(app.instance_path, 'schema.lock'), 'a') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX) # Released when the file is closed
+        db.create_all()
+        ensure_conversation_columns()
+        ensure_chat_envelope_columns()
+        ensure_database_indexes()
+        ensure_tag_project_count_column()
+        ensure_project_submission_dates()
+        ensure_outbound_email_columns()
+        ensure_publication_job_columns()
+        ensure_course_search_index()
+        ensure_project_search_index()
+
+
+_database_ready = False
+_database_ready_lock = threading.Lock()
+
+
+def ensure_database_ready():
+    """prepare_database() once per process, whichever server started it (python app.py, flask run, gunicorn)."""
+    global _database_ready
+    if _database_ready:
+        return
+    with _database_ready_lock:
+        if not _database_ready:
+            prepare_database()
+            _database_ready = True
+
+
+_background_started = False
+
+
+def start_background_services():
+    """
+    Starts the email sender, the publication notifier and the chat write-behind once per serving
+    process, so windows that open after a restart get announced and journaled chat messages reach
+    PrivateChat under any server. Not called from the reloader's watcher process or CLI commands,
+    which never serve requests.
+    """
+    global _background_started
+    if _background_started:
+        return
+    with _database_ready_lock:
+        if _background_started:
+            return
+        _background_started = True
+    email_worker.wake() # Sends anything left in the queue from before a restart
+    publication_notifier.wake()
+    try:
+        chat_write_behind.start() # Replays chat messages journaled before a crash
+    except Exception as e:
+        print(f"Chat write-behind could not start: {e}") # Sends fail with the same error until it can
+
+
+@app.before_request
+def prepare_process():
+    ensure_database_ready()
+    start_background_services()
+
+
+@app.cli.command('init-db')
+def init_db():
+    """Creates tables and applies schema upgrades (what the first request would otherwise do)."""
+    ensure_database_ready()
+    click.echo('Database tables created or already exist!')
+
+
 if __name__ == '__main__':
     # Context manager needed for Flask extensions like SQLAlchemy to work outside of a request
     with app.app_context():
         # CRITICAL: Create all database tables based on the models defined in your app.
         # This line should typically be run just once when setting up the environment.
-        db.create_all() 
+        ensure_database_ready()
         print("Database tables created or already exist!")
-        
-    # Start the Flask development server
-    app.run(debug=True)
+    # debug=True runs the Werkzeug reloader: this process only watches files and re-runs
+    # the script as a child (WERKZEUG_RUN_MAIN=true) that serves requests. Background
+    # workers belong in the child; the chat journal's lock can only have one owner.
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_services()
+
+    # Start the server; socketio.run serves both HTTP and the Socket.IO gateway.
+    # PORT lets several workers run side by side (see SOCKETIO_MESSAGE_QUEUE).
+    socketio.run(app, debug=True, port=int(os.environ.get('PORT', 5000)))
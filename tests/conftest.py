@@ -0,0 +1,23 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The app binds its database when imported, so point it at a scratch file first
+_scratch = tempfile.mkdtemp(prefix='palgunn-tests-')
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(_scratch, 'test.db'))
+os.environ.setdefault('CHAT_JOURNAL_DIR', _scratch)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as palgunn  # noqa: E402
+
+
+@pytest.fixture
+def app_module():
+    """The app module inside an app context, on freshly created tables."""
+    with palgunn.app.app_context():
+        palgunn.db.drop_all()
+        palgunn.db.create_all()
+        yield palgunn
+        palgunn.db.session.remove()
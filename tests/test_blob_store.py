@@ -0,0 +1,60 @@
+import io
+import os
+
+from werkzeug.datastructures import FileStorage
+
+
+def upload(m, data, name='a.bin'):
+    return m.save_upload_blob(FileStorage(io.BytesIO(data), filename=name))
+
+
+def test_file_is_removed_with_its_last_reference(app_module, tmp_path, monkeypatch):
+    m = app_module
+    monkeypatch.setitem(m.BLOB_FOLDERS, 'uploads', str(tmp_path))
+    data = os.urandom(4096)
+    first, second = upload(m, data), upload(m, data, 'b.bin')
+    m.db.session.commit()
+    path = tmp_path / first
+
+    assert first == second
+    assert m.StoredBlob.query.one().ref_count == 2
+
+    m.release_blob(first)
+    m.db.session.commit()
+    assert path.exists()
+    assert m.StoredBlob.query.one().ref_count == 1
+
+    m.release_blob(first)
+    m.db.session.commit()
+    assert not path.exists()
+    assert m.StoredBlob.query.count() == 0
+    assert [name for name in os.listdir(tmp_path) if name.startswith('.upload-')] == []
+
+
+def test_releasing_an_unknown_file_is_a_no_op(app_module):
+    m = app_module
+    m.release_blob('legacy.png')
+    m.db.session.commit()
+    assert m.StoredBlob.query.count() == 0
+
+
+def test_rollback_keeps_a_file_another_upload_commits(app_module, tmp_path, monkeypatch):
+    m = app_module
+    monkeypatch.setitem(m.BLOB_FOLDERS, 'uploads', str(tmp_path))
+    data = os.urandom(4096)
+    name = upload(m, data)
+    path = tmp_path / name
+    # A concurrent upload of the same content found the file in place and kept its own copy
+    copy = tmp_path / '.upload-concurrent'
+    copy.write_bytes(data)
+    other = m.db.session.session_factory()
+    other.info['blob_copies'] = [('uploads', name, str(copy))]
+
+    m.db.session.rollback()
+    assert not path.exists()
+
+    other.add(m.StoredBlob(folder='uploads', filename=name, sha256=name, size=len(data), ref_count=1))
+    other.commit()
+    other.close()
+    assert path.read_bytes() == data
+    assert not copy.exists()
@@ -0,0 +1,77 @@
+import os
+
+
+def write_journal(m, path, messages, tail=b''):
+    with open(path, 'wb') as journal:
+        for message in messages:
+            journal.write(m.encode_chat_journal_record(message))
+        journal.write(tail)
+
+
+def test_journal_is_replayed_when_the_process_starts_serving(app_module, tmp_path, monkeypatch):
+    m = app_module
+    journal_path = tmp_path / 'chat-journal.bin'
+    message = m.new_chat_message(1, 2, b'ciphertext', bytes(m.CHAT_NONCE_BYTES))
+    write_journal(m, journal_path, [message])
+    monkeypatch.setattr(m, 'chat_write_behind', m.ChatWriteBehind(m.ChatJournal(str(tmp_path), 'chat-journal.bin')))
+    monkeypatch.setattr(m, '_background_started', False)
+    monkeypatch.setattr(m.email_worker, 'wake', lambda: None)
+    monkeypatch.setattr(m.publication_notifier, 'wake', lambda: None)
+
+    m.app.test_client().get('/no-such-page') # Any request starts the serving process's services
+
+    assert [row.message_uid for row in m.PrivateChat.query.all()] == [message['message_uid']]
+    assert os.path.getsize(journal_path) == 0
+
+
+def test_replay_stops_at_a_torn_tail(app_module, tmp_path):
+    m = app_module
+    messages = [m.new_chat_message(1, 2, f'ciphertext {i}'.encode(), bytes(m.CHAT_NONCE_BYTES)) for i in range(3)]
+    torn = m.encode_chat_journal_record(m.new_chat_message(1, 2, b'cut short', bytes(m.CHAT_NONCE_BYTES)))
+    write_journal(m, tmp_path / 'chat-journal.bin', messages, tail=torn[:len(torn) // 2]) # Crash mid-write
+
+    replayed = m.ChatWriteBehind(m.ChatJournal(str(tmp_path), 'chat-journal.bin')).replay()
+
+    assert replayed == 3
+    assert sorted(row.message_uid for row in m.PrivateChat.query) == sorted(message['message_uid'] for message in messages)
+
+
+def test_replay_skips_messages_already_flushed(app_module, tmp_path):
+    m = app_module
+    messages = [m.new_chat_message(1, 2, f'ciphertext {i}'.encode(), bytes(m.CHAT_NONCE_BYTES)) for i in range(4)]
+    # The first two reached the database before the crash, but the journal was not truncated yet
+    m.db.session.execute(m._private_chat_insert_ignore(), messages[:2])
+    m.db.session.commit()
+    write_journal(m, tmp_path / 'chat-journal.bin', messages)
+
+    m.ChatWriteBehind(m.ChatJournal(str(tmp_path), 'chat-journal.bin')).replay()
+    write_journal(m, tmp_path / 'chat-journal.bin', messages) # And again, as after a second crash
+    m.ChatWriteBehind(m.ChatJournal(str(tmp_path), 'chat-journal.bin')).replay()
+
+    assert m.PrivateChat.query.count() == 4
+
+
+def test_message_that_cannot_be_journaled_is_not_relayed(app_module, monkeypatch):
+    m = app_module
+    for i in (1, 2):
+        m.db.session.add(m.User(fullname=f'U{i}', email=f'u{i}@x.com', regno=f'R{i}', phone='1', password='x'))
+    m.db.session.commit()
+    clients = []
+    for user_id in (1, 2):
+        http = m.app.test_client()
+        with http.session_transaction() as session:
+            session['user_id'] = user_id
+        clients.append(m.socketio.test_client(m.app, flask_test_client=http))
+    sender, recipient = clients
+
+    def journal_in_use(message):
+        raise RuntimeError('chat-journal.bin is in use by another process')
+    monkeypatch.setattr(m.chat_write_behind, 'enqueue', journal_in_use)
+    recipient.get_received()
+
+    ack = sender.emit('send_encrypted_message', {
+        'recipient_id': 2, 'encrypted_message': {'ciphertext': b'x' * 40, 'nonce': bytes(m.CHAT_NONCE_BYTES)},
+    }, callback=True)
+
+    assert ack['ok'] is False
+    assert [packet['name'] for packet in recipient.get_received()] == []
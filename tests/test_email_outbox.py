@@ -0,0 +1,23 @@
+from datetime import datetime, timedelta
+
+
+def queue(m, to, status='queued'):
+    email = m.OutboundEmail(to_address=to, subject='s', body='b', status=status,
+                            next_attempt_at=datetime.utcnow() - timedelta(seconds=1))
+    m.db.session.add(email)
+    return email
+
+
+def test_claim_batch_takes_only_due_queued_mail(app_module):
+    m = app_module
+    queue(m, 'a@x.y')
+    queue(m, 'b@x.y')
+    queue(m, 'c@x.y', status='sent')
+    m.db.session.commit()
+    worker, other = m.EmailWorker(), m.EmailWorker()
+
+    claimed = worker._claim_batch()
+
+    assert [email.to_address for email in claimed] == ['a@x.y', 'b@x.y']
+    assert all(email.status == 'sending' and email.claimed_by == worker.token for email in claimed)
+    assert other._claim_batch() == []
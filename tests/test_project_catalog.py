@@ -0,0 +1,62 @@
+from datetime import datetime
+
+
+def walk_catalog(m, limit):
+    ids, cursor = [], None
+    for _ in range(100):
+        projects, cursor = m.project_catalog_page(m.project_catalog_query(include_private=True), cursor, limit=limit)
+        ids.extend(project.id for project in projects)
+        if cursor is None:
+            return ids
+    raise AssertionError('pagination never reached the last page')
+
+
+def test_every_page_is_visited_once(app_module):
+    m = app_module
+    second = datetime(2025, 3, 1, 12, 0, 0)
+    for i in range(25):
+        # Several projects per second, as a bulk import would produce
+        m.db.session.add(m.ProjectIdea(title=f'P{i}', description='d', contact_email='a@b.c',
+                                       submission_date=second.replace(second=i // 4)))
+    m.db.session.commit()
+
+    ids = walk_catalog(m, limit=4)
+
+    expected = [project.id for project in m.ProjectIdea.query.order_by(m.ProjectIdea.submission_date.desc(), m.ProjectIdea.id.desc())]
+    assert ids == expected
+    assert len(set(ids)) == 25
+
+
+def test_rows_stamped_by_sqlite_are_paginated_after_upgrade(app_module):
+    m = app_module
+    with m.db.engine.begin() as conn:
+        for i in range(12):
+            conn.exec_driver_sql(
+                "INSERT INTO project_idea (title, description, contact_email, submission_date, visibility) "
+                "VALUES (?, 'd', 'a@b.c', '2025-03-01 12:00:00', 'public')", (f'Legacy {i}',)
+            )
+    m.db.session.add(m.ProjectIdea(title='New', description='d', contact_email='a@b.c'))
+    m.db.session.commit()
+    m.ensure_project_submission_dates()
+
+    ids = walk_catalog(m, limit=5)
+
+    assert len(ids) == 13
+    assert len(set(ids)) == 13
+
+
+def test_search_limit_applies_to_visible_projects_only(app_module):
+    m = app_module
+    for i in range(3):
+        m.db.session.add(m.ProjectIdea(title=f'Solar dryer {i}', description='solar solar solar', contact_email='a@b.c',
+                                       visibility='private', user_id=99))
+    public = m.ProjectIdea(title='Solar pump', description='d', contact_email='a@b.c', visibility='public')
+    m.db.session.add(public)
+    m.db.session.commit()
+    if not m.ensure_project_search_index(rebuild=True):
+        return # No FTS5 in this SQLite build
+
+    ids, snippets = m.search_project_ideas('solar', viewer_id=1, limit=2)
+
+    assert ids == [public.id]
+    assert set(snippets) == {public.id}
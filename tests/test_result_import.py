@@ -0,0 +1,27 @@
+import io
+
+from werkzeug.datastructures import FileStorage
+
+
+def sheet(text):
+    return FileStorage(io.BytesIO(text.encode()), filename='results.csv')
+
+
+def import_rows(m, text):
+    report = m.new_result_import_report()
+    students = list(m.validate_result_rows(m.iter_result_sheet_rows(sheet(text)), report))
+    return students, report
+
+
+def test_header_row_is_skipped(app_module):
+    students, report = import_rows(app_module, 'Student Name,Reg No,CA Score,Exam Score\nAda,REG1,20,50\n')
+    assert [s['reg_number'] for s in students] == ['REG1']
+    assert report['processed'] == 1
+    assert report['errors'] == []
+
+
+def test_bad_first_data_row_is_reported_not_dropped(app_module):
+    students, report = import_rows(app_module, 'Ada,REG1,2O,50\nBayo,REG2,20,50\n')
+    assert [s['reg_number'] for s in students] == ['REG2']
+    assert report['skipped'] == 1
+    assert [issue['entry'] for issue in report['errors']] == [1]
@@ -0,0 +1,33 @@
+import time
+from datetime import timedelta
+
+
+def test_prewarm_is_refreshed_before_entries_age_out(app_module, monkeypatch):
+    m = app_module
+    cache = m.StudentResultsSurgeCache()
+    prewarms = []
+    monkeypatch.setattr(cache, 'prewarm', prewarms.append)
+    now = m.lagos_now()
+    clock = [now]
+    monkeypatch.setattr(m, 'lagos_now', lambda: clock[0])
+    open_windows = {(1, '2024/2025'): {'publish_end': now + timedelta(hours=6)}}
+
+    def wait_for_prewarms(count):
+        deadline = time.monotonic() + 5
+        while len(prewarms) < count or cache._prewarms_running:
+            assert time.monotonic() < deadline, 'prewarm did not run'
+            time.sleep(0.01)
+
+    cache.get(1, open_windows)
+    wait_for_prewarms(1)
+    clock[0] = now + cache.MAX_AGE / 4
+    cache.get(1, open_windows)
+    time.sleep(0.05)
+    assert len(prewarms) == 1 # Still fresh
+
+    clock[0] = now + cache.MAX_AGE / 2
+    cache.get(1, open_windows)
+    wait_for_prewarms(2)
+
+    cache.put(1, {'results': []}, open_windows, cache.generation())
+    assert cache.get(1, open_windows) == {'results': []}
@@ -0,0 +1,29 @@
+def test_tag_created_concurrently_is_reused(app_module):
+    m = app_module
+    idea = m.ProjectIdea(title='P', description='d', contact_email='a@b.c')
+    m.db.session.add(idea)
+    m.db.session.commit()
+
+    racing = [True]
+
+    def create_tag_after_lookup(state):
+        # Another request commits the same new tag right after this request looked it up
+        if not (racing and state.is_select and 'lower(tag.name)' in str(state.statement)):
+            return None
+        racing.clear()
+        result = state.invoke_statement().freeze()
+        with m.db.engine.begin() as conn:
+            conn.exec_driver_sql("INSERT INTO tag (name, project_count) VALUES ('Robotics', 0)")
+        return result()
+
+    m.db.event.listen(m.db.session, 'do_orm_execute', create_tag_after_lookup)
+    try:
+        m.set_project_tags(idea, ['Robotics'])
+        m.db.session.commit()
+    finally:
+        m.db.event.remove(m.db.session, 'do_orm_execute', create_tag_after_lookup)
+
+    tag = m.Tag.query.one()
+    assert tag.name == 'Robotics'
+    assert tag.project_count == 1
+    assert [t.name for t in idea.tags] == ['Robotics']
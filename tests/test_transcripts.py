@@ -0,0 +1,24 @@
+from sqlalchemy import inspect
+
+
+def add_result(m, course, reg_number, grade='A'):
+    m.db.session.add(m.StudentResult(course_id=course.id, student_name=reg_number, reg_number=reg_number,
+                                     ca_score=30, exam_score=50, total_score=80, grade=grade))
+
+
+def test_missing_transcripts_are_rebuilt_without_expiring_loaded_ones(app_module):
+    m = app_module
+    course = m.Course(course_code='CSC101', course_title='Intro', session_written='2024/2025', year='1', semester='First')
+    m.db.session.add(course)
+    m.db.session.flush()
+    add_result(m, course, 'REG1')
+    add_result(m, course, 'REG2', grade='B')
+    m.refresh_student_transcripts(['REG1'])
+    m.db.session.commit()
+
+    transcripts = m.load_student_transcripts(['REG1', 'REG2'])
+
+    assert not inspect(transcripts['REG1'][0]).expired
+    assert [t.reg_number for t in transcripts['REG1']] == ['REG1']
+    assert m.StudentTranscript.query.filter_by(reg_number='REG2').count() == 1
+    assert transcripts['REG2'][0].cgpa == m.calculate_gpa(['B'])
@@ -0,0 +1,27 @@
+import io
+import os
+
+
+def upload_temp_files(m):
+    return sorted(name for name in os.listdir(m.BLOB_FOLDERS['project_uploads']) if name.startswith('.upload-'))
+
+
+def test_oversized_second_file_leaves_no_temp_files(app_module):
+    m = app_module
+    m.db.session.add(m.User(fullname='U', email='u@x.com', regno='R1', phone='1', password='x'))
+    m.db.session.commit()
+    before = upload_temp_files(m)
+    client = m.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+
+    limit = m.UPLOAD_STREAM_RULES['upload_project'][1]
+    response = client.post('/upload', data={
+        'projectTitle': 'Too big', 'projectDescription': 'd' * 60, 'keyInnovations': 'k',
+        'contactEmail': 'u@x.com', 'visibility': 'public',
+        'supportingFiles': [(io.BytesIO(b'small file ' * 100), 'a.txt'), (io.BytesIO(b'x' * (limit + 1)), 'b.txt')],
+    }, content_type='multipart/form-data')
+
+    assert response.status_code in (302, 413)
+    assert upload_temp_files(m) == before
+    assert m.ProjectIdea.query.count() == 0